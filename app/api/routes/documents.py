@@ -1,62 +1,179 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
 import uuid
 
-from app.db.database import get_db
-from app.db.crud import DocumentRepository, ChunkRepository
-from app.schemas.document import DocumentCreate, DocumentResponse
-from app.core.document_processor import DocumentProcessor
+from app.config import settings
+from app.dependencies import get_db
+from app.db.crud import DocumentRepository, IngestionJobRepository
+from app.db.pagination import next_cursor
+from app.schemas.document import (
+    DocumentCreate,
+    DocumentResponse,
+    EmbeddingCacheStats,
+    IngestionJobResponse
+)
+from app.core.embedding_cache import embedding_cache
+from app.core.ingestion import (
+    ingestion_worker,
+    IngestionQueueFull,
+    spool_path_for,
+    spool_upload,
+    remove_spooled_upload
+)
+from app.core.bulk_ingest import bulk_spool_path_for, spool_bulk_uploads
+from app.core.vector_index import vector_index
+from app.core.lexical_index import lexical_index
 
 router = APIRouter()
-document_processor = DocumentProcessor()
 
-@router.post("/", response_model=DocumentResponse)
+@router.post("/", response_model=IngestionJobResponse, status_code=202)
 async def upload_document(
     file: UploadFile = File(...),
     title: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    # UPLOAD DOC AND PROCESS IT
+    # UPLOAD DOC AND QUEUE IT FOR PROCESSING
     if not file.filename.endswith(('.txt', '.md')):
         raise HTTPException(
             status_code=400,
             detail="Only .txt and .md files are supported"
         )
     
-    # READ FILE CONTENT
-    content = await file.read()
-    text_content = content.decode('utf-8')
+    if ingestion_worker.is_full():
+        raise HTTPException(
+            status_code=503,
+            detail="Too many documents are being processed, try again later"
+        )
     
-    # CREATE DOC IN DB
-    document = DocumentCreate(title=title, content=text_content)
-    db_document = DocumentRepository.create_document(db, document)
+    # CREATE DOC IN DB -- THE TEXT ITSELF ONLY LIVES IN ITS CHUNKS
+    document = DocumentCreate(title=title)
+    db_document = await DocumentRepository.acreate_document(db, document)
     
-    # PROCESS DOC
-    chunks_data = document_processor.process_document(text_content, db_document.id)
+    # SPOOL THE UPLOAD TO DISK WITHOUT READING IT INTO MEMORY, THEN QUEUE ITS JOB
+    # ON ANY FAILURE THE DOCUMENT AND THE SPOOL FILE GO AGAIN -- NO JOB WOULD EVER FILL OR REMOVE THEM
+    source_path = spool_path_for(db_document.id)
+    try:
+        await run_in_threadpool(spool_upload, file.file, source_path)
+        job = await IngestionJobRepository.acreate_job(db, db_document.id, source_path=source_path)
+    except Exception as exc:
+        remove_spooled_upload(source_path)
+        await DocumentRepository.adelete_document(db, db_document.id)
+        if isinstance(exc, UnicodeDecodeError):
+            raise HTTPException(
+                status_code=400,
+                detail="File must be UTF-8 encoded text"
+            )
+        raise
     
-    # STORE CHUNKS IN DB
-    ChunkRepository.create_chunks(db, db_document.id, chunks_data)
+    # CHUNKING AND EMBEDDING RUN IN THE BACKGROUND
+    try:
+        ingestion_worker.submit(job.id)
+    except IngestionQueueFull:
+        remove_spooled_upload(source_path)
+        await IngestionJobRepository.aupdate_job(
+            db, job.id, status="failed", error="Ingestion queue is full", source_path=None
+        )
+        raise HTTPException(
+            status_code=503,
+            detail="Too many documents are being processed, try again later"
+        )
     
-    return db_document
+    return job
+
+
+@router.post("/bulk", response_model=IngestionJobResponse, status_code=202)
+async def upload_documents_bulk(
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db)
+):
+    # .txt/.md FILES AND ZIP/TAR ARCHIVES OF THEM -- EACH TEXT FILE BECOMES A DOCUMENT TITLED BY ITS PATH
+    # SPOOLED AND QUEUED AS A "bulk" JOB -- GET /jobs/{id} SHOWS ITS PROGRESS, AND ITS result THE
+    # PER-FILE RESULTS AND THROUGHPUT (EVERY BULK_INGEST_INDEX_BATCH_FILES FILES, FINAL ONCE COMPLETED)
+    if ingestion_worker.is_full():
+        raise HTTPException(
+            status_code=503,
+            detail="Too many documents are being processed, try again later"
+        )
+
+    source_path = bulk_spool_path_for(uuid.uuid4())
+    uploads = [(file.filename or "upload", file.file) for file in files]
+    try:
+        await run_in_threadpool(spool_bulk_uploads, uploads, source_path, settings.BULK_INGEST_MAX_UPLOAD_BYTES)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=413,
+            detail=str(exc)
+        )
+
+    try:
+        job = await IngestionJobRepository.acreate_job(db, None, source_path=source_path, kind="bulk")
+    except Exception:
+        remove_spooled_upload(source_path)
+        raise
+    try:
+        ingestion_worker.submit(job.id)
+    except IngestionQueueFull:
+        remove_spooled_upload(source_path)
+        await IngestionJobRepository.aupdate_job(
+            db, job.id, status="failed", error="Ingestion queue is full", source_path=None
+        )
+        raise HTTPException(
+            status_code=503,
+            detail="Too many documents are being processed, try again later"
+        )
+
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=IngestionJobResponse)
+async def get_ingestion_job(
+    job_id: uuid.UUID,
+    db: AsyncSession = Depends(get_db)
+):
+    job = await IngestionJobRepository.aget_job(db, job_id)
+    if not job:
+        raise HTTPException(
+            status_code=404,
+            detail="Ingestion job not found"
+        )
+    return job
 
 
 @router.get("/", response_model=List[DocumentResponse])
-def get_documents(
-    skip: int = 0,
-    limit = 100,
-    db: Session = Depends(get_db)
+async def get_documents(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
-    documents = DocumentRepository.get_all_documents(db, skip=skip, limit=limit)
+    # NEWEST FIRST -- PASS THE X-Next-Cursor HEADER BACK AS cursor FOR THE NEXT PAGE
+    try:
+        documents = await DocumentRepository.aget_all_documents(db, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid cursor"
+        )
+    page_cursor = next_cursor(documents, limit)
+    if page_cursor:
+        response.headers["X-Next-Cursor"] = page_cursor
     return documents
 
 
+@router.get("/embedding-cache/stats", response_model=EmbeddingCacheStats)
+def get_embedding_cache_stats():
+    return embedding_cache.stats()
+
+
 @router.get("/{document_id}", response_model=DocumentResponse)
-def get_document(
+async def get_document(
     document_id: uuid.UUID,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    document = DocumentRepository.get_docuent(db, document_id)  
+    document = await DocumentRepository.aget_document(db, document_id)
     if not document:
         raise HTTPException(
             status_code=404,
@@ -64,15 +181,96 @@ def get_document(
         )
     return document
     
+@router.put("/{document_id}", response_model=IngestionJobResponse, status_code=202)
+async def update_document(
+    document_id: uuid.UUID,
+    file: UploadFile = File(...),
+    title: Optional[str] = Form(None),
+    db: AsyncSession = Depends(get_db)
+):
+    # REPLACE A DOCUMENT'S TEXT -- THE JOB ONLY EMBEDS CHUNKS WHOSE TEXT IS NOT STORED ALREADY
+    if not file.filename.endswith(('.txt', '.md')):
+        raise HTTPException(
+            status_code=400,
+            detail="Only .txt and .md files are supported"
+        )
+
+    document = await DocumentRepository.aget_document(db, document_id)
+    if not document:
+        raise HTTPException(
+            status_code=404,
+            detail="Document not found"
+        )
+
+    # ONE JOB AT A TIME PER DOCUMENT, EACH DIFFS AGAINST THE CHUNKS THE LAST ONE COMMITTED
+    # (A CHEAP EARLY CHECK -- THE UNIQUE INDEX ON UNFINISHED JOBS DECIDES A RACE BELOW)
+    if await IngestionJobRepository.ahas_unfinished_job(db, document_id):
+        raise HTTPException(
+            status_code=409,
+            detail="Document is still being processed, try again later"
+        )
+
+    if ingestion_worker.is_full():
+        raise HTTPException(
+            status_code=503,
+            detail="Too many documents are being processed, try again later"
+        )
+
+    # OWN SPOOL FILE PER UPDATE, A CONCURRENT PUT NEVER OVERWRITES IT
+    source_path = spool_path_for(uuid.uuid4())
+    try:
+        await run_in_threadpool(spool_upload, file.file, source_path)
+        job = await IngestionJobRepository.acreate_job(db, document_id, source_path=source_path)
+    except Exception as exc:
+        remove_spooled_upload(source_path)
+        if isinstance(exc, UnicodeDecodeError):
+            raise HTTPException(
+                status_code=400,
+                detail="File must be UTF-8 encoded text"
+            )
+        if isinstance(exc, IntegrityError):
+            raise HTTPException(
+                status_code=409,
+                detail="Document is still being processed, try again later"
+            )
+        raise
+    if title:
+        await DocumentRepository.aupdate_title(db, document_id, title)
+
+    try:
+        ingestion_worker.submit(job.id)
+    except IngestionQueueFull:
+        remove_spooled_upload(source_path)
+        await IngestionJobRepository.aupdate_job(
+            db, job.id, status="failed", error="Ingestion queue is full", source_path=None
+        )
+        raise HTTPException(
+            status_code=503,
+            detail="Too many documents are being processed, try again later"
+        )
+
+    return job
+
+
 @router.delete("/{document_id}")
-def delete_document(
+async def delete_document(
     document_id: uuid.UUID,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    success = DocumentRepository.delete_document(db, document_id)
+    # THE JOBS GO WITH THE DOCUMENT -- THEIR UPLOADS WOULD OTHERWISE STAY IN THE SPOOL FOR GOOD
+    source_paths = await IngestionJobRepository.aget_unfinished_source_paths(db, document_id)
+    success = await DocumentRepository.adelete_document(db, document_id)
     if not success:
         raise HTTPException(
             status_code=400,
             detail="Document nor found"
         )
+    
+    # A WORKER STILL RUNNING ONE OF THE JOBS FINDS IT GONE AND DROPS ITS RESULT
+    for source_path in source_paths:
+        remove_spooled_upload(source_path)
+    
+    # DROP CHUNKS FROM THE IN-MEMORY INDEXES -- MAY COMPACT OR (SHARED) WRITE A GENERATION, SO OFF THE LOOP
+    await run_in_threadpool(vector_index.remove_document, document_id)
+    await run_in_threadpool(lexical_index.remove_document, document_id)
     return {"message": "Document deleted successfully"}
\ No newline at end of file
@@ -1,36 +1,36 @@
-from typing import List
+from typing import List, Dict, Any, Optional
 import json
-from fastapi import APIRouter, Depends, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
 import uuid
 
-from app.db.database import get_db
+from app.config import settings
+from app.dependencies import get_db, get_qa_chain, get_query_batcher
 from app.db.crud import QARepository
-from app.schemas.qa import QARequest, QAResponse, QAHistoryResponse
+from app.db.pagination import next_cursor
+from app.schemas.qa import (
+    QARequest, QABatchRequest, QAResponse, QAHistoryResponse, QueryCacheStats, QueryBatcherStats, QAHistoryWriterStats
+)
 from app.core.qa_chain import QAChain
-from app.core.retriever import VectorRetriever
+from app.core.embedding_cache import query_embedding_cache
+from app.core.query_batcher import QueryEmbeddingBatcher
+from app.core.history_writer import qa_history_writer
 
 router = APIRouter()
 
+
 @router.post("/ask", response_model=QAResponse)
 async def ask_question(
     qa_request: QARequest,
-    db: Session = Depends(get_db)
+    qa_chain: QAChain = Depends(get_qa_chain)
 ):
     if qa_request.stream:
-        return await stream_qa_response(qa_request, db)
-    
-    # CREATE RETRIEVER
-    retriever = VectorRetriever(db)
-    
-    # SETUP QA CHAIN
-    qa_chain = QAChain(retriever_fn=lambda q: retriever.retrieve(q))
+        return await stream_qa_response(qa_request, qa_chain)
     
-    # PROCESS QUESTION
-    result = qa_chain.run(qa_request.question)
+    # PROCESS QUESTION WITHOUT BLOCKING THE EVENT LOOP
+    result = await qa_chain.arun(qa_request.question)
     
     result["created_at"] = datetime.utcnow()
     result["id"] = uuid.uuid4()
@@ -42,59 +42,149 @@ async def ask_question(
     
     result.pop("chain_visualization", None)
     
-    # STORE QUESTION in the DB
-    QARepository.create_qa_record(
-        db=db,
-        question=qa_request.question,
-        answer=result["answer"],
-        chain_trace=result["chain_trace"]
-    )
+    # STORE QUESTION in the DB -- QUEUED, WRITTEN BEHIND THE RESPONSE
+    await qa_history_writer.submit(qa_history_writer.make_record(
+        qa_request.question,
+        result["answer"],
+        result["chain_trace"],
+        record_id=result["id"],
+        created_at=result["created_at"]
+    ))
     
     return result
 
 
-async def stream_qa_response(qa_request: QARequest, db: Session):
-    retriever = VectorRetriever(db)
-    qa_chain = QAChain(retriever_fn=lambda q: retriever.retrieve(q))
-    result = qa_chain.run(qa_request.question)
-    
-    async def save_record():
-        QARepository.create_qa_record(
-            db=db,
-            question=qa_request.question,
-            answer=result["answer"],
-            chain_trace=result["chain_visualization"].dict()
-        )
-    
-    background_tasks = BackgroundTasks()
-    background_tasks.add_task(save_record)
+async def stream_qa_response(qa_request: QARequest, qa_chain: QAChain):
+    # RETRIEVE BEFORE THE RESPONSE STARTS SO RETRIEVAL ERRORS STILL BECOME HTTP ERRORS
+    state = await qa_chain.astart_stream(qa_request.question)
     
     async def generate():
-        # First yield the chain visualization
+        # First yield the chain visualization up to the reasoning step
         yield json.dumps({
             "type": "chain_visualization",
-            "data": result["chain_visualization"].dict()
+            "data": qa_chain.get_visualization(state).dict()
         }) + "\n"
-        # Then stream the answer token by token
-        for token in result["answer"].split(" "):
-            await asyncio.sleep(0.05)
+        # Then forward answer tokens as the LLM produces them
+        async for token in qa_chain.astream_answer(state):
             yield json.dumps({
                 "type": "token",
-                "data": token + " "
+                "data": token
             }) + "\n"
+        # Finally yield the full trace including the answer node
+        chain_trace = qa_chain.get_visualization(state).dict()
+        yield json.dumps({
+            "type": "chain_visualization",
+            "data": chain_trace
+        }) + "\n"
+        
+        await qa_history_writer.submit(
+            qa_history_writer.make_record(qa_request.question, state.answer, chain_trace)
+        )
     
     return StreamingResponse(
         generate(),
-        media_type="application/x-ndjson",
-        background=background_tasks
+        media_type="application/x-ndjson"
+    )
+
+
+@router.post("/ask/batch")
+async def ask_questions(
+    batch_request: QABatchRequest,
+    qa_chain: QAChain = Depends(get_qa_chain)
+):
+    # NDJSON, ONE LINE PER QUESTION AS ITS ANSWER COMPLETES (WITH ITS INDEX IN THE REQUEST),
+    # THEN A "done" LINE -- HISTORY RECORDS GO THROUGH THE WRITE-BEHIND QUEUE IN BATCHED INSERTS
+    questions = batch_request.questions
+    if len(questions) > settings.QA_BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.QA_BATCH_MAX_QUESTIONS} questions per batch"
+        )
+    
+    async def generate():
+        answered = 0
+        failed = 0
+        async for index, result in qa_chain.arun_batch(
+            questions,
+            max_concurrency=settings.QA_BATCH_CONCURRENCY,
+            retrieval_batch_size=settings.QA_BATCH_RETRIEVAL_SIZE
+        ):
+            if isinstance(result, Exception):
+                failed += 1
+                yield json.dumps({
+                    "type": "error",
+                    "index": index,
+                    "data": {"question": questions[index], "detail": str(result)}
+                }) + "\n"
+                continue
+            
+            response = QAResponse(
+                id=uuid.uuid4(),
+                question=result["question"],
+                answer=result["answer"],
+                chain_trace=result["chain_visualization"].dict(),
+                created_at=datetime.utcnow()
+            )
+            answered += 1
+            await qa_history_writer.submit(response.dict())
+            yield json.dumps({
+                "type": "answer",
+                "index": index,
+                "data": response.model_dump(mode="json")
+            }) + "\n"
+        
+        yield json.dumps({
+            "type": "done",
+            "data": {"answered": answered, "failed": failed}
+        }) + "\n"
+    
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson"
     )
 
 
 @router.get("/history", response_model=List[QAHistoryResponse])
-def get_qa_history(
-    skip: int = 0,
-    limit: int = 20,
-    db: Session = Depends(get_db)
+async def get_qa_history(
+    response: Response,
+    limit: int = Query(20, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    include_trace: bool = False,
+    db: AsyncSession = Depends(get_db)
 ):
-    qa_records = QARepository.get_qa_history(db, skip=skip, limit=limit)
+    # NEWEST FIRST, SAME CURSOR SCHEME AS GET /documents/ -- chain_trace ONLY WITH include_trace
+    try:
+        qa_records = await QARepository.aget_qa_history(
+            db, limit=limit, cursor=cursor, include_trace=include_trace
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid cursor"
+        )
+    page_cursor = next_cursor(qa_records, limit)
+    if page_cursor:
+        response.headers["X-Next-Cursor"] = page_cursor
     return qa_records
+
+
+@router.get("/history/writer/stats", response_model=QAHistoryWriterStats)
+def get_qa_history_writer_stats():
+    return qa_history_writer.stats()
+
+
+@router.get("/query-cache/stats", response_model=QueryCacheStats)
+def get_query_cache_stats():
+    return query_embedding_cache.stats()
+
+
+@router.get("/query-batcher/stats", response_model=QueryBatcherStats)
+def get_query_batcher_stats(
+    query_batcher: Optional[QueryEmbeddingBatcher] = Depends(get_query_batcher)
+):
+    if query_batcher is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Query batching is disabled"
+        )
+    return query_batcher.stats()
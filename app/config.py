@@ -12,18 +12,111 @@ class Settings(BaseSettings):
     
     #DB
     DATABASE_URL: str = os.getenv("DATABASE_URL", "")
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
     
     # LLM SETTINGS
     OPENAI_API_KEY: str = os.getenv("DATABASE_URL", "")
     LLM_MODEL: str = os.getenv("OPENAI_API_KEY", "gpt-4o")
     EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+    OPENAI_BASE_URL: str = os.getenv("OPENAI_BASE_URL", "")  # EMPTY = PROVIDER DEFAULT
+    # TOKENIZE LOCALLY (tiktoken) AND SPLIT TEXTS OVER THE MODEL'S CONTEXT LENGTH BEFORE EMBEDDING
+    EMBEDDING_CHECK_CTX_LENGTH: bool = True
+    # OUTBOUND HTTP POOL SHARED BY THE EMBEDDINGS AND CHAT CLIENTS
+    OPENAI_MAX_CONNECTIONS: int = 100
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_KEEPALIVE_EXPIRY: float = 30.0
+    OPENAI_TIMEOUT_SECONDS: float = 60.0
     
     # DOCUMENT PROCESSING
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
+    EMBEDDING_BATCH_SIZE: int = 64
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+    EMBEDDING_CACHE_SIZE: int = 10000
+    EMBEDDING_CACHE_PERSISTENT: bool = True
+    
+    # INGESTION JOBS
+    INGESTION_WORKERS: int = 2
+    INGESTION_MAX_PENDING: int = 100
+    # A RUNNING JOB'S CLAIM, RENEWED EVERY QUARTER OF THIS -- AFTER IT LAPSES ANOTHER WORKER TAKES THE JOB OVER
+    INGESTION_JOB_LEASE_SECONDS: float = 120.0
+    UPLOAD_SPOOL_DIR: str = os.getenv("UPLOAD_SPOOL_DIR", "./data/uploads")
+    UPLOAD_READ_SIZE: int = 64 * 1024
+    # BULK UPLOADS (MANY FILES OR A ZIP/TAR) -- SPLITTING RUNS IN A PROCESS POOL, 0 = ONE PROCESS PER CPU
+    BULK_INGEST_SPLIT_PROCESSES: int = 0
+    BULK_INGEST_MAX_FILES: int = 10000
+    BULK_INGEST_MAX_FILE_BYTES: int = 20 * 1024 * 1024
+    # WHOLE REQUEST, AS SPOOLED TO DISK FOR ITS JOB
+    BULK_INGEST_MAX_UPLOAD_BYTES: int = 2 * 1024 * 1024 * 1024
+    # COMMITTED FILES ARE ADDED TO THE IN-MEMORY INDEXES THIS MANY AT A TIME
+    BULK_INGEST_INDEX_BATCH_FILES: int = 100
     
     # RETRIEVAL
     TOP_K_RETRIEVAL: int = 5
+    # "exact" OR "ivf" (APPROXIMATE, INVERTED FILE OVER k-MEANS CENTROIDS)
+    RETRIEVAL_INDEX: str = "exact"
+    IVF_NLIST: int = 0  # 0 = ~sqrt(number of chunks)
+    IVF_NPROBE: int = 16
+    IVF_TRAIN_ITERATIONS: int = 10
+    IVF_MIN_TRAIN_SIZE: int = 10000
+    IVF_RETRAIN_GROWTH: float = 2.0
+    # "none", "int8" OR "binary" -- QUANTIZED SHORTLISTS ARE RE-RANKED AT FULL PRECISION
+    RETRIEVAL_QUANTIZATION: str = "none"
+    RETRIEVAL_SHORTLIST_MULTIPLIER: int = 4
+    # COMPACT THE INDEX ONCE THIS SHARE OF ITS ROWS ARE DELETED
+    VECTOR_INDEX_COMPACT_RATIO: float = 0.2
+    # KEEP THE INDEX IN MEMORY-MAPPED FILES SHARED BY EVERY WORKER ON THE HOST
+    VECTOR_INDEX_SHARED: bool = False
+    VECTOR_INDEX_DIR: str = os.getenv("VECTOR_INDEX_DIR", "./data/vector_index")
+    # LOAD THE INDEXES AT STARTUP FROM A SAVED SNAPSHOT PLUS THE CHUNKS CHANGED SINCE, SAVE THEM ON SHUTDOWN
+    # (THE BM25 INDEX OF HYBRID AND LEXICAL MODES IS KEPT IN THE lexical/ SUBDIRECTORY)
+    VECTOR_INDEX_SNAPSHOT_ENABLED: bool = True
+    VECTOR_INDEX_SNAPSHOT_DIR: str = os.getenv("VECTOR_INDEX_SNAPSHOT_DIR", "./data/index_snapshot")
+    # "vector", "lexical" (BM25 ONLY) OR "hybrid" (BOTH, FUSED BY RECIPROCAL RANK)
+    RETRIEVAL_MODE: str = "hybrid"
+    RETRIEVAL_FUSION_DEPTH: int = 20
+    RRF_K: int = 60
+    BM25_K1: float = 1.2
+    BM25_B: float = 0.75
+    # SEGMENTS OF ONE SIZE TIER MERGED INTO ONE BY A BACKGROUND THREAD
+    LEXICAL_MERGE_FACTOR: int = 8
+    # HYBRID MODE ANSWERS FROM BM25 ALONE IF EMBEDDING THE QUERY FAILS OR TAKES LONGER
+    QUERY_EMBEDDING_TIMEOUT_SECONDS: float = 2.0
+    # COALESCE CONCURRENT QUERY EMBEDDINGS INTO ONE PROVIDER CALL
+    QUERY_BATCHING_ENABLED: bool = True
+    QUERY_BATCH_WINDOW_MS: float = 5.0
+    QUERY_BATCH_MAX_SIZE: int = 64
+    QUERY_CACHE_SIZE: int = 1024
+    QUERY_CACHE_TTL_SECONDS: float = 3600
+    
+    # BATCH QA (/qa/ask/batch)
+    QA_BATCH_MAX_QUESTIONS: int = 1000
+    QA_BATCH_CONCURRENCY: int = 8  # LLM GENERATIONS IN FLIGHT PER BATCH
+    QA_BATCH_RETRIEVAL_SIZE: int = 64  # QUESTIONS EMBEDDED AND SCORED TOGETHER
+    
+    # QA HISTORY -- WRITTEN BEHIND THE ANSWER, IN BATCHED INSERTS
+    QA_HISTORY_WRITE_BEHIND: bool = True
+    QA_HISTORY_QUEUE_SIZE: int = 10000
+    QA_HISTORY_BATCH_SIZE: int = 200
+    QA_HISTORY_FLUSH_INTERVAL_SECONDS: float = 1.0
+    # "block" (WAIT UP TO QA_HISTORY_BLOCK_TIMEOUT_SECONDS, THEN DROP), "drop_newest" OR "drop_oldest"
+    QA_HISTORY_FULL_POLICY: str = "block"
+    QA_HISTORY_BLOCK_TIMEOUT_SECONDS: float = 1.0
+    
+    # CONTEXT PACKING -- MERGE NEIGHBOURING CHUNKS, DROP NEAR-DUPLICATES, FIT A TOKEN BUDGET
+    CONTEXT_PACKING_ENABLED: bool = True
+    CONTEXT_TOKEN_BUDGET: int = 3000
+    CONTEXT_MMR_LAMBDA: float = 0.7
+    CONTEXT_DUPLICATE_THRESHOLD: float = 0.8  # SHARE OF WORD SHINGLES ALREADY IN THE CONTEXT
+    TOKENIZER_ENCODING: str = ""  # EMPTY = tiktoken ENCODING OF LLM_MODEL
+    
+    # OBSERVABILITY
+    # STAGE HISTOGRAMS SERVED FROM /metrics -- QA TRACES CARRY THEIR OWN TIMINGS EITHER WAY
+    METRICS_ENABLED: bool = True
     
 settings = Settings()
     
\ No newline at end of file
@@ -0,0 +1,151 @@
+from typing import List, Optional
+import numpy as np
+
+# ROWS SCORED AGAINST THE CENTROIDS AT A TIME, BOUNDS THE (rows x nlist) SCRATCH MATRIX
+ASSIGN_BLOCK_SIZE = 8192
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    # POSITIONS OF THE k HIGHEST SCORES, BEST FIRST
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(n)
+    return top[np.argsort(-scores[top])]
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # NEAREST CENTROID (BY INNER PRODUCT) FOR EVERY ROW
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_SIZE):
+        block = vectors[start:start + ASSIGN_BLOCK_SIZE]
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors: np.ndarray,
+                    nlist: int,
+                    iterations: int = 10,
+                    max_points_per_centroid: int = 256,
+                    seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means over a sample of the (already normalized) vectors.
+
+    Args:
+        vectors: Normalized float32 rows to cluster
+        nlist: Number of centroids
+        iterations: Lloyd iterations
+        max_points_per_centroid: Caps the training sample at nlist * this many rows
+        seed: Seed for sampling and initialization
+
+    Returns:
+        A (nlist, dim) float32 matrix of normalized centroids
+    """
+
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    nlist = max(1, min(nlist, n))
+
+    sample_size = min(n, nlist * max_points_per_centroid)
+    sample = vectors[np.sort(rng.choice(n, sample_size, replace=False))] if sample_size < n else vectors
+    centroids = np.array(sample[rng.choice(len(sample), nlist, replace=False)], dtype=np.float32)
+
+    for _ in range(iterations):
+        labels = assign_to_centroids(sample, centroids)
+
+        # SUM MEMBERS PER CLUSTER WITH ONE SORT + reduceat INSTEAD OF A PYTHON LOOP
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[non_empty]
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+
+        centroids[non_empty] = sums
+        # RESEED EMPTY CLUSTERS FROM RANDOM SAMPLE POINTS
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids /= norms
+
+    return centroids
+
+
+class IVFLists:
+
+    # IMMUTABLE INVERTED-FILE STRUCTURE: COARSE CENTROIDS PLUS, FOR EACH CENTROID,
+    # THE ROW POSITIONS ASSIGNED TO IT. UPDATES RETURN A NEW INSTANCE THAT SHARES
+    # EVERY UNTOUCHED LIST WITH THE OLD ONE
+
+    __slots__ = ("centroids", "lists", "trained_size")
+
+    def __init__(self, centroids: np.ndarray, lists: List[np.ndarray], trained_size: int):
+        self.centroids = centroids
+        self.lists = lists
+        self.trained_size = trained_size
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, nlist: int, iterations: int) -> "IVFLists":
+        centroids = train_centroids(vectors, nlist, iterations)
+        labels = assign_to_centroids(vectors, centroids)
+        return cls(centroids, cls._group(labels, len(centroids)), len(vectors))
+
+    @staticmethod
+    def _group(labels: np.ndarray, nlist: int, offset: int = 0) -> List[np.ndarray]:
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(nlist + 1))
+        return [order[bounds[i]:bounds[i + 1]] + offset for i in range(nlist)]
+
+    def with_appended(self, vectors: np.ndarray, first_row: int) -> "IVFLists":
+        # ASSIGN NEW ROWS first_row .. first_row + len(vectors) TO THEIR NEAREST LISTS
+        labels = assign_to_centroids(vectors, self.centroids)
+        lists = list(self.lists)
+        for label in np.unique(labels):
+            rows = np.flatnonzero(labels == label) + first_row
+            lists[label] = np.concatenate([lists[label], rows])
+        return IVFLists(self.centroids, lists, self.trained_size)
+
+    def with_remapped(self, keep: np.ndarray) -> "IVFLists":
+        # APPLY A ROW COMPACTION: keep IS THE BOOLEAN MASK OF SURVIVING ROWS
+        remap = np.full(len(keep), -1, dtype=np.int64)
+        remap[keep] = np.arange(int(keep.sum()))
+        lists = []
+        for rows in self.lists:
+            rows = remap[rows]
+            lists.append(rows[rows >= 0])
+        return IVFLists(self.centroids, lists, self.trained_size)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        # ROW POSITIONS IN THE nprobe LISTS WHOSE CENTROIDS ARE CLOSEST TO THE QUERY
+        probe = top_k_indices(self.centroids @ query, nprobe)
+        if not len(probe):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self.lists[i] for i in probe])
+
+
+def default_nlist(n: int) -> int:
+    # COMMON RULE OF THUMB: ~sqrt(n) LISTS
+    return max(1, int(np.sqrt(n)))
+
+
+def resolve_nlist(configured: int, n: int) -> int:
+    return configured if configured > 0 else default_nlist(n)
+
+
+def should_train(ivf: Optional[IVFLists], n: int, min_train_size: int, growth: float) -> bool:
+    if n < min_train_size:
+        return False
+    if ivf is None:
+        return True
+    # CENTROIDS DRIFT FROM THE DATA AS THE CORPUS GROWS -- RETRAIN PAST A GROWTH FACTOR
+    return n >= ivf.trained_size * growth
@@ -0,0 +1,455 @@
+from typing import Any, BinaryIO, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+
+from app.config import settings
+from app.db.database import SessionLocal
+from app.db.crud import DocumentRepository, ChunkRepository, IngestionJobRepository
+from app.db.models import IngestionJob
+from app.schemas.document import DocumentCreate
+from app.core.document_processor import DocumentProcessor
+from app.core.ingestion import ingestion_worker, IngestionJobLost, remove_spooled_upload
+from app.core.split_worker import init_splitter, split_text
+from app.core.metrics import metrics
+from app.core.vector_index import vector_index
+from app.core.lexical_index import lexical_index
+
+logger = logging.getLogger(__name__)
+
+TEXT_EXTENSIONS = (".txt", ".md")
+ZIP_EXTENSIONS = (".zip",)
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+def iter_upload_entries(filename: str, fileobj: BinaryIO) -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    Iterate over the files in an upload, one entry at a time.
+
+    Args:
+        filename: The uploaded file's name, its extension picks the format
+        fileobj: The uploaded file
+
+    Returns:
+        Iterator over (path, stream) pairs -- the upload itself unless it is a
+        zip or tar archive. Each stream is only valid until the next pair
+    """
+
+    lower = filename.lower()
+    if lower.endswith(ZIP_EXTENSIONS):
+        # ZIP NEEDS A SEEKABLE FILE -- UPLOADS ARE SPOOLED TO DISK BY THE FRAMEWORK
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as entry:
+                    yield info.filename, entry
+    elif lower.endswith(TAR_EXTENSIONS):
+        # STREAM MODE ("r|*") READS MEMBERS IN ORDER WITHOUT SEEKING OR INDEXING THE ARCHIVE
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                entry = archive.extractfile(member)
+                if entry is not None:
+                    yield member.name, entry
+    else:
+        yield filename, fileobj
+
+
+def bulk_spool_path_for(upload_id) -> str:
+    return os.path.join(settings.UPLOAD_SPOOL_DIR, f"{upload_id}.bulk")
+
+
+def spool_bulk_uploads(uploads: Iterable[Tuple[str, BinaryIO]], path: str, max_bytes: int) -> int:
+    """
+    Copy the files of a bulk upload to a spool directory, as-is, for a bulk ingestion job.
+
+    Args:
+        uploads: (filename, file) pairs
+        path: Directory to create, one numbered file per upload plus uploads.json with their names
+        max_bytes: Limit on the bytes written, over it ValueError is raised
+
+    Returns:
+        The number of bytes written
+    """
+
+    os.makedirs(path)
+    names = []
+    written = 0
+    try:
+        for position, (filename, fileobj) in enumerate(uploads):
+            with open(os.path.join(path, str(position)), "wb") as spooled:
+                while True:
+                    data = fileobj.read(settings.UPLOAD_READ_SIZE)
+                    if not data:
+                        break
+                    written += len(data)
+                    if written > max_bytes:
+                        raise ValueError(f"Upload is larger than {max_bytes} bytes")
+                    spooled.write(data)
+            names.append(filename)
+        # WRITTEN LAST -- A DIRECTORY WITHOUT IT WAS NEVER FULLY SPOOLED
+        with open(os.path.join(path, "uploads.json"), "w") as manifest:
+            json.dump(names, manifest)
+    except Exception:
+        remove_spooled_upload(path)
+        raise
+    return written
+
+
+def iter_spooled_uploads(path: str) -> Iterator[Tuple[str, BinaryIO]]:
+    # (filename, file) PAIRS OF A SPOOLED BULK UPLOAD, EACH FILE OPEN UNTIL THE NEXT PAIR
+    with open(os.path.join(path, "uploads.json")) as manifest:
+        names = json.load(manifest)
+    for position, filename in enumerate(names):
+        with open(os.path.join(path, str(position)), "rb") as fileobj:
+            yield filename, fileobj
+
+
+def read_text(fileobj: BinaryIO, max_bytes: int) -> str:
+    # ONE ENTRY AT A TIME, CAPPED SO A COMPRESSED ENTRY CANNOT INFLATE WITHOUT BOUND
+    data = fileobj.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f"File is larger than {max_bytes} bytes")
+    return data.decode("utf-8")
+
+
+class _BulkRun:
+
+    # STATE OF ONE ingest() CALL OR ONE RUN OF A BULK JOB -- A JOB RESUMED AFTER ITS WORKER
+    # DIED SKIPS THE files_done RESULT POSITIONS ITS EARLIER RUNS COMMITTED, KEEPING THEIR
+    # RESULTS FROM THE LAST SAVED CHECKPOINT
+
+    def __init__(self,
+                 job_id=None,
+                 owner: Optional[str] = None,
+                 files_done: int = 0,
+                 checkpoint: Optional[Dict[str, Any]] = None):
+        checkpoint = checkpoint or {}
+        self.job_id = job_id
+        self.owner = owner
+        self.files_done = files_done
+        self.restored: List[Dict[str, Any]] = checkpoint.get("files", [])[:files_done]
+        self.started = time.perf_counter()
+        self.elapsed_before = checkpoint.get("elapsed_seconds", 0.0)
+        self.results: List[Dict[str, Any]] = []
+        # (POSITION, RESULT, SPLIT FUTURE), IN FILE ORDER
+        self.splitting: Deque[Tuple[int, Dict[str, Any], Future]] = deque()
+        # (POSITION, RESULT, TEXT CHUNKS, EMBEDDING BATCH FUTURES), IN FILE ORDER
+        self.embedding: Deque[Tuple[int, Dict[str, Any], List[str], List[Future]]] = deque()
+        self.batches_in_flight = 0
+        # COMMITTED BUT NOT YET IN THE IN-MEMORY INDEXES
+        self.unindexed_files = 0
+        self.unindexed: Tuple[List, List, List, List] = ([], [], [], [])
+        self.truncated = False
+        self.timings = {"read": 0.0, "split_wait": 0.0, "embed_wait": 0.0, "store": 0.0, "index": 0.0}
+        self.timings.update(checkpoint.get("stage_seconds", {}))
+
+    @property
+    def elapsed(self) -> float:
+        return self.elapsed_before + time.perf_counter() - self.started
+
+    def add_result(self, filename: str, source: str) -> Dict[str, Any]:
+        result = {
+            "filename": filename,
+            "source": source,
+            "status": "pending",
+            "document_id": None,
+            "chunks": 0,
+            "bytes": 0,
+            "error": None
+        }
+        self.results.append(result)
+        return result
+
+
+class BulkIngestor:
+
+    # INGESTS MANY FILES AS A PIPELINE: READ (CALLING THREAD, ONE ENTRY AT A
+    # TIME) -> SPLIT (PROCESS POOL, ONE TASK PER FILE) -> EMBED (THREAD POOL, ONE TASK PER
+    # PROVIDER BATCH) -> STORE (CALLING THREAD, FILES IN ORDER, ONE TRANSACTION EACH)
+    # EVERY STAGE KEEPS A BOUNDED NUMBER OF FILES OR BATCHES IN FLIGHT, SO WHILE ONE FILE'S
+    # BATCHES ARE AT THE PROVIDER THE NEXT FILES ARE ALREADY BEING READ AND SPLIT, AND
+    # MEMORY STAYS FLAT HOWEVER LARGE THE ARCHIVE IS
+    # COMMITTED FILES REACH THE IN-MEMORY INDEXES index_batch_files AT A TIME (ONE SHARED
+    # GENERATION, ONE BM25 SEGMENT PER BATCH) AND ONCE MORE AT THE END OF THE RUN
+    # UPLOADS TO THE API RUN AS "bulk" INGESTION JOBS (run_job) ON A SPOOLED COPY, RECORDING
+    # THEIR PROGRESS PER FILE AND THEIR RESULTS EVERY index_batch_files FILES
+
+    def __init__(self,
+                 processor: DocumentProcessor,
+                 split_processes: int,
+                 max_file_bytes: int,
+                 max_files: int,
+                 index_batch_files: int = 100,
+                 session_factory: Callable = SessionLocal):
+        self.processor = processor
+        self.split_processes = split_processes if split_processes > 0 else (os.cpu_count() or 1)
+        self.max_file_bytes = max(1, max_file_bytes)
+        self.max_files = max(1, max_files)
+        self.index_batch_files = max(1, index_batch_files)
+        self.session_factory = session_factory
+        self._split_pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_split_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._split_pool is None:
+                # SPAWN, NOT FORK -- THE SERVER PROCESS HAS THREADS AND OPEN CONNECTIONS
+                self._split_pool = ProcessPoolExecutor(
+                    max_workers=self.split_processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_splitter,
+                    initargs=(settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)
+                )
+            return self._split_pool
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._split_pool = self._split_pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def ingest(self, uploads: Iterable[Tuple[str, BinaryIO]]) -> Dict[str, Any]:
+        """
+        Ingest plain text files and the text files inside zip/tar archives.
+
+        Args:
+            uploads: (filename, file) pairs
+
+        Returns:
+            Per-file results in upload order plus totals and throughput
+        """
+
+        with self.session_factory() as db:
+            return self._ingest(db, uploads, _BulkRun())
+
+    def run_job(self, db, job: IngestionJob, owner: str) -> None:
+        """
+        Run a claimed "bulk" ingestion job on its spooled upload, resuming after its last committed file.
+
+        Args:
+            db: Session the job was claimed with
+            job: The job, its source_path a directory written by spool_bulk_uploads
+            owner: Worker id holding the job's lease
+        """
+
+        source_path = job.source_path
+        run = _BulkRun(job_id=job.id, owner=owner, files_done=job.files_done, checkpoint=job.result)
+        summary = self._ingest(db, iter_spooled_uploads(source_path), run)
+        if not IngestionJobRepository.update_owned_job(
+            db, job.id, owner, status="completed", result=summary, source_path=None,
+            lease_owner=None, lease_expires_at=None
+        ):
+            raise IngestionJobLost()
+        remove_spooled_upload(source_path)
+
+    def _ingest(self, db, uploads: Iterable[Tuple[str, BinaryIO]], run: _BulkRun) -> Dict[str, Any]:
+        split_pool = self._get_split_pool()
+        max_splitting = self.split_processes * 2
+        max_batches = self.processor.max_concurrency * 2
+
+        with ThreadPoolExecutor(max_workers=self.processor.max_concurrency,
+                                thread_name_prefix="bulk-embed") as embed_pool:
+            try:
+                for position, result, text in self._iter_texts(uploads, run):
+                    run.splitting.append((position, result, split_pool.submit(split_text, text)))
+                    while len(run.splitting) > max_splitting:
+                        self._embed_next(run, embed_pool)
+                    while run.batches_in_flight > max_batches:
+                        self._store_next(db, run)
+
+                while run.splitting:
+                    self._embed_next(run, embed_pool)
+                    while run.batches_in_flight > max_batches:
+                        self._store_next(db, run)
+                while run.embedding:
+                    self._store_next(db, run)
+            finally:
+                # A FAILED REQUEST DOES NOT LEAVE WORK QUEUED IN THE SHARED POOLS
+                for _, _, future in run.splitting:
+                    future.cancel()
+                for _, _, _, futures in run.embedding:
+                    for future in futures:
+                        future.cancel()
+                # WHAT WAS COMMITTED IS INDEXED EVEN IF A LATER FILE FAILED THE RUN
+                self._index_pending(run)
+
+        summary = self._summary(run)
+        metrics.record_stage("ingest.bulk", summary["elapsed_seconds"])
+        return summary
+
+    def _iter_texts(self,
+                    uploads: Iterable[Tuple[str, BinaryIO]],
+                    run: _BulkRun) -> Iterator[Tuple[int, Dict[str, Any], str]]:
+        read_started = time.perf_counter()
+        for source, fileobj in uploads:
+            try:
+                for name, entry in iter_upload_entries(source, fileobj):
+                    if len(run.results) >= self.max_files:
+                        run.truncated = True
+                        return
+                    position = len(run.results)
+                    result = run.add_result(name, source)
+                    # HANDLED BY AN EARLIER RUN OF THE JOB (STILL "pending" IF IT WAS IN FLIGHT AT THE CHECKPOINT)
+                    if position < len(run.restored) and run.restored[position]["status"] != "pending":
+                        result.update(run.restored[position])
+                        continue
+                    if not name.lower().endswith(TEXT_EXTENSIONS):
+                        result.update(status="skipped", error="Only .txt and .md files are ingested")
+                        continue
+                    if position < run.files_done:
+                        # COMMITTED AFTER THE LAST CHECKPOINT, BEFORE THE JOB'S WORKER WAS LOST
+                        result.update(status="completed", error="Stored before the job was resumed")
+                        continue
+                    try:
+                        text = read_text(entry, self.max_file_bytes)
+                    except UnicodeDecodeError:
+                        result.update(status="failed", error="File must be UTF-8 encoded text")
+                        continue
+                    except ValueError as exc:
+                        result.update(status="failed", error=str(exc))
+                        continue
+                    result["bytes"] = len(text.encode("utf-8"))
+
+                    run.timings["read"] += time.perf_counter() - read_started
+                    yield position, result, text
+                    read_started = time.perf_counter()
+            except (zipfile.BadZipFile, tarfile.TarError, EOFError) as exc:
+                run.add_result(source, source).update(status="failed", error=f"Unreadable archive: {exc}")
+        run.timings["read"] += time.perf_counter() - read_started
+
+    def _embed_next(self, run: _BulkRun, embed_pool: ThreadPoolExecutor) -> None:
+        # OLDEST SPLIT -> ITS EMBEDDING BATCHES, WHICH RUN WHILE LATER FILES ARE READ AND SPLIT
+        position, result, future = run.splitting.popleft()
+        waited = time.perf_counter()
+        try:
+            chunks = future.result()
+        except Exception as exc:
+            logger.exception("Could not split %s", result["filename"])
+            result.update(status="failed", error=str(exc))
+            return
+        finally:
+            run.timings["split_wait"] += time.perf_counter() - waited
+
+        if not chunks:
+            result.update(status="skipped", error="File has no text")
+            return
+        batch_size = self.processor.batch_size
+        futures = [
+            embed_pool.submit(self.processor.embed_texts, chunks[start:start + batch_size])
+            for start in range(0, len(chunks), batch_size)
+        ]
+        run.embedding.append((position, result, chunks, futures))
+        run.batches_in_flight += len(futures)
+
+    def _store_next(self, db, run: _BulkRun) -> None:
+        position, result, chunks, futures = run.embedding.popleft()
+        run.batches_in_flight -= len(futures)
+        waited = time.perf_counter()
+        try:
+            embeddings = [embedding for future in futures for embedding in future.result()]
+        except Exception as exc:
+            logger.exception("Could not embed %s", result["filename"])
+            result.update(status="failed", error=str(exc))
+            return
+        finally:
+            run.timings["embed_wait"] += time.perf_counter() - waited
+
+        stored = time.perf_counter()
+        try:
+            # DOCUMENT AND CHUNKS IN ONE TRANSACTION, INDEXED ONCE COMMITTED
+            document = DocumentRepository.create_document(db, DocumentCreate(title=result["filename"]), commit=False)
+            chunks_data = self.processor.build_chunks(chunks, embeddings, document.id)
+            chunk_ids = ChunkRepository.create_chunks(db, document.id, chunks_data, commit=False)
+            # A JOB'S PROGRESS COMMITS WITH THE FILE, SO A RESUMED RUN NEVER STORES IT TWICE
+            if run.job_id is not None and not IngestionJobRepository.update_owned_job(
+                db, run.job_id, run.owner, commit=False, files_done=position + 1,
+                chunks_embedded=IngestionJob.chunks_embedded + len(chunk_ids),
+                chunks_total=IngestionJob.chunks_total + len(chunk_ids)
+            ):
+                raise IngestionJobLost()
+            db.commit()
+        except IngestionJobLost:
+            db.rollback()
+            raise
+        except Exception as exc:
+            db.rollback()
+            logger.exception("Could not store %s", result["filename"])
+            result.update(status="failed", error=str(exc))
+            return
+        finally:
+            run.timings["store"] += time.perf_counter() - stored
+
+        pending_chunk_ids, pending_document_ids, pending_embeddings, pending_texts = run.unindexed
+        pending_chunk_ids.extend(chunk_ids)
+        pending_document_ids.extend([document.id] * len(chunk_ids))
+        pending_embeddings.extend(embeddings)
+        pending_texts.extend(chunks)
+        run.unindexed_files += 1
+        # STRING ID -- A JOB KEEPS ITS RESULTS AS JSON
+        result.update(status="completed", document_id=str(document.id), chunks=len(chunk_ids))
+        if run.unindexed_files >= self.index_batch_files:
+            self._index_pending(run)
+            self._checkpoint(db, run)
+
+    def _index_pending(self, run: _BulkRun) -> None:
+        chunk_ids, document_ids, embeddings, texts = run.unindexed
+        run.unindexed = ([], [], [], [])
+        run.unindexed_files = 0
+        if not chunk_ids:
+            return
+        indexed = time.perf_counter()
+        vector_index.add(chunk_ids, document_ids, embeddings)
+        lexical_index.add(chunk_ids, document_ids, texts)
+        run.timings["index"] += time.perf_counter() - indexed
+
+    def _checkpoint(self, db, run: _BulkRun) -> None:
+        # RESULTS SO FAR, FOR GET /jobs/{id} AND FOR A RUN THAT RESUMES THE JOB
+        if run.job_id is not None:
+            IngestionJobRepository.update_owned_job(db, run.job_id, run.owner, result=self._summary(run))
+
+    def _summary(self, run: _BulkRun) -> Dict[str, Any]:
+        elapsed = run.elapsed
+        completed = [result for result in run.results if result["status"] == "completed"]
+        chunks = sum(result["chunks"] for result in completed)
+        num_bytes = sum(result["bytes"] for result in completed)
+        rate = 1 / elapsed if elapsed > 0 else 0.0
+        return {
+            "files": run.results,
+            "files_completed": len(completed),
+            "files_failed": sum(1 for result in run.results if result["status"] == "failed"),
+            "files_skipped": sum(1 for result in run.results if result["status"] == "skipped"),
+            "truncated": run.truncated,
+            "chunks": chunks,
+            "bytes": num_bytes,
+            "elapsed_seconds": elapsed,
+            "files_per_second": len(completed) * rate,
+            "chunks_per_second": chunks * rate,
+            "megabytes_per_second": num_bytes / (1024 * 1024) * rate,
+            # TIME THE CALLING THREAD SPENT ON EACH STAGE -- A LARGE WAIT NAMES THE BOTTLENECK
+            "stage_seconds": dict(run.timings)
+        }
+
+
+# SHARED BY EVERY BULK UPLOAD IN THIS PROCESS, SHUT DOWN IN THE app.main LIFESPAN
+# SAME PROCESSOR (EMBEDDINGS CLIENT, EMBEDDING CACHE) AS SINGLE UPLOADS
+bulk_ingestor = BulkIngestor(
+    processor=ingestion_worker.processor,
+    split_processes=settings.BULK_INGEST_SPLIT_PROCESSES,
+    max_file_bytes=settings.BULK_INGEST_MAX_FILE_BYTES,
+    max_files=settings.BULK_INGEST_MAX_FILES,
+    index_batch_files=settings.BULK_INGEST_INDEX_BATCH_FILES
+)
+
+# THE WORKER CLAIMS, LEASES AND RESUMES BULK JOBS LIKE SINGLE UPLOADS AND RUNS THEM HERE
+ingestion_worker.register_job_kind("bulk", bulk_ingestor.run_job)
@@ -0,0 +1,64 @@
+from typing import Optional
+import httpx
+from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+
+from app.config import settings
+
+
+def http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY
+    )
+
+
+def build_http_client() -> httpx.Client:
+    return httpx.Client(limits=http_limits(), timeout=settings.OPENAI_TIMEOUT_SECONDS)
+
+
+def build_async_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(limits=http_limits(), timeout=settings.OPENAI_TIMEOUT_SECONDS)
+
+
+def build_embeddings(http_client: Optional[httpx.Client] = None,
+                     http_async_client: Optional[httpx.AsyncClient] = None) -> OpenAIEmbeddings:
+    return OpenAIEmbeddings(
+        model=settings.EMBEDDING_MODEL,
+        openai_api_key=settings.OPENAI_API_KEY,
+        openai_api_base=settings.OPENAI_BASE_URL or None,
+        check_embedding_ctx_length=settings.EMBEDDING_CHECK_CTX_LENGTH,
+        http_client=http_client or build_http_client(),
+        http_async_client=http_async_client or build_async_http_client()
+    )
+
+
+def build_llm(http_client: Optional[httpx.Client] = None,
+              http_async_client: Optional[httpx.AsyncClient] = None) -> ChatOpenAI:
+    return ChatOpenAI(
+        model=settings.LLM_MODEL,
+        temperature=0,
+        api_key=settings.OPENAI_API_KEY,
+        base_url=settings.OPENAI_BASE_URL or None,
+        streaming=True,
+        # ASK FOR TOKEN USAGE ON STREAMED RESPONSES TOO (QA TRACE + /metrics)
+        stream_usage=True,
+        http_client=http_client or build_http_client(),
+        http_async_client=http_async_client or build_async_http_client()
+    )
+
+
+class ProviderClients:
+
+    # PROVIDER CLIENTS CREATED ONCE PER PROCESS (SEE app.main LIFESPAN) SO KEEP-ALIVE
+    # CONNECTIONS TO THE PROVIDER ARE REUSED ACROSS REQUESTS
+
+    def __init__(self):
+        self.http_client = build_http_client()
+        self.http_async_client = build_async_http_client()
+        self.embeddings = build_embeddings(self.http_client, self.http_async_client)
+        self.llm = build_llm(self.http_client, self.http_async_client)
+
+    async def aclose(self) -> None:
+        self.http_client.close()
+        await self.http_async_client.aclose()
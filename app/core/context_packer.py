@@ -0,0 +1,261 @@
+from typing import List, Dict, Any, Optional, FrozenSet
+from dataclasses import dataclass, field
+import logging
+import math
+import re
+import threading
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+# SHORTER SUFFIX/PREFIX MATCHES BETWEEN NEIGHBOURING CHUNKS ARE TREATED AS COINCIDENCE
+MIN_OVERLAP_CHARS = 16
+
+
+class TokenCounter:
+
+    # LOCAL TOKENIZER FOR THE CHAT MODEL (tiktoken). tiktoken DOWNLOADS ITS ENCODING FILES
+    # ON FIRST USE -- WHEN THAT FAILS WE FALL BACK TO ~4 CHARACTERS PER TOKEN
+
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, model: str, encoding_name: str = ""):
+        self.model = model
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return self._encoding
+            try:
+                import tiktoken
+                if self.encoding_name:
+                    self._encoding = tiktoken.get_encoding(self.encoding_name)
+                else:
+                    try:
+                        self._encoding = tiktoken.encoding_for_model(self.model)
+                    except KeyError:
+                        self._encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as exc:
+                logger.warning("tiktoken encoding unavailable (%s), estimating tokens from text length", exc)
+                self._encoding = None
+            self._loaded = True
+            return self._encoding
+
+    @property
+    def exact(self) -> bool:
+        return self._load() is not None
+
+    def count(self, text: str) -> int:
+        encoding = self._encoding if self._loaded else self._load()
+        if encoding is None:
+            return math.ceil(len(text) / self.CHARS_PER_TOKEN)
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        # FIRST max_tokens TOKENS OF text
+        encoding = self._encoding if self._loaded else self._load()
+        if encoding is None:
+            return text[:max_tokens * self.CHARS_PER_TOKEN]
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+@dataclass
+class Passage:
+    # ONE OR MORE NEIGHBOURING CHUNKS OF A DOCUMENT, MERGED
+    text: str
+    score: float
+    rank: int
+    chunk_positions: List[int]
+    shingles: FrozenSet = field(default=frozenset(), repr=False)
+    tokens: int = 0
+
+
+@dataclass
+class PackedContext:
+    text: str
+    # POSITIONS (IN RETRIEVAL ORDER) OF THE CHUNKS THAT MADE IT INTO text
+    packed_positions: List[int]
+    passages: int
+    tokens_before: int
+    tokens_after: int
+    exact_tokens: bool
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "passages": self.passages,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "tokens_saved": self.tokens_before - self.tokens_after,
+            "exact_tokens": self.exact_tokens
+        }
+
+
+def _overlap(left: str, right: str, max_chars: int) -> int:
+    # LENGTH OF THE LONGEST SUFFIX OF left THAT IS ALSO A PREFIX OF right
+    for size in range(min(len(left), len(right), max_chars), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _shingles(text: str, size: int = 3) -> FrozenSet:
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return frozenset([tuple(words)])
+    return frozenset(tuple(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def _covered(shingles: FrozenSet, seen: set) -> float:
+    # SHARE OF A PASSAGE'S SHINGLES ALREADY IN THE CONTEXT -- 1.0 FOR A CHUNK CONTAINED IN A MERGED PASSAGE
+    if not shingles:
+        return 0.0
+    return len(shingles & seen) / len(shingles)
+
+
+def _chunk_score(chunk: Dict[str, Any]) -> float:
+    score = chunk.get("score")
+    if score is None:
+        score = chunk.get("similarity")
+    return float(score or 0.0)
+
+
+def merge_neighbours(chunks: List[Dict[str, Any]], max_overlap: int) -> List[Passage]:
+    """
+    Merge retrieved chunks that are consecutive in the same document.
+
+    Consecutive chunks (by chunk_index metadata) become one passage, with the
+    text the splitter repeated between them (CHUNK_OVERLAP) kept only once.
+
+    Args:
+        chunks: Retrieved chunks in rank order
+        max_overlap: Longest repeated text to look for between neighbours
+
+    Returns:
+        Passages, best-ranked first
+    """
+
+    by_document: Dict[Any, List[int]] = {}
+    passages = []
+    for position, chunk in enumerate(chunks):
+        chunk_index = (chunk.get("metadata") or {}).get("chunk_index")
+        if chunk_index is None:
+            passages.append(Passage(chunk["content"], _chunk_score(chunk), position, [position]))
+        else:
+            by_document.setdefault(chunk["document_id"], []).append(position)
+
+    for positions in by_document.values():
+        positions.sort(key=lambda p: chunks[p]["metadata"]["chunk_index"])
+        run = [positions[0]]
+        for position in positions[1:] + [None]:
+            if position is not None:
+                previous_index = chunks[run[-1]]["metadata"]["chunk_index"]
+                if chunks[position]["metadata"]["chunk_index"] == previous_index + 1:
+                    run.append(position)
+                    continue
+
+            text = chunks[run[0]]["content"]
+            for right in run[1:]:
+                right_text = chunks[right]["content"]
+                size = _overlap(text, right_text, max_overlap)
+                text = text + right_text[size:] if size else text + "\n" + right_text
+            passages.append(Passage(
+                text,
+                max(_chunk_score(chunks[p]) for p in run),
+                min(run),
+                sorted(run)
+            ))
+            run = [position]
+
+    passages.sort(key=lambda passage: passage.rank)
+    return passages
+
+
+def pack_context(chunks: List[Dict[str, Any]],
+                 token_budget: int = None,
+                 mmr_lambda: float = None,
+                 duplicate_threshold: float = None,
+                 counter: Optional[TokenCounter] = None) -> PackedContext:
+    """
+    Build the LLM context from retrieved chunks within a token budget.
+
+    Neighbouring chunks are merged, near-duplicate passages (at least
+    duplicate_threshold of their word shingles already in the context) are
+    dropped, and the rest are picked by maximal marginal relevance until the
+    budget is full.
+
+    Args:
+        chunks: Retrieved chunks in rank order
+        token_budget: Maximum context tokens, defaults to settings.CONTEXT_TOKEN_BUDGET
+        mmr_lambda: Relevance vs. novelty trade-off, defaults to settings.CONTEXT_MMR_LAMBDA
+        duplicate_threshold: Defaults to settings.CONTEXT_DUPLICATE_THRESHOLD
+        counter: Tokenizer, defaults to the shared token_counter
+
+    Returns:
+        The packed context text with before/after token counts
+    """
+
+    if token_budget is None:
+        token_budget = settings.CONTEXT_TOKEN_BUDGET
+    if mmr_lambda is None:
+        mmr_lambda = settings.CONTEXT_MMR_LAMBDA
+    if duplicate_threshold is None:
+        duplicate_threshold = settings.CONTEXT_DUPLICATE_THRESHOLD
+    counter = counter or token_counter
+
+    # WHAT THE PLAIN JOIN OF EVERY CHUNK WOULD HAVE COST
+    tokens_before = counter.count("\n\n".join(chunk["content"] for chunk in chunks))
+
+    passages = merge_neighbours(chunks, settings.CHUNK_OVERLAP)
+    top_score = max((passage.score for passage in passages), default=0.0) or 1.0
+    for passage in passages:
+        passage.shingles = _shingles(passage.text)
+        passage.tokens = counter.count(passage.text)
+
+    # MMR: BEST REMAINING BY RELEVANCE MINUS SIMILARITY TO WHAT IS ALREADY PICKED
+    selected: List[Passage] = []
+    seen_shingles = set()
+    used_tokens = 0
+    separator_tokens = counter.count("\n\n")
+    candidates = list(passages)
+    while candidates:
+        best, best_value, best_similarity = None, -math.inf, 0.0
+        for passage in candidates:
+            similarity = _covered(passage.shingles, seen_shingles)
+            value = mmr_lambda * passage.score / top_score - (1 - mmr_lambda) * similarity
+            if value > best_value:
+                best, best_value, best_similarity = passage, value, similarity
+        candidates.remove(best)
+        if best_similarity >= duplicate_threshold:
+            continue
+
+        cost = best.tokens + (separator_tokens if selected else 0)
+        if used_tokens + cost > token_budget:
+            if selected:
+                continue
+            # NOT EVEN THE BEST PASSAGE FITS -- SEND ITS BEGINNING RATHER THAN NOTHING
+            best.text = counter.truncate(best.text, token_budget)
+            best.tokens = counter.count(best.text)
+            cost = best.tokens
+        selected.append(best)
+        seen_shingles |= best.shingles
+        used_tokens += cost
+
+    text = "\n\n".join(passage.text for passage in selected)
+    return PackedContext(
+        text=text,
+        packed_positions=sorted(p for passage in selected for p in passage.chunk_positions),
+        passages=len(selected),
+        tokens_before=tokens_before,
+        tokens_after=counter.count(text),
+        exact_tokens=counter.exact
+    )
+
+
+token_counter = TokenCounter(settings.LLM_MODEL, settings.TOKENIZER_ENCODING)
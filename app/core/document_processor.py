@@ -1,53 +1,229 @@
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Iterable, Iterator, BinaryIO, Optional
+import codecs
+import hashlib
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 
 from app.config import settings
+from app.core.embedding_cache import EmbeddingCache, embedding_cache
+from app.core.clients import build_embeddings
+from app.core.metrics import metrics
 
 class DocumentProcessor:
     
-    def __init__(self):
-        self.embeddings = OpenAIEmbeddings(
-            model=settings.EMBEDDING_MODEL,
-            openai_api_key=settings.OPENAI_API_KEY
-        )
+    def __init__(self, cache: EmbeddingCache = embedding_cache, embeddings: OpenAIEmbeddings = None):
+        self.embeddings = embeddings or build_embeddings()
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=settings.CHUNK_SIZE,
-            chunk_overlap=settings.CHUNK_OVERLAP
+            chunk_overlap=settings.CHUNK_OVERLAP,
+            add_start_index=True
         )
+        # HOW MUCH STREAMED TEXT TO BUFFER BEFORE SPLITTING
+        self.stream_window = settings.CHUNK_SIZE * 32
+        self.batch_size = max(1, settings.EMBEDDING_BATCH_SIZE)
+        self.max_concurrency = max(1, settings.EMBEDDING_MAX_CONCURRENCY)
+        self.cache = cache
+    
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts, serving repeated texts from the embedding cache.
         
-    def process_document(self, document_text: str, document_id: uuid.UUID) -> List[Dict[str, Any]]:
+        Args:
+            texts: The texts to embed
+            
+        Returns:
+            One embedding per text, in the same order as the input
         """
-        Process a document by chunking and embedding.
+        
+        with metrics.span("ingest.embed"):
+            if self.cache is None:
+                return self._embed_batches(texts)
+            return self.cache.get_or_embed(settings.EMBEDDING_MODEL, texts, self._embed_batches)
+    
+    def _embed_batches(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts in batches, keeping a bounded number of batches in flight.
         
         Args:
-            document_text: The text content of the document
-            document_id: The 3 of the document
+            texts: The texts to embed
             
         Returns:
-            List of dictionaries containing chunk data with content, embeddings, and metadata
+            One embedding per text, in the same order as the input
         """
         
-        # SPLIT TEXT INTO CHUNKS
-        text_chunks = self.text_splitter.split_text(document_text)
+        # SPLIT INTO PROVIDER BATCHES
+        batches = [
+            texts[start:start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        if not batches:
+            return []
+        
+        if len(batches) == 1 or self.max_concurrency == 1:
+            batch_embeddings = [self.embeddings.embed_documents(batch) for batch in batches]
+        else:
+            # MAP KEEPS BATCH ORDER REGARDLESS OF COMPLETION ORDER
+            workers = min(self.max_concurrency, len(batches))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                batch_embeddings = list(executor.map(self.embeddings.embed_documents, batches))
+        
+        return [embedding for batch in batch_embeddings for embedding in batch]
         
+    def build_chunks(self,
+                      text_chunks: List[str],
+                      embeddings: List[List[float]],
+                      document_id: uuid.UUID,
+                      start_index: int = 0) -> List[Dict[str, Any]]:
         chunks_data = []
-        for idx, chunk in enumerate(text_chunks):
-            # GENERATE EMBEDDINGS
-            embedding = self.embeddings.embed_query(chunk)
-            
+        for offset, (chunk, embedding) in enumerate(zip(text_chunks, embeddings)):
             # CREATE CHUNK DATA
             chunk_data = {
                 "content": chunk,
                 "embedding": embedding,
                 "metadata": {
                     "document_id": str(document_id),
-                    "chunk_index": idx,
+                    "chunk_index": start_index + offset,
                     "word_count": len(chunk.split()),
                     "char_count": len(chunk)
                 }
             }
             chunks_data.append(chunk_data)
         
-        return chunks_data
\ No newline at end of file
+        return chunks_data
+        
+    def process_document(self, document_text: str, document_id: uuid.UUID) -> List[Dict[str, Any]]:
+        """
+        Process a document by chunking and embedding.
+        
+        Args:
+            document_text: The text content of the document
+            document_id: The id of the document
+            
+        Returns:
+            List of dictionaries containing chunk data with content, embeddings, and metadata
+        """
+        
+        # SPLIT TEXT INTO CHUNKS
+        with metrics.span("ingest.split"):
+            text_chunks = self.text_splitter.split_text(document_text)
+        
+        # GENERATE EMBEDDINGS
+        embeddings = self.embed_texts(text_chunks)
+        
+        return self.build_chunks(text_chunks, embeddings, document_id)
+    
+    def split_stream(self, text_stream: Iterable[str]) -> Iterator[str]:
+        """
+        Split text arriving in pieces without holding the whole document.
+        
+        Args:
+            text_stream: Consecutive pieces of the document text
+            
+        Returns:
+            Iterator over the text chunks, in document order
+        """
+        
+        buffer = ""
+        for piece in text_stream:
+            buffer += piece
+            if len(buffer) < self.stream_window:
+                continue
+            
+            # EMIT EVERY CHUNK BUT THE LAST, THEN RE-SPLIT FROM WHERE THE LAST ONE STARTS
+            # SO ITS BOUNDARY AND OVERLAP SEE THE TEXT THAT FOLLOWS
+            with metrics.span("ingest.split"):
+                documents = self.text_splitter.create_documents([buffer])
+            last_start = documents[-1].metadata.get("start_index", -1) if documents else -1
+            if last_start <= 0:
+                continue
+            for document in documents[:-1]:
+                yield document.page_content
+            buffer = buffer[last_start:]
+        
+        if buffer:
+            with metrics.span("ingest.split"):
+                tail_chunks = self.text_splitter.split_text(buffer)
+            yield from tail_chunks
+    
+    def process_stream(self,
+                       text_stream: Iterable[str],
+                       document_id: uuid.UUID,
+                       existing: Optional[Dict[str, List[uuid.UUID]]] = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Process a streamed document in rounds of concurrent embedding batches.
+        
+        Args:
+            text_stream: Consecutive pieces of the document text
+            document_id: The id of the document
+            existing: Ids of the document's stored chunks by content_hash -- a chunk
+                with the same text takes one of them (consumed from the list) and is
+                returned with that "id" and no embedding instead of being embedded
+            
+        Returns:
+            Iterator over lists of chunk data, in document order
+        """
+        
+        round_size = self.batch_size * self.max_concurrency
+        start_index = 0
+        pending: List[str] = []
+        
+        for chunk in self.split_stream(text_stream):
+            pending.append(chunk)
+            if len(pending) >= round_size:
+                yield self._process_round(pending, document_id, start_index, existing)
+                start_index += len(pending)
+                pending = []
+        
+        if pending:
+            yield self._process_round(pending, document_id, start_index, existing)
+    
+    def _process_round(self,
+                       text_chunks: List[str],
+                       document_id: uuid.UUID,
+                       start_index: int,
+                       existing: Optional[Dict[str, List[uuid.UUID]]]) -> List[Dict[str, Any]]:
+        if not existing:
+            return self.build_chunks(text_chunks, self.embed_texts(text_chunks), document_id, start_index)
+        
+        reused_ids = []
+        for chunk in text_chunks:
+            matches = existing.get(content_hash(chunk))
+            reused_ids.append(matches.pop() if matches else None)
+        
+        # ONLY NEW OR CHANGED TEXT GOES TO THE PROVIDER
+        new_texts = [chunk for chunk, reused_id in zip(text_chunks, reused_ids) if reused_id is None]
+        new_embeddings = iter(self.embed_texts(new_texts) if new_texts else [])
+        embeddings = [next(new_embeddings) if reused_id is None else None for reused_id in reused_ids]
+        
+        chunks_data = self.build_chunks(text_chunks, embeddings, document_id, start_index)
+        for chunk_data, reused_id in zip(chunks_data, reused_ids):
+            if reused_id is not None:
+                chunk_data["id"] = reused_id
+        return chunks_data
+    
+    def estimate_chunk_count(self, num_chars: int) -> int:
+        # EACH CHUNK ADVANCES ROUGHLY chunk_size - chunk_overlap CHARACTERS
+        stride = max(1, settings.CHUNK_SIZE - settings.CHUNK_OVERLAP)
+        return max(1, -(-num_chars // stride))
+
+
+def content_hash(text: str) -> str:
+    # IDENTIFIES A CHUNK'S TEXT WHEN A DOCUMENT IS RE-INGESTED
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def iter_decoded(fileobj: BinaryIO, encoding: str = "utf-8", read_size: int = 64 * 1024) -> Iterator[str]:
+    # DECODE A BINARY FILE PIECE BY PIECE, MULTI-BYTE SEQUENCES MAY SPAN READS
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        data = fileobj.read(read_size)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
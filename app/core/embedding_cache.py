@@ -0,0 +1,262 @@
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import threading
+import time
+import numpy as np
+
+from app.config import settings
+from app.db.database import SessionLocal
+from app.db.crud import EmbeddingCacheRepository
+from app.db.vector_codec import EMBEDDING_DTYPE
+
+
+class EmbeddingCache:
+
+    # TWO-TIER CACHE OF TEXT EMBEDDINGS
+    # A BOUNDED IN-MEMORY LRU SITS IN FRONT OF THE embedding_cache TABLE
+
+    def __init__(self, max_size: int, session_factory: Callable = SessionLocal, persistent: bool = True):
+        self.max_size = max(0, max_size)
+        self.session_factory = session_factory
+        self.persistent = persistent
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # COUNTERS
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.provider_calls = 0
+        self.provider_seconds = 0.0
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lru_get(self, key: str) -> Optional[np.ndarray]:
+        embedding = self._lru.get(key)
+        if embedding is not None:
+            self._lru.move_to_end(key)
+        return embedding
+
+    def _lru_put(self, key: str, embedding: np.ndarray) -> None:
+        if self.max_size == 0:
+            return
+        self._lru[key] = embedding
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def get_or_embed(self,
+                     model: str,
+                     texts: List[str],
+                     embed_fn: Callable[[List[str]], List[List[float]]]) -> List[np.ndarray]:
+        """
+        Look up embeddings for texts, calling the provider only for texts not cached yet.
+
+        Args:
+            model: The embedding model the vectors belong to
+            texts: The texts to embed
+            embed_fn: Called once with the texts that missed both tiers
+
+        Returns:
+            One embedding per text, in the same order as the input
+        """
+
+        keys = [self.make_key(model, text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+
+        # MEMORY TIER
+        with self._lock:
+            for key in keys:
+                embedding = self._lru_get(key)
+                if embedding is not None:
+                    found[key] = embedding
+            memory_hits = len(found)
+
+        # DB TIER
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        db_found = {}
+        if missing and self.persistent:
+            with self.session_factory() as db:
+                db_found = EmbeddingCacheRepository.get_embeddings(db, missing)
+            found.update(db_found)
+
+        # PROVIDER -- EACH DISTINCT TEXT IS EMBEDDED ONCE
+        texts_by_key = dict(zip(keys, texts))
+        missing = [key for key in missing if key not in db_found]
+        computed = {}
+        if missing:
+            started = time.perf_counter()
+            embeddings = embed_fn([texts_by_key[key] for key in missing])
+            elapsed = time.perf_counter() - started
+            # FLOAT32 ARRAYS ARE A QUARTER OF THE SIZE OF LISTS OF PYTHON FLOATS
+            computed = {
+                key: np.asarray(embedding, dtype=EMBEDDING_DTYPE)
+                for key, embedding in zip(missing, embeddings)
+            }
+            found.update(computed)
+
+            if self.persistent:
+                with self.session_factory() as db:
+                    EmbeddingCacheRepository.put_embeddings(db, model, computed)
+        else:
+            elapsed = 0.0
+
+        with self._lock:
+            for key, embedding in db_found.items():
+                self._lru_put(key, embedding)
+            for key, embedding in computed.items():
+                self._lru_put(key, embedding)
+
+            self.memory_hits += memory_hits
+            self.db_hits += len(db_found)
+            self.misses += len(missing)
+            if missing:
+                self.provider_calls += 1
+                self.provider_seconds += elapsed
+
+        return [found[key] for key in keys]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.db_hits
+            lookups = hits + self.misses
+            seconds_per_text = self.provider_seconds / self.misses if self.misses else 0.0
+            return {
+                "size": len(self._lru),
+                "max_size": self.max_size,
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "provider_calls": self.provider_calls,
+                "provider_seconds": self.provider_seconds,
+                # HITS PRICED AT THE OBSERVED PER-TEXT PROVIDER LATENCY
+                "estimated_seconds_saved": hits * seconds_per_text
+            }
+
+
+class QueryEmbeddingCache:
+
+    # IN-MEMORY LRU + TTL CACHE OF QUESTION EMBEDDINGS
+    # KEYED BY EMBEDDING MODEL AND NORMALIZED QUESTION TEXT
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max(0, max_size)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # COUNTERS
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # CASE AND WHITESPACE DO NOT MAKE A DIFFERENT QUESTION
+        return " ".join(text.split()).casefold()
+
+    def _get(self, key: Tuple[str, str], now: float) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, embedding = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return embedding
+
+    def _put(self, key: Tuple[str, str], embedding: List[float], now: float) -> None:
+        if self.max_size == 0:
+            return
+        with self._lock:
+            self._entries[key] = (now + self.ttl_seconds, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_embed(self, model: str, text: str, embed_fn: Callable[[str], List[float]]) -> List[float]:
+        started = time.perf_counter()
+        key = (model, self.normalize(text))
+
+        embedding = self._get(key, time.monotonic())
+        if embedding is not None:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.hits += 1
+                self.hit_seconds += elapsed
+            return embedding
+
+        embedding = embed_fn(text)
+        self._put(key, embedding, time.monotonic())
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += elapsed
+        return embedding
+
+    def get_or_submit(self, model: str, text: str, submit_fn: Callable[[str], Future]) -> Future:
+        # NON-BLOCKING get_or_embed: A HIT IS AN ALREADY-RESOLVED FUTURE, A MISS IS
+        # HANDED TO submit_fn (E.G. A BATCHER) AND CACHED WHEN IT RESOLVES
+        started = time.perf_counter()
+        key = (model, self.normalize(text))
+
+        embedding = self._get(key, time.monotonic())
+        if embedding is not None:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.hits += 1
+                self.hit_seconds += elapsed
+            future = Future()
+            future.set_result(embedding)
+            return future
+
+        def store(done: Future) -> None:
+            if done.cancelled() or done.exception() is not None:
+                return
+            self._put(key, done.result(), time.monotonic())
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.misses += 1
+                self.miss_seconds += elapsed
+
+        future = submit_fn(text)
+        future.add_done_callback(store)
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "avg_hit_ms": 1000 * self.hit_seconds / self.hits if self.hits else 0.0,
+                "avg_miss_ms": 1000 * self.miss_seconds / self.misses if self.misses else 0.0
+            }
+
+
+# SHARED BY EVERY UPLOAD IN THIS PROCESS
+embedding_cache = EmbeddingCache(
+    max_size=settings.EMBEDDING_CACHE_SIZE,
+    persistent=settings.EMBEDDING_CACHE_PERSISTENT
+)
+
+# SHARED BY EVERY QUESTION IN THIS PROCESS
+query_embedding_cache = QueryEmbeddingCache(
+    max_size=settings.QUERY_CACHE_SIZE,
+    ttl_seconds=settings.QUERY_CACHE_TTL_SECONDS
+)
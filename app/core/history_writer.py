@@ -0,0 +1,221 @@
+from typing import Dict, Any, Callable, List, Optional
+from datetime import datetime
+import asyncio
+import logging
+import time
+import uuid
+
+from app.config import settings
+from app.db.database import AsyncSessionLocal
+from app.db.crud import QARepository
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+FULL_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+history_records = metrics.counter(
+    "knbqa_qa_history_records_total", "QA history records by what happened to them.", "outcome"
+)
+
+
+class QAHistoryWriter:
+
+    # WRITE-BEHIND FOR QA HISTORY: ANSWERS QUEUE THEIR RECORD AND RETURN, A FLUSHER TASK
+    # INSERTS THEM batch_size AT A TIME (OR WHATEVER IS QUEUED AFTER flush_interval) AND
+    # DRAINS THE QUEUE ON close(). LIVES ON THE EVENT LOOP -- CALL submit() FROM IT
+    # WHEN THE QUEUE IS FULL, full_policy DECIDES: "block" WAITS UP TO block_timeout AND
+    # THEN DROPS THE NEW RECORD, "drop_newest" DROPS IT AT ONCE, "drop_oldest" EVICTS THE
+    # OLDEST QUEUED ONE
+
+    def __init__(self,
+                 max_queue_size: int,
+                 batch_size: int,
+                 flush_interval: float,
+                 full_policy: str = "block",
+                 block_timeout: float = 1.0,
+                 enabled: bool = True,
+                 session_factory: Callable = AsyncSessionLocal):
+        if full_policy not in FULL_POLICIES:
+            raise ValueError(f"Unknown QA history full policy: {full_policy}")
+        self.max_queue_size = max(1, max_queue_size)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval)
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self.enabled = enabled
+        self.session_factory = session_factory
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # COUNTERS
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.last_flush_ms = 0.0
+
+        metrics.gauge("knbqa_qa_history_queue_depth", "QA history records waiting to be written.",
+                      lambda: self.queue_depth)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @staticmethod
+    def make_record(question: str, answer: str, chain_trace: Dict[str, Any],
+                    record_id: Optional[uuid.UUID] = None,
+                    created_at: Optional[datetime] = None) -> Dict[str, Any]:
+        # TIMESTAMPED NOW, NOT AT FLUSH TIME, SO HISTORY KEEPS ANSWER ORDER
+        return {
+            "id": record_id or uuid.uuid4(),
+            "question": question,
+            "answer": answer,
+            "chain_trace": chain_trace,
+            "created_at": created_at or datetime.utcnow()
+        }
+
+    def _start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._wake = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="qa-history-writer")
+
+    async def submit(self, record: Dict[str, Any]) -> bool:
+        """
+        Queue a history record (see make_record).
+
+        Args:
+            record: Column values for one QARecord
+
+        Returns:
+            False if the record was dropped because the queue was full
+        """
+
+        if not self.enabled or self._closing:
+            # NO WRITE-BEHIND (OR SHUTTING DOWN) -- WRITE IT NOW
+            await self._flush([record])
+            return True
+        if self._task is None:
+            self._start()
+
+        queue = self._queue
+        if queue.full():
+            if self.full_policy == "drop_oldest":
+                queue.get_nowait()
+                self._drop()
+            elif self.full_policy == "drop_newest":
+                self._drop()
+                return False
+            else:
+                try:
+                    await asyncio.wait_for(queue.put(record), self.block_timeout)
+                except asyncio.TimeoutError:
+                    self._drop()
+                    return False
+                self._queued()
+                return True
+        queue.put_nowait(record)
+        self._queued()
+        return True
+
+    def _queued(self) -> None:
+        self.enqueued += 1
+        depth = self._queue.qsize()
+        # WAKE THE FLUSHER FOR THE FIRST RECORD (STARTS ITS INTERVAL) AND FOR A FULL BATCH
+        if depth == 1 or depth >= self.batch_size:
+            self._wake.set()
+
+    def _drop(self) -> None:
+        self.dropped += 1
+        if metrics.enabled:
+            history_records.inc(1, "dropped")
+        logger.warning("QA history queue full (%d records), dropped a record", self.max_queue_size)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        while True:
+            if queue.empty():
+                if self._closing:
+                    return
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            # WAIT FOR A FULL BATCH, THE INTERVAL OR close()
+            deadline = loop.time() + self.flush_interval
+            while queue.qsize() < self.batch_size and not self._closing:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = [queue.get_nowait() for _ in range(min(self.batch_size, queue.qsize()))]
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        started = time.perf_counter()
+        try:
+            async with self.session_factory() as session:
+                await QARepository.acreate_qa_records(session, batch)
+        except Exception:
+            self.failed += len(batch)
+            if metrics.enabled:
+                history_records.inc(len(batch), "failed")
+            logger.exception("Could not write %d QA history records", len(batch))
+            return
+        elapsed = time.perf_counter() - started
+        self.written += len(batch)
+        self.flushes += 1
+        self.flush_seconds += elapsed
+        self.last_flush_ms = 1000 * elapsed
+        if metrics.enabled:
+            history_records.inc(len(batch), "written")
+        metrics.record_stage("qa_history.flush", elapsed)
+
+    async def close(self) -> None:
+        # WRITE EVERYTHING STILL QUEUED, THEN STOP
+        self._closing = True
+        if self._task is not None:
+            self._wake.set()
+            await self._task
+        # A LATER EVENT LOOP (A NEW LIFESPAN) STARTS A FRESH FLUSHER
+        self._queue = self._wake = self._task = None
+        self._closing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queue_depth": self.queue_depth,
+            "max_queue_size": self.max_queue_size,
+            "full_policy": self.full_policy,
+            "batch_size": self.batch_size,
+            "flush_interval_seconds": self.flush_interval,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "avg_flush_ms": 1000 * self.flush_seconds / self.flushes if self.flushes else 0.0,
+            "last_flush_ms": self.last_flush_ms
+        }
+
+
+# SHARED BY EVERY REQUEST IN THIS PROCESS, CLOSED IN THE app.main LIFESPAN
+qa_history_writer = QAHistoryWriter(
+    max_queue_size=settings.QA_HISTORY_QUEUE_SIZE,
+    batch_size=settings.QA_HISTORY_BATCH_SIZE,
+    flush_interval=settings.QA_HISTORY_FLUSH_INTERVAL_SECONDS,
+    full_policy=settings.QA_HISTORY_FULL_POLICY,
+    block_timeout=settings.QA_HISTORY_BLOCK_TIMEOUT_SECONDS,
+    enabled=settings.QA_HISTORY_WRITE_BEHIND
+)
@@ -0,0 +1,233 @@
+from typing import Dict, Any, Optional, Set
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.db.models import Document, DocumentChunk, IngestionJob
+from app.core.quantization import make_codec
+
+# BUMPED WHEN THE FILE LAYOUT CHANGES -- SNAPSHOTS OF ANOTHER FORMAT ARE IGNORED
+SNAPSHOT_FORMAT = 2
+
+MANIFEST = "manifest.json"
+LOCK_FILE = "snapshot.lock"
+
+# TIMESTAMPS ARE SET BY WHICHEVER APP HOST WROTE THE ROW -- REPLAY A LITTLE EARLIER THAN
+# THE MARKS SO CLOCK SKEW BETWEEN HOSTS CANNOT HIDE A CHANGE
+CLOCK_SKEW_MARGIN = timedelta(minutes=5)
+
+
+class StoredSnapshot:
+    # ONE SAVED VERSION, LOADED INTO MEMORY -- ITS MANIFEST AND ITS ARRAYS BY NAME
+
+    __slots__ = ("manifest", "arrays")
+
+    def __init__(self, manifest: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+        self.manifest = manifest
+        self.arrays = arrays
+
+    @property
+    def high_water_mark(self) -> Optional[datetime]:
+        value = self.manifest.get("high_water_mark")
+        return datetime.fromisoformat(value) if value else None
+
+    @property
+    def saved_at(self) -> datetime:
+        return datetime.fromisoformat(self.manifest["saved_at"])
+
+
+class IndexSnapshot(StoredSnapshot):
+    # A SAVED VECTOR INDEX
+
+    __slots__ = ("codec",)
+
+    def __init__(self, manifest: Dict[str, Any], arrays: Dict[str, np.ndarray], codec):
+        super().__init__(manifest, arrays)
+        self.codec = codec
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self.arrays["codes"]
+
+    @property
+    def chunk_ids(self) -> np.ndarray:
+        return self.arrays["chunk_ids"]
+
+    @property
+    def document_ids(self) -> np.ndarray:
+        return self.arrays["document_ids"]
+
+
+class SnapshotStore:
+
+    # VERSIONED ON-DISK COPIES OF AN INDEX, SO A RESTART LOADS .npy FILES AND REPLAYS
+    # WHAT CHANGED INSTEAD OF DECODING EVERY EMBEDDING (OR TOKENIZING EVERY CHUNK) IN THE DB
+    #
+    #   manifest.json          CURRENT VERSION, SWAPPED WITH os.replace
+    #   v-<version>/<name>.npy ONE FILE PER ARRAY, LISTED IN THE MANIFEST
+    #
+    # THE VECTOR INDEX SAVES codes (NO TOMBSTONES, THEY ARE DROPPED ON SAVE), chunk_ids
+    # AND document_ids AS (rows, 16) uint8 UUIDS, AND codec.<key> FOR THE QUANTIZER STATE
+    # (SEE save / load); THE LEXICAL INDEX SAVES ITS OWN ARRAYS THROUGH save_arrays
+    #
+    # THE MANIFEST CARRIES TWO MARKS: THE NEWEST chunk created_at IN THE DB WHEN THE
+    # SNAPSHOT WAS TAKEN, AND THE TIME IT WAS TAKEN (FOR INGESTION JOBS THAT FINISHED
+    # -- COMMITTED THEIR CHUNKS -- OR FAILED AFTERWARDS)
+
+    def __init__(self, directory: str, database: str = ""):
+        self.directory = directory
+        # A SNAPSHOT OF ANOTHER DATABASE'S INDEX IS NEVER REPLAYED ONTO THIS ONE
+        self.database = hashlib.sha256(database.encode("utf-8")).hexdigest()[:16]
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.directory, *parts)
+
+    @contextmanager
+    def _lock(self):
+        # EVERY WORKER SAVES ON SHUTDOWN -- ONE AT A TIME
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(MANIFEST)) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if manifest.get("format") != SNAPSHOT_FORMAT:
+            return None
+        return manifest
+
+    def load_arrays(self, **fields: Any) -> Optional[StoredSnapshot]:
+        # THE CURRENT VERSION, OR None IF THERE IS NONE OR ITS MANIFEST DISAGREES WITH fields
+        with self._lock():
+            manifest = self.read_manifest()
+            if manifest is None or manifest.get("database") != self.database:
+                return None
+            if any(manifest.get(key) != value for key, value in fields.items()):
+                return None
+            version = manifest["path"]
+            arrays = {name: np.load(self._path(version, f"{name}.npy")) for name in manifest["arrays"]}
+            return StoredSnapshot(manifest, arrays)
+
+    def save_arrays(self,
+                    arrays: Dict[str, np.ndarray],
+                    high_water_mark: Optional[datetime],
+                    saved_at: datetime,
+                    **fields: Any) -> Dict[str, Any]:
+        # WRITE A NEW VERSION HOLDING arrays, WITH fields ADDED TO ITS MANIFEST
+        with self._lock():
+            previous = self.read_manifest()
+            version = (previous["version"] + 1) if previous else 1
+            path = f"v-{version:08d}"
+            shutil.rmtree(self._path(path), ignore_errors=True)
+            os.makedirs(self._path(path))
+            for name, array in arrays.items():
+                with open(self._path(path, f"{name}.npy"), "wb") as f:
+                    np.save(f, np.ascontiguousarray(array))
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            manifest = {
+                **fields,
+                "format": SNAPSHOT_FORMAT,
+                "version": version,
+                "path": path,
+                "arrays": sorted(arrays),
+                "database": self.database,
+                "high_water_mark": high_water_mark.isoformat() if high_water_mark else None,
+                "saved_at": saved_at.isoformat()
+            }
+            temp_path = self._path(f"{MANIFEST}.tmp")
+            with open(temp_path, "w") as f:
+                json.dump(manifest, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self._path(MANIFEST))
+
+            for name in os.listdir(self.directory):
+                if name.startswith("v-") and name != path:
+                    shutil.rmtree(self._path(name), ignore_errors=True)
+            return manifest
+
+    def load(self, quantization: str) -> Optional[IndexSnapshot]:
+        # THE CURRENT VECTOR INDEX VERSION, OR None IF THERE IS NONE USABLE WITH THIS quantization
+        stored = self.load_arrays(quantization=quantization)
+        if stored is None:
+            return None
+        codec = make_codec(quantization, stored.manifest["dim"])
+        codec.load_state({
+            name[len("codec."):]: array for name, array in stored.arrays.items() if name.startswith("codec.")
+        })
+        return IndexSnapshot(stored.manifest, stored.arrays, codec)
+
+    def save(self,
+             codec,
+             codes: np.ndarray,
+             chunk_ids: np.ndarray,
+             document_ids: np.ndarray,
+             high_water_mark: Optional[datetime],
+             saved_at: datetime) -> Dict[str, Any]:
+        arrays = {"codes": codes, "chunk_ids": chunk_ids, "document_ids": document_ids}
+        arrays.update((f"codec.{key}", value) for key, value in codec.state().items())
+        return self.save_arrays(
+            arrays, high_water_mark, saved_at,
+            rows=len(chunk_ids), dim=codec.dim, quantization=codec.name
+        )
+
+
+def chunk_high_water_mark(db: Session) -> Optional[datetime]:
+    # NEWEST COMMITTED CHUNK -- TAKEN BEFORE THE INDEX IS COPIED, SO THE COPY COVERS IT
+    return db.query(func.max(DocumentChunk.created_at)).scalar()
+
+
+def documents_to_replay(db: Session, snapshot: StoredSnapshot) -> Set[uuid.UUID]:
+    """
+    Documents whose chunks may differ from what the snapshot holds.
+
+    A document is replayed when it has chunks newer than the high-water mark
+    (uploaded or re-ingested since), or when one of its ingestion jobs changed
+    state after the snapshot was taken -- a job that was still running then
+    may have committed chunks older than the mark, or rolled back rows the
+    in-memory index already held.
+
+    Args:
+        db: Database session
+        snapshot: The loaded snapshot
+
+    Returns:
+        Ids of the documents to drop from the snapshot and reload from the DB
+    """
+
+    query = db.query(DocumentChunk.document_id).distinct()
+    high_water_mark = snapshot.high_water_mark
+    if high_water_mark is not None:
+        query = query.filter(DocumentChunk.created_at > high_water_mark - CLOCK_SKEW_MARGIN)
+    changed = {row[0] for row in query}
+
+    jobs = (
+        db.query(IngestionJob.document_id)
+        .filter(IngestionJob.updated_at > snapshot.saved_at - CLOCK_SKEW_MARGIN)
+        .distinct()
+    )
+    changed.update(row[0] for row in jobs)
+    return changed
+
+
+def existing_documents(db: Session) -> Set[uuid.UUID]:
+    # DOCUMENTS DELETE THEIR CHUNKS -- A SNAPSHOT DOCUMENT MISSING HERE WAS DELETED SINCE
+    return {row[0] for row in db.query(Document.id)}
@@ -0,0 +1,331 @@
+from typing import Callable, Dict, List, Optional, Set, BinaryIO
+from concurrent.futures import ThreadPoolExecutor
+import codecs
+import logging
+import os
+import shutil
+import socket
+import threading
+import uuid
+
+from app.config import settings
+from app.db.database import SessionLocal
+from app.db.crud import ChunkRepository, IngestionJobRepository
+from app.core.document_processor import DocumentProcessor, iter_decoded, content_hash
+from app.core.vector_index import vector_index
+from app.core.lexical_index import lexical_index
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionQueueFull(Exception):
+    pass
+
+
+class IngestionJobLost(Exception):
+    # THE JOB'S LEASE LAPSED AND ANOTHER WORKER TOOK IT OVER
+    pass
+
+
+class IngestionWorker:
+
+    # RUNS CHUNKING AND EMBEDDING FOR UPLOADED DOCUMENTS ON A BOUNDED THREAD POOL
+    # JOB STATE LIVES IN THE ingestion_jobs TABLE AND THE UPLOAD IN THE SPOOL
+    # DIRECTORY, SO BOTH SURVIVE RESTARTS
+    # SEVERAL PROCESSES MAY SUBMIT THE SAME JOB -- EACH RUN FIRST CLAIMS IT WITH ONE CONDITIONAL
+    # UPDATE, SO ONLY ONE OF THEM PROCESSES IT. A CLAIM IS A LEASE THE HEARTBEAT THREAD RENEWS;
+    # JOBS WHOSE LEASE LAPSED (THEIR WORKER DIED) ARE PICKED UP BY THE HEARTBEAT OF ANOTHER ONE
+    # JOBS OF ANOTHER KIND (SEE register_job_kind) GET THE SAME CLAIMS, LEASES AND FAILURE HANDLING
+
+    def __init__(self,
+                 processor: DocumentProcessor,
+                 max_workers: int,
+                 max_pending: int,
+                 lease_seconds: float = 120.0,
+                 session_factory: Callable = SessionLocal):
+        self.processor = processor
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self.lease_seconds = max(1.0, lease_seconds)
+        self.session_factory = session_factory
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._heartbeat: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._pending = 0
+        # SUBMITTED HERE AND NOT FINISHED / CLAIMED BY THIS WORKER AND RUNNING, WITH ITS SPOOLED UPLOAD
+        self._submitted: Set[uuid.UUID] = set()
+        self._claimed: Dict[uuid.UUID, Optional[str]] = {}
+        # IngestionJob.kind -> handler(db, job, worker_id), "document" JOBS ARE RUN HERE
+        self._job_handlers: Dict[str, Callable] = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="ingestion"
+            )
+            self._stopping.clear()
+            self._heartbeat = threading.Thread(target=self._beat, name="ingestion-heartbeat", daemon=True)
+            self._heartbeat.start()
+        return self._executor
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def is_full(self) -> bool:
+        return self._pending >= self.max_pending
+
+    def submit(self, job_id: uuid.UUID, force: bool = False) -> None:
+        # QUEUE A JOB, RAISES IngestionQueueFull WHEN THE BACKLOG IS AT ITS LIMIT
+        with self._lock:
+            if job_id in self._submitted:
+                return
+            if not force and self._pending >= self.max_pending:
+                raise IngestionQueueFull()
+            self._pending += 1
+            self._submitted.add(job_id)
+            executor = self._get_executor()
+        executor.submit(self._run, job_id)
+
+    def register_job_kind(self, kind: str, handler: Callable) -> None:
+        # handler RUNS A CLAIMED JOB TO COMPLETION, WRITING THROUGH update_owned_job AND RAISING
+        # IngestionJobLost WHEN THAT FAILS -- ANY OTHER EXCEPTION MARKS THE JOB FAILED
+        self._job_handlers[kind] = handler
+
+    def resume_unfinished(self) -> int:
+        # QUEUED JOBS AND RUNNING ONES WHOSE WORKER IS GONE -- JOBS OTHER LIVE WORKERS HOLD ARE LEFT
+        # ALONE, AND A QUEUED JOB ANOTHER WORKER ALSO SUBMITTED IS RUN BY WHICHEVER CLAIMS IT FIRST
+        with self.session_factory() as db:
+            job_ids = IngestionJobRepository.get_claimable_job_ids(db)
+
+        for job_id in job_ids:
+            self.submit(job_id, force=True)
+        return len(job_ids)
+
+    def shutdown(self) -> None:
+        # QUEUED JOBS STAY "queued" IN THE DB AND ARE RESUMED ON NEXT STARTUP
+        with self._lock:
+            executor, self._executor = self._executor, None
+            heartbeat, self._heartbeat = self._heartbeat, None
+        if executor is not None:
+            # RUNNING JOBS FINISH FIRST -- THE HEARTBEAT KEEPS THEIR LEASES ALIVE MEANWHILE
+            executor.shutdown(wait=True, cancel_futures=True)
+        if heartbeat is not None:
+            self._stopping.set()
+            heartbeat.join()
+
+    def _beat(self) -> None:
+        while not self._stopping.wait(self.lease_seconds / 4):
+            try:
+                with self._lock:
+                    claimed = list(self._claimed)
+                with self.session_factory() as db:
+                    IngestionJobRepository.renew_job_leases(db, claimed, self.worker_id, self.lease_seconds)
+                    orphaned = IngestionJobRepository.get_claimable_job_ids(db, include_queued=False)
+                for job_id in orphaned:
+                    logger.warning("Ingestion job %s lost its worker, taking it over", job_id)
+                    self.submit(job_id, force=True)
+            except Exception:
+                logger.exception("Ingestion heartbeat failed")
+
+    def _run(self, job_id: uuid.UUID) -> None:
+        try:
+            with self.session_factory() as db:
+                self._process_job(db, job_id)
+        except IngestionJobLost:
+            with self.session_factory() as db:
+                job = IngestionJobRepository.get_job(db, job_id)
+            if job is None:
+                # ITS DOCUMENT WAS DELETED MEANWHILE -- NO WORKER WILL READ THE UPLOAD AGAIN
+                logger.warning("Ingestion job %s was deleted while it ran, dropped its result", job_id)
+                remove_spooled_upload(self._claimed_source_path(job_id))
+            else:
+                logger.warning("Ingestion job %s was taken over by another worker, dropped its result", job_id)
+        except Exception as exc:
+            logger.exception("Ingestion job %s failed", job_id)
+            with self.session_factory() as db:
+                job = IngestionJobRepository.get_job(db, job_id)
+                if job is None:
+                    remove_spooled_upload(self._claimed_source_path(job_id))
+                else:
+                    # READ BEFORE THE UPDATE, WHICH CLEARS IT
+                    source_path = job.source_path
+                    # ONLY WHILE THE JOB IS STILL OURS
+                    if IngestionJobRepository.update_owned_job(
+                        db, job_id, self.worker_id, status="failed", error=str(exc), source_path=None,
+                        lease_owner=None, lease_expires_at=None
+                    ):
+                        remove_spooled_upload(source_path)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._submitted.discard(job_id)
+                self._claimed.pop(job_id, None)
+
+    def _claimed_source_path(self, job_id: uuid.UUID) -> Optional[str]:
+        with self._lock:
+            return self._claimed.get(job_id)
+
+    def _process_job(self, db, job_id: uuid.UUID) -> None:
+        # ANOTHER WORKER HOLDS IT, OR IT IS FINISHED ALREADY
+        if not IngestionJobRepository.claim_job(db, job_id, self.worker_id, self.lease_seconds):
+            return
+        job = IngestionJobRepository.get_job(db, job_id)
+        with self._lock:
+            self._claimed[job_id] = job.source_path
+        handler = self._job_handlers.get(job.kind)
+        if handler is not None:
+            handler(db, job, self.worker_id)
+            return
+        document_id = job.document_id
+        source_path = job.source_path
+        legacy_content = job.document.content if not source_path else None
+
+        # THE DOCUMENT'S STORED CHUNKS (NONE FOR A NEW UPLOAD) -- NEW CHUNKS WITH THE SAME TEXT
+        # KEEP THE ROW, ITS EMBEDDING AND ITS INDEX ENTRIES, THE REST ARE DELETED AT THE END
+        existing: Dict[str, List[uuid.UUID]] = {}
+        stored_positions: Dict[uuid.UUID, int] = {}
+        for chunk_id, chunk_index, content in ChunkRepository.get_chunk_contents(db, document_id):
+            existing.setdefault(content_hash(content), []).append(chunk_id)
+            stored_positions[chunk_id] = chunk_index
+
+        if source_path:
+            source = open(source_path, "rb")
+            total = self.processor.estimate_chunk_count(os.path.getsize(source_path))
+            text_stream = iter_decoded(source, read_size=settings.UPLOAD_READ_SIZE)
+        else:
+            source = None
+            total = self.processor.estimate_chunk_count(len(legacy_content or ""))
+            text_stream = iter([legacy_content or ""])
+        self._report_progress(job_id, 0, total)
+
+        embedded = 0
+        reused = 0
+        added_ids: List[uuid.UUID] = []
+        try:
+            for chunks_data in self.processor.process_stream(text_stream, document_id, existing):
+                new_chunks = [chunk_data for chunk_data in chunks_data if "id" not in chunk_data]
+                kept_chunks = [chunk_data for chunk_data in chunks_data if "id" in chunk_data]
+
+                # STORE CHUNKS IN DB -- COMMITTED TOGETHER ONCE THE WHOLE DOCUMENT IS IN
+                chunk_ids = ChunkRepository.create_chunks(
+                    db, document_id, new_chunks, start_index=embedded, commit=False
+                )
+                ChunkRepository.update_chunk_positions(db, [
+                    {
+                        "id": chunk_data["id"],
+                        "chunk_index": chunk_data["metadata"]["chunk_index"],
+                        "chunk_metadata": chunk_data["metadata"]
+                    }
+                    for chunk_data in kept_chunks
+                    if stored_positions[chunk_data["id"]] != chunk_data["metadata"]["chunk_index"]
+                ], commit=False)
+
+                # ADD NEW CHUNKS TO THE IN-MEMORY INDEXES, KEPT ONES ARE ALREADY THERE
+                vector_index.add(
+                    chunk_ids,
+                    [document_id] * len(chunk_ids),
+                    [chunk_data["embedding"] for chunk_data in new_chunks]
+                )
+                lexical_index.add(
+                    chunk_ids,
+                    [document_id] * len(chunk_ids),
+                    [chunk_data["content"] for chunk_data in new_chunks]
+                )
+                added_ids.extend(chunk_ids)
+
+                embedded += len(chunks_data)
+                reused += len(kept_chunks)
+                self._report_progress(job_id, embedded, max(total, embedded), reused)
+
+            # STORED CHUNKS NO NEW CHUNK MATCHED ARE GONE FROM THE TEXT
+            stale_ids = [chunk_id for chunk_ids in existing.values() for chunk_id in chunk_ids]
+            ChunkRepository.delete_chunks(db, stale_ids, commit=False)
+
+            # COMPLETED IN THE SAME TRANSACTION AS THE CHUNKS, AND ONLY IF THE LEASE IS STILL OURS
+            if not IngestionJobRepository.update_owned_job(
+                db, job_id, self.worker_id, commit=False, status="completed", chunks_embedded=embedded,
+                chunks_total=embedded, chunks_reused=reused, source_path=None,
+                lease_owner=None, lease_expires_at=None
+            ):
+                raise IngestionJobLost()
+            db.commit()
+        except Exception:
+            db.rollback()
+            # THE STORED CHUNKS ARE STILL COMMITTED -- ONLY THE NEW ONES LEAVE THE INDEXES
+            if added_ids:
+                vector_index.remove_chunks(added_ids)
+                lexical_index.remove_chunks(added_ids)
+            raise
+        finally:
+            if source is not None:
+                source.close()
+
+        # PLAIN UPLOADS HAVE NO STALE CHUNKS AND SKIP THIS
+        if stale_ids:
+            vector_index.remove_chunks(stale_ids)
+            lexical_index.remove_chunks(stale_ids)
+        remove_spooled_upload(source_path)
+
+    def _report_progress(self, job_id: uuid.UUID, embedded: int, total: int, reused: int = 0) -> None:
+        # OWN SESSION SO PROGRESS IS VISIBLE WHILE THE CHUNK INSERTS ARE UNCOMMITTED
+        with self.session_factory() as db:
+            IngestionJobRepository.update_owned_job(
+                db, job_id, self.worker_id, chunks_embedded=embedded, chunks_total=total, chunks_reused=reused
+            )
+
+
+def spool_path_for(upload_id: uuid.UUID) -> str:
+    # KEYED BY THE NEW DOCUMENT'S ID FOR AN UPLOAD, A FRESH uuid4 FOR AN UPDATE
+    return os.path.join(settings.UPLOAD_SPOOL_DIR, f"{upload_id}.upload")
+
+
+def spool_upload(fileobj: BinaryIO, path: str) -> int:
+    """
+    Copy an upload to the spool directory, checking it decodes as UTF-8 on the way.
+    
+    Args:
+        fileobj: The uploaded file
+        path: Where to write the spooled copy
+        
+    Returns:
+        The number of bytes written
+    """
+    
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    written = 0
+    try:
+        with open(path, "wb") as spooled:
+            while True:
+                data = fileobj.read(settings.UPLOAD_READ_SIZE)
+                if not data:
+                    break
+                decoder.decode(data)
+                spooled.write(data)
+                written += len(data)
+            decoder.decode(b"", final=True)
+    except Exception:
+        remove_spooled_upload(path)
+        raise
+    return written
+
+
+def remove_spooled_upload(path: Optional[str]) -> None:
+    # A FILE, OR THE DIRECTORY OF A BULK UPLOAD
+    if path and os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif path and os.path.exists(path):
+        os.remove(path)
+
+
+# SHARED BY EVERY UPLOAD IN THIS PROCESS
+ingestion_worker = IngestionWorker(
+    processor=DocumentProcessor(),
+    max_workers=settings.INGESTION_WORKERS,
+    max_pending=settings.INGESTION_MAX_PENDING,
+    lease_seconds=settings.INGESTION_JOB_LEASE_SECONDS
+)
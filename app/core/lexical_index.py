@@ -0,0 +1,749 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Sequence
+from collections import Counter
+from datetime import datetime
+import logging
+import math
+import os
+import re
+import threading
+import time
+import uuid
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db.models import DocumentChunk
+from app.core.ann import top_k_indices
+from app.core.shared_index import ID_WIDTH
+from app.core.vector_index import uuid_rows, id_keys
+from app.core.index_snapshot import (
+    SnapshotStore,
+    StoredSnapshot,
+    chunk_high_water_mark,
+    documents_to_replay,
+    existing_documents
+)
+
+logger = logging.getLogger(__name__)
+
+# WORDS PLUS JOINED IDENTIFIERS SUCH AS "ERR-1042", "v2.3.1" OR "max_connections"
+_TOKEN_PATTERN = re.compile(r"\w+(?:[-.:/]\w+)*")
+_PART_PATTERN = re.compile(r"[^\W_]+")
+
+# BUMPED WHEN tokenize() CHANGES -- SAVED POSTINGS OF ANOTHER VERSION ARE REBUILT
+TOKENIZER_VERSION = 1
+
+
+def tokenize(text: str) -> List[str]:
+    # LOWERCASED TOKENS -- A COMPOUND TOKEN IS KEPT WHOLE AND ALSO SPLIT INTO ITS PARTS
+    # SO "max_connections" MATCHES BOTH THE EXACT KEY AND THE WORD "connections"
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = _PART_PATTERN.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class _Segment:
+
+    # IMMUTABLE CSR POSTINGS FOR A SET OF ROWS: THE POSTINGS OF terms[i] ARE
+    # rows[offsets[i]:offsets[i + 1]] WITH FREQUENCIES tfs[...], terms SORTED ASCENDING
+    # keys ARE THE CHUNK IDS OF THE SEGMENT'S ROWS, SORTED, AND key_rows THEIR ROWS -- FINDING
+    # A CHUNK IS A BINARY SEARCH PER SEGMENT, NOT A SCAN OVER EVERY ROW OF THE INDEX
+
+    __slots__ = ("terms", "offsets", "rows", "tfs", "keys", "key_rows")
+
+    def __init__(self,
+                 terms: np.ndarray,
+                 offsets: np.ndarray,
+                 rows: np.ndarray,
+                 tfs: np.ndarray,
+                 keys: np.ndarray,
+                 key_rows: np.ndarray):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.keys = keys
+        self.key_rows = key_rows
+
+    @classmethod
+    def from_triples(cls,
+                     term_ids: np.ndarray,
+                     rows: np.ndarray,
+                     tfs: np.ndarray,
+                     keys: np.ndarray,
+                     key_rows: np.ndarray) -> "_Segment":
+        # (term, row, tf) TRIPLES, AT MOST ONE PER (term, row) PAIR, AND THE (chunk key, row) OF EVERY ROW
+        order = np.lexsort((rows, term_ids))
+        term_ids, rows, tfs = term_ids[order], rows[order], tfs[order]
+        terms, starts = np.unique(term_ids, return_index=True)
+        offsets = np.append(starts, len(term_ids)).astype(np.int64)
+        key_order = np.argsort(keys, kind="stable")
+        return cls(
+            terms.astype(np.int32),
+            offsets,
+            rows.astype(np.int32),
+            tfs.astype(np.int32),
+            keys[key_order],
+            key_rows[key_order].astype(np.int32)
+        )
+
+    def triples(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return np.repeat(self.terms, np.diff(self.offsets)), self.rows, self.tfs
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        i = np.searchsorted(self.terms, term_id)
+        if i == len(self.terms) or self.terms[i] != term_id:
+            return _EMPTY_ROWS, _EMPTY_ROWS
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.rows[start:end], self.tfs[start:end]
+
+    def find(self, keys: np.ndarray) -> np.ndarray:
+        # ROW OF EACH CHUNK KEY IN THIS SEGMENT, -1 WHERE IT IS NOT HERE
+        if not len(self.keys):
+            return np.full(len(keys), -1, dtype=np.int32)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[positions] == keys, self.key_rows[positions], -1)
+
+    def shifted(self, offset: int) -> "_Segment":
+        # THE SAME POSTINGS WITH EVERY ROW MOVED BY offset
+        return _Segment(self.terms, self.offsets, self.rows + offset, self.tfs, self.keys, self.key_rows + offset)
+
+    @property
+    def size(self) -> int:
+        # ENTRIES A MERGE COPIES AND SORTS -- WHAT SIZE TIERS ARE MEASURED IN
+        return len(self.rows) + len(self.keys)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.terms.nbytes + self.offsets.nbytes + self.rows.nbytes + self.tfs.nbytes
+            + self.keys.nbytes + self.key_rows.nbytes
+        )
+
+
+_EMPTY_ROWS = np.empty(0, dtype=np.int32)
+_EMPTY_KEYS = id_keys(np.empty((0, ID_WIDTH), dtype=np.uint8))
+
+
+class _LexicalSnapshot:
+    # IMMUTABLE VIEW OF THE INDEX -- SWAPPED AS A WHOLE SO READERS NEVER SEE A TORN STATE
+    # IDS ARE (rows, 16) BYTE ARRAYS LIKE THE VECTOR INDEX'S, NOT PYTHON UUID OBJECTS
+    # live_count / live_length ARE COUNTED FROM alive UNLESS THE CALLER KEPT THEM UP TO DATE
+
+    __slots__ = ("segments", "chunk_ids", "document_ids", "lengths", "alive", "live_count", "live_length")
+
+    def __init__(self,
+                 segments: Tuple[_Segment, ...],
+                 chunk_ids: np.ndarray,
+                 document_ids: np.ndarray,
+                 lengths: np.ndarray,
+                 alive: np.ndarray,
+                 live_count: Optional[int] = None,
+                 live_length: Optional[int] = None):
+        self.segments = segments
+        self.chunk_ids = chunk_ids
+        self.document_ids = document_ids
+        self.lengths = lengths
+        self.alive = alive
+        self.live_count = int(alive.sum()) if live_count is None else live_count
+        self.live_length = int(lengths[alive].sum()) if live_length is None else live_length
+
+    def chunk_id(self, row: int) -> uuid.UUID:
+        return uuid.UUID(bytes=self.chunk_ids[row].tobytes())
+
+    def rows_of(self, keys: np.ndarray) -> np.ndarray:
+        # LIVE ROW OF EACH CHUNK KEY, -1 WHERE THE CHUNK IS NOT IN THE INDEX
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        for segment in self.segments:
+            found = segment.find(keys)
+            hit = found >= 0
+            hit[hit] = self.alive[found[hit]]
+            rows[hit] = found[hit]
+        return rows
+
+
+class LexicalIndex:
+
+    # PROCESS-RESIDENT BM25 INDEX OVER CHUNK CONTENT
+    # NEW CHUNKS LAND IN SMALL SEGMENTS; A BACKGROUND THREAD MERGES merge_factor SEGMENTS OF
+    # THE SAME SIZE TIER INTO ONE, SO A POSTING IS RE-SORTED ONCE PER TIER (LOG OF THE CORPUS)
+    # AND THERE ARE FEWER THAN merge_factor SEGMENTS PER TIER. WRITERS ONLY APPEND
+    # DELETED ROWS ARE MASKED OUT AND DROPPED FOR GOOD ONCE THEY ARE A QUARTER OF THE ROWS
+    # WITH snapshots A COLD START LOADS THE LAST SAVED POSTINGS AND RE-TOKENIZES ONLY THE
+    # DOCUMENTS THAT CHANGED SINCE, THE SAME WAY THE VECTOR INDEX REPLAYS (SEE index_snapshot)
+
+    LOAD_BATCH_SIZE = 1000
+    LOAD_SEGMENT_ROWS = 50000
+    MIN_CAPACITY = 1024
+
+    def __init__(self,
+                 k1: float = 1.2,
+                 b: float = 0.75,
+                 merge_factor: int = 8,
+                 snapshots: Optional[SnapshotStore] = None):
+        self.k1 = k1
+        self.b = b
+        self.merge_factor = max(2, merge_factor)
+        self.snapshots = snapshots
+        # HOW THE LAST LOAD WENT -- SOURCE, REPLAYED DOCUMENTS, SECONDS
+        self.load_stats: Dict[str, Any] = {}
+
+        self._lock = threading.Lock()
+        self._vocabulary: Dict[str, int] = {}
+        self._snapshot = self._empty_snapshot()
+        self._loaded = False
+        # (chunk high-water mark, time) OF THE LAST LOAD'S READ OF THE DB -- THIS INDEX IS
+        # PRIVATE TO THE PROCESS, SO THAT IS ALL A SAVED COPY IS KNOWN TO COVER
+        self._synced_marks: Optional[Tuple[Optional[datetime], datetime]] = None
+
+        # APPEND BUFFERS -- SNAPSHOTS ARE VIEWS OF THE FIRST rows ENTRIES, SO WRITING PAST
+        # THEM NEVER DISTURBS A READER HOLDING AN OLDER SNAPSHOT
+        self._adopt_buffers(self._snapshot)
+
+        # ONE MERGE AT A TIME -- THE MERGER THREAD, OR merge() IN THE CALLER
+        self._merge_lock = threading.Lock()
+        self._merge_wanted = threading.Event()
+        self._merger: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _empty_snapshot() -> _LexicalSnapshot:
+        return _LexicalSnapshot(
+            (),
+            np.empty((0, ID_WIDTH), dtype=np.uint8),
+            np.empty((0, ID_WIDTH), dtype=np.uint8),
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=bool)
+        )
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def size(self) -> int:
+        return self._snapshot.live_count
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._snapshot.segments)
+
+    @property
+    def memory_bytes(self) -> int:
+        snapshot = self._snapshot
+        return (
+            sum(segment.nbytes for segment in snapshot.segments)
+            + snapshot.chunk_ids.nbytes + snapshot.document_ids.nbytes
+            + snapshot.lengths.nbytes + snapshot.alive.nbytes
+        )
+
+    def _adopt_buffers(self, snapshot: _LexicalSnapshot) -> None:
+        # snapshot'S ARRAYS BECOME THE APPEND BUFFERS -- ONLY FOR ARRAYS NOTHING ELSE WRITES TO
+        self._chunk_id_buffer = snapshot.chunk_ids
+        self._document_id_buffer = snapshot.document_ids
+        self._length_buffer = snapshot.lengths
+        self._alive_buffer = snapshot.alive
+
+    def _reserve(self, count: int, needed: int) -> None:
+        # GROW THE BUFFERS GEOMETRICALLY SO APPENDS ARE AMORTIZED O(ROWS ADDED)
+        capacity = len(self._chunk_id_buffer)
+        if needed <= capacity:
+            return
+
+        new_capacity = max(needed, 2 * capacity, self.MIN_CAPACITY)
+        chunk_ids = np.empty((new_capacity, ID_WIDTH), dtype=np.uint8)
+        document_ids = np.empty((new_capacity, ID_WIDTH), dtype=np.uint8)
+        lengths = np.empty(new_capacity, dtype=np.int32)
+        alive = np.zeros(new_capacity, dtype=bool)
+        chunk_ids[:count] = self._chunk_id_buffer[:count]
+        document_ids[:count] = self._document_id_buffer[:count]
+        lengths[:count] = self._length_buffer[:count]
+        alive[:count] = self._alive_buffer[:count]
+
+        self._chunk_id_buffer = chunk_ids
+        self._document_id_buffer = document_ids
+        self._length_buffer = lengths
+        self._alive_buffer = alive
+
+    def load(self, db: Session) -> None:
+        # BUILD THE INDEX FROM THE CONTENT OF EVERY CHUNK IN THE DB
+        with self._lock:
+            self._load_locked(db)
+
+    def ensure_loaded(self, db: Session) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load_locked(db)
+
+    def _load_locked(self, db: Session) -> None:
+        # THE LAST SAVED POSTINGS PLUS WHAT CHANGED SINCE, OR (WITHOUT THEM) EVERY CHUNK IN THE DB
+        started = time.perf_counter()
+        # MARKS FIRST, THEN THE ROWS -- EVERY CHUNK THE MARKS COVER IS ALREADY IN WHAT IS READ
+        synced_marks = (chunk_high_water_mark(db), datetime.utcnow())
+        stored = (
+            self.snapshots.load_arrays(tokenizer=TOKENIZER_VERSION)
+            if self.snapshots is not None else None
+        )
+        if stored is None:
+            snapshot = self._empty_snapshot()
+            self._adopt_buffers(snapshot)
+            snapshot = self._read_db(db, snapshot)
+            self.load_stats = {"source": "db", "rows": len(snapshot.chunk_ids)}
+        else:
+            snapshot = self._restored(stored)
+            replay = documents_to_replay(db, stored)
+            snapshot_documents = {
+                uuid.UUID(bytes=key.tobytes()) for key in np.unique(id_keys(snapshot.document_ids))
+            }
+            deleted = snapshot_documents - existing_documents(db)
+            dropped = np.isin(id_keys(snapshot.document_ids), id_keys(uuid_rows(list(replay | deleted))))
+            snapshot = _LexicalSnapshot(
+                snapshot.segments,
+                snapshot.chunk_ids,
+                snapshot.document_ids,
+                snapshot.lengths,
+                snapshot.alive & ~dropped
+            )
+            self._adopt_buffers(snapshot)
+
+            restored_rows = len(snapshot.chunk_ids)
+            snapshot = self._read_db(db, snapshot, replay)
+            self.load_stats = {
+                "source": "snapshot",
+                "snapshot_version": stored.manifest["version"],
+                "rows": snapshot.live_count,
+                "replayed_documents": len(replay),
+                "replayed_rows": len(snapshot.chunk_ids) - restored_rows,
+                "deleted_documents": len(deleted)
+            }
+
+        snapshot = self._merged(snapshot)
+        self._adopt_buffers(snapshot)
+        self._snapshot = snapshot
+        self._loaded = True
+        self._synced_marks = synced_marks
+        self.load_stats["seconds"] = round(time.perf_counter() - started, 3)
+        logger.info("Lexical index loaded: %s", self.load_stats)
+
+    def _read_db(self,
+                 db: Session,
+                 snapshot: _LexicalSnapshot,
+                 document_ids: Optional[Iterable[uuid.UUID]] = None) -> _LexicalSnapshot:
+        # snapshot WITH EVERY CHUNK IN THE DB, OR THOSE OF document_ids, APPENDED
+        query = db.query(DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.content)
+        if document_ids is not None:
+            document_ids = list(document_ids)
+            if not document_ids:
+                return snapshot
+            query = query.filter(DocumentChunk.document_id.in_(document_ids))
+
+        # TERM IDS ARE NEVER REASSIGNED, SO SNAPSHOTS STILL BEING READ STAY VALID
+        batch_chunk_ids, batch_document_ids, batch_contents = [], [], []
+        for chunk_id, document_id, content in query.execution_options(yield_per=self.LOAD_BATCH_SIZE):
+            batch_chunk_ids.append(chunk_id)
+            batch_document_ids.append(document_id)
+            batch_contents.append(content or "")
+            if len(batch_chunk_ids) >= self.LOAD_SEGMENT_ROWS:
+                snapshot = self._appended(snapshot, batch_chunk_ids, batch_document_ids, batch_contents)
+                batch_chunk_ids, batch_document_ids, batch_contents = [], [], []
+        return self._appended(snapshot, batch_chunk_ids, batch_document_ids, batch_contents)
+
+    def _restored(self, stored: StoredSnapshot) -> _LexicalSnapshot:
+        # A SAVED SNAPSHOT, ITS TERM IDS MAPPED ONTO THIS PROCESS'S VOCABULARY
+        arrays = stored.arrays
+        text = arrays["vocabulary"].tobytes().decode("utf-8")
+        terms = text.split("\n") if text else []
+        keys = id_keys(arrays["chunk_ids"])
+        key_rows = np.arange(len(keys), dtype=np.int32)
+        if not self._vocabulary:
+            self._vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+            key_order = np.argsort(keys, kind="stable")
+            segment = _Segment(
+                arrays["terms"], arrays["offsets"], arrays["rows"], arrays["tfs"],
+                keys[key_order], key_rows[key_order]
+            )
+        else:
+            # RELOADED AFTER TERMS WERE ASSIGNED -- EXISTING IDS STAY, SO THE POSTINGS ARE RENUMBERED
+            term_map = np.empty(len(terms), dtype=np.int32)
+            for stored_id, term in enumerate(terms):
+                term_id = self._vocabulary.get(term)
+                if term_id is None:
+                    term_id = self._vocabulary[term] = len(self._vocabulary)
+                term_map[stored_id] = term_id
+            term_ids = np.repeat(arrays["terms"], np.diff(arrays["offsets"]))
+            segment = _Segment.from_triples(term_map[term_ids], arrays["rows"], arrays["tfs"], keys, key_rows)
+
+        lengths = arrays["lengths"]
+        return _LexicalSnapshot(
+            (segment,),
+            arrays["chunk_ids"],
+            arrays["document_ids"],
+            lengths,
+            np.ones(len(lengths), dtype=bool)
+        )
+
+    def save_snapshot(self) -> Optional[Dict[str, Any]]:
+        """
+        Write the live rows and their postings to the snapshot store.
+
+        The marks saved are those of the last load, not the DB's current
+        ones -- chunks other workers committed since never reached this
+        index, and the next load replays them together with the ones this
+        process added itself.
+
+        Returns:
+            The snapshot manifest, or None when snapshots are off or nothing is loaded
+        """
+
+        if self.snapshots is None or not self._loaded or self._synced_marks is None:
+            return None
+        with self._lock:
+            # EVERY TERM ID IN THE SNAPSHOT IS ALREADY IN THE VOCABULARY
+            snapshot = self._snapshot
+            terms = list(self._vocabulary)
+            high_water_mark, saved_at = self._synced_marks
+
+        snapshot = self._merged(snapshot)
+        segment = snapshot.segments[0] if snapshot.segments else _Segment.from_triples(
+            _EMPTY_ROWS, _EMPTY_ROWS, _EMPTY_ROWS, _EMPTY_KEYS, _EMPTY_ROWS
+        )
+        # TOKENS NEVER CONTAIN A NEWLINE
+        vocabulary = np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8)
+        return self.snapshots.save_arrays(
+            {
+                "vocabulary": vocabulary,
+                "terms": segment.terms,
+                "offsets": segment.offsets,
+                "rows": segment.rows,
+                "tfs": segment.tfs,
+                "chunk_ids": snapshot.chunk_ids,
+                "document_ids": snapshot.document_ids,
+                "lengths": snapshot.lengths
+            },
+            high_water_mark,
+            saved_at,
+            tokenizer=TOKENIZER_VERSION,
+            rows=len(snapshot.chunk_ids)
+        )
+
+    def _appended(self,
+                  snapshot: _LexicalSnapshot,
+                  chunk_ids: Sequence[uuid.UUID],
+                  document_ids: Sequence[uuid.UUID],
+                  contents: Sequence[str]) -> _LexicalSnapshot:
+        # NEW SNAPSHOT WITH THESE ROWS IN A SEGMENT OF THEIR OWN, WRITTEN PAST THE END OF
+        # THE BUFFERS -- snapshot MUST BE THE ONE THE BUFFERS BELONG TO
+        if not chunk_ids:
+            return snapshot
+
+        first_row = len(snapshot.chunk_ids)
+        added = len(chunk_ids)
+        term_ids, rows, tfs, lengths = [], [], [], []
+        for offset, content in enumerate(contents):
+            counts = Counter(tokenize(content))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_id = self._vocabulary.get(term)
+                if term_id is None:
+                    term_id = self._vocabulary[term] = len(self._vocabulary)
+                term_ids.append(term_id)
+                rows.append(first_row + offset)
+                tfs.append(tf)
+
+        count = first_row + added
+        self._reserve(first_row, count)
+        new_chunk_ids = uuid_rows(chunk_ids)
+        self._chunk_id_buffer[first_row:count] = new_chunk_ids
+        self._document_id_buffer[first_row:count] = uuid_rows(document_ids)
+        self._length_buffer[first_row:count] = lengths
+        self._alive_buffer[first_row:count] = True
+
+        segment = _Segment.from_triples(
+            np.asarray(term_ids, dtype=np.int32),
+            np.asarray(rows, dtype=np.int32),
+            np.asarray(tfs, dtype=np.int32),
+            id_keys(new_chunk_ids),
+            np.arange(first_row, count, dtype=np.int32)
+        )
+        return _LexicalSnapshot(
+            snapshot.segments + (segment,),
+            self._chunk_id_buffer[:count],
+            self._document_id_buffer[:count],
+            self._length_buffer[:count],
+            self._alive_buffer[:count],
+            snapshot.live_count + added,
+            snapshot.live_length + sum(lengths)
+        )
+
+    @staticmethod
+    def _merged(snapshot: _LexicalSnapshot) -> _LexicalSnapshot:
+        # ONE SEGMENT HOLDING ONLY THE LIVE ROWS, RENUMBERED FROM 0
+        alive = snapshot.alive
+        live_count = int(alive.sum())
+        remap = np.full(len(alive), -1, dtype=np.int64)
+        remap[alive] = np.arange(live_count)
+        chunk_ids = snapshot.chunk_ids[alive]
+
+        parts = [segment.triples() for segment in snapshot.segments]
+        if parts:
+            term_ids = np.concatenate([part[0] for part in parts])
+            rows = remap[np.concatenate([part[1] for part in parts])]
+            tfs = np.concatenate([part[2] for part in parts])
+            live = rows >= 0
+            segments = (_Segment.from_triples(
+                term_ids[live], rows[live], tfs[live],
+                id_keys(chunk_ids), np.arange(live_count, dtype=np.int32)
+            ),)
+        else:
+            segments = ()
+
+        return _LexicalSnapshot(
+            segments,
+            chunk_ids,
+            snapshot.document_ids[alive],
+            snapshot.lengths[alive],
+            np.ones(live_count, dtype=bool)
+        )
+
+    def add(self,
+            chunk_ids: Sequence[uuid.UUID],
+            document_ids: Sequence[uuid.UUID],
+            contents: Sequence[str]) -> int:
+        # ADD CHUNKS TO THE INDEX, RETURNS THE NUMBER OF ROWS ADDED
+        with self._lock:
+            # NOT LOADED YET -- THE NEXT LOAD PICKS THESE UP FROM THE DB
+            if not self._loaded:
+                return 0
+
+            # ROWS ALREADY IN THE INDEX ARE NOT ADDED TWICE
+            snapshot = self._snapshot
+            fresh = snapshot.rows_of(id_keys(uuid_rows(chunk_ids))) < 0
+            new_rows = [
+                (chunk_id, document_id, content or "")
+                for chunk_id, document_id, content, keep in zip(chunk_ids, document_ids, contents, fresh)
+                if keep
+            ]
+            if not new_rows:
+                return 0
+
+            new_chunk_ids, new_document_ids, new_contents = zip(*new_rows)
+            self._snapshot = self._appended(snapshot, new_chunk_ids, new_document_ids, new_contents)
+            self._request_merge_locked()
+            return len(new_rows)
+
+    def remove_document(self, document_id: uuid.UUID) -> int:
+        # MASK OUT EVERY ROW THAT BELONGS TO THE DOCUMENT, RETURNS THE NUMBER OF ROWS REMOVED
+        with self._lock:
+            snapshot = self._snapshot
+            key = id_keys(uuid_rows([document_id]))
+            rows = np.flatnonzero((id_keys(snapshot.document_ids) == key) & snapshot.alive)
+            return self._remove_rows_locked(rows)
+
+    def remove_chunks(self, chunk_ids: Iterable[uuid.UUID]) -> int:
+        # MASK OUT THESE CHUNKS ONLY, RETURNS THE NUMBER OF ROWS REMOVED
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return 0
+        with self._lock:
+            rows = self._snapshot.rows_of(id_keys(uuid_rows(chunk_ids)))
+            return self._remove_rows_locked(np.unique(rows[rows >= 0]))
+
+    def _remove_rows_locked(self, rows: np.ndarray) -> int:
+        # MASK OUT THESE LIVE ROWS -- IN A COPY OF alive, READERS OF THE OLD SNAPSHOT KEEP THEIRS
+        if not len(rows):
+            return 0
+        snapshot = self._snapshot
+        alive = self._alive_buffer.copy()
+        alive[rows] = False
+        self._alive_buffer = alive
+        count = len(snapshot.chunk_ids)
+        self._snapshot = _LexicalSnapshot(
+            snapshot.segments,
+            snapshot.chunk_ids,
+            snapshot.document_ids,
+            snapshot.lengths,
+            alive[:count],
+            snapshot.live_count - len(rows),
+            snapshot.live_length - int(snapshot.lengths[rows].sum())
+        )
+        self._request_merge_locked()
+        return len(rows)
+
+    def _merge_plan(self, snapshot: _LexicalSnapshot) -> Optional[List[int]]:
+        # SEGMENTS TO MERGE NEXT: merge_factor OF THE SMALLEST TIER THAT HAS THAT MANY, OR None
+        tiers: Dict[int, List[int]] = {}
+        for position, segment in enumerate(snapshot.segments):
+            tier = int(math.log(max(segment.size, 1), self.merge_factor))
+            tiers.setdefault(tier, []).append(position)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier][:self.merge_factor]
+        return None
+
+    def _needs_compaction(self, snapshot: _LexicalSnapshot) -> bool:
+        # DROP DEAD ROWS FOR GOOD ONCE THEY ARE A QUARTER OF THE INDEX
+        rows = len(snapshot.alive)
+        return rows - snapshot.live_count > rows // 4
+
+    def _request_merge_locked(self) -> None:
+        snapshot = self._snapshot
+        if not self._needs_compaction(snapshot) and self._merge_plan(snapshot) is None:
+            return
+        if self._merger is None:
+            self._merger = threading.Thread(target=self._merge_loop, name="lexical-merge", daemon=True)
+            self._merger.start()
+        self._merge_wanted.set()
+
+    def _merge_loop(self) -> None:
+        while True:
+            self._merge_wanted.wait()
+            self._merge_wanted.clear()
+            try:
+                self.merge()
+            except Exception:
+                logger.exception("Lexical index merge failed")
+
+    def merge(self) -> None:
+        # RUN EVERY MERGE THE INDEX WANTS NOW, IN THE CALLING THREAD
+        while self._merge_step():
+            pass
+
+    def _merge_step(self) -> bool:
+        # ONE MERGE, BUILT WITHOUT _lock AND INSTALLED ONLY IF THE SEGMENTS IT REPLACES ARE STILL
+        # THERE -- WRITERS ONLY APPEND SEGMENTS AND MASK ROWS, A RELOAD MAKES IT START OVER
+        with self._merge_lock:
+            snapshot = self._snapshot
+            if self._needs_compaction(snapshot):
+                return self._compact(snapshot)
+            plan = self._merge_plan(snapshot)
+            if plan is None:
+                return False
+
+            sources = [snapshot.segments[position] for position in plan]
+            alive = snapshot.alive
+            parts = [segment.triples() for segment in sources]
+            rows = np.concatenate([part[1] for part in parts])
+            live = alive[rows]
+            keys = np.concatenate([segment.keys for segment in sources])
+            key_rows = np.concatenate([segment.key_rows for segment in sources])
+            live_keys = alive[key_rows]
+            merged = _Segment.from_triples(
+                np.concatenate([part[0] for part in parts])[live],
+                rows[live],
+                np.concatenate([part[2] for part in parts])[live],
+                keys[live_keys],
+                key_rows[live_keys]
+            )
+
+            with self._lock:
+                current = self._snapshot
+                if not all(any(segment is source for segment in current.segments) for source in sources):
+                    return True
+                segments = tuple(
+                    merged if segment is sources[0] else segment
+                    for segment in current.segments
+                    if not any(segment is source for source in sources[1:])
+                )
+                self._snapshot = _LexicalSnapshot(
+                    segments,
+                    current.chunk_ids,
+                    current.document_ids,
+                    current.lengths,
+                    current.alive,
+                    current.live_count,
+                    current.live_length
+                )
+            return True
+
+    def _compact(self, snapshot: _LexicalSnapshot) -> bool:
+        # RENUMBER THE LIVE ROWS OF snapshot FROM 0, THEN CARRY OVER WHAT CHANGED WHILE IT RAN:
+        # SEGMENTS APPENDED SINCE MOVE DOWN WITH THEIR ROWS, ROWS REMOVED SINCE STAY DEAD
+        compacted = self._merged(snapshot)
+        planned_rows = len(snapshot.chunk_ids)
+        shift = len(compacted.chunk_ids) - planned_rows
+
+        with self._lock:
+            current = self._snapshot
+            planned = len(snapshot.segments)
+            if len(current.segments) < planned or \
+                    any(a is not b for a, b in zip(current.segments, snapshot.segments)):
+                return True
+            alive = np.concatenate([current.alive[:planned_rows][snapshot.alive], current.alive[planned_rows:]])
+            result = _LexicalSnapshot(
+                compacted.segments + tuple(segment.shifted(shift) for segment in current.segments[planned:]),
+                np.concatenate([compacted.chunk_ids, current.chunk_ids[planned_rows:]]),
+                np.concatenate([compacted.document_ids, current.document_ids[planned_rows:]]),
+                np.concatenate([compacted.lengths, current.lengths[planned_rows:]]),
+                alive,
+                current.live_count,
+                current.live_length
+            )
+            self._adopt_buffers(result)
+            self._snapshot = result
+        return True
+
+    def search(self, query: str, top_k: int) -> List[Tuple[uuid.UUID, float]]:
+        # RETURN (chunk_id, bm25_score) PAIRS FOR THE top_k BEST ROWS, BEST FIRST
+        snapshot = self._snapshot
+        if not snapshot.live_count or top_k <= 0:
+            return []
+
+        query_terms = Counter(
+            self._vocabulary[token] for token in tokenize(query) if token in self._vocabulary
+        )
+        if not query_terms:
+            return []
+
+        n = snapshot.live_count
+        avg_length = snapshot.live_length / n
+        matched_rows, matched_scores = [], []
+        for term_id, query_tf in query_terms.items():
+            postings = [segment.postings(term_id) for segment in snapshot.segments]
+            rows = np.concatenate([rows for rows, _ in postings])
+            tfs = np.concatenate([tfs for _, tfs in postings])
+            live = snapshot.alive[rows]
+            rows, tfs = rows[live], tfs[live].astype(np.float32)
+            if not len(rows):
+                continue
+
+            df = len(rows)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * snapshot.lengths[rows] / avg_length)
+            matched_rows.append(rows)
+            matched_scores.append(query_tf * idf * tfs * (self.k1 + 1) / (tfs + norm))
+
+        if not matched_rows:
+            return []
+
+        # SUM PER-TERM CONTRIBUTIONS OVER THE MATCHED ROWS ONLY -- NEVER A DENSE n-ROW ARRAY
+        rows, inverse = np.unique(np.concatenate(matched_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(matched_scores))
+        top = top_k_indices(scores, top_k)
+        return [(snapshot.chunk_id(rows[i]), float(scores[i])) for i in top]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Tuple[uuid.UUID, float]]],
+                           k: int = 60) -> List[Tuple[uuid.UUID, float]]:
+    # FUSE RANKED (chunk_id, score) LISTS BY SUMMING 1 / (k + rank) -- SCORE SCALES NEVER MIX
+    fused: Dict[uuid.UUID, float] = {}
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+# SHARED BY EVERY REQUEST IN THIS PROCESS
+lexical_index = LexicalIndex(
+    k1=settings.BM25_K1,
+    b=settings.BM25_B,
+    merge_factor=settings.LEXICAL_MERGE_FACTOR,
+    snapshots=(
+        SnapshotStore(os.path.join(settings.VECTOR_INDEX_SNAPSHOT_DIR, "lexical"), settings.DATABASE_URL)
+        if settings.VECTOR_INDEX_SNAPSHOT_ENABLED else None
+    )
+)
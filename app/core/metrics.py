@@ -0,0 +1,242 @@
+from typing import List, Dict, Tuple, Callable, Optional, Iterator, Sequence
+from contextlib import contextmanager
+from contextvars import ContextVar
+import asyncio
+import bisect
+import functools
+import math
+import threading
+import time
+
+from app.config import settings
+
+# LATENCY BUCKETS IN SECONDS, FROM SUB-MILLISECOND INDEX LOOKUPS TO SLOW LLM CALLS
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# STAGE TIMINGS (ms) OF THE CURRENT QA RUN, SET BY collect_timings() -- None OUTSIDE ONE
+_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Histogram:
+
+    # CUMULATIVE-BUCKET HISTOGRAM WITH ONE OPTIONAL LABEL, RENDERED IN PROMETHEUS TEXT FORMAT
+
+    def __init__(self, name: str, documentation: str, label: Optional[str] = None,
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # LABEL VALUE -> (PER-BUCKET COUNTS WITH A TRAILING +Inf SLOT, SUM)
+        self._series: Dict[str, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][slot] += 1
+            series[1][0] += value
+
+    def _labels(self, label_value: str, extra: str = "") -> str:
+        labels = []
+        if self.label:
+            labels.append(f'{self.label}="{_escape(label_value)}"')
+        if extra:
+            labels.append(extra)
+        return "{" + ",".join(labels) + "}" if labels else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total[0]) for key, (counts, total) in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _format(bound) + '"'
+                lines.append(f"{self.name}_bucket{self._labels(label_value, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(label_value)} {_format(total)}")
+            lines.append(f"{self.name}_count{self._labels(label_value)} {cumulative}")
+        return lines
+
+
+class Counter:
+
+    # MONOTONIC COUNTER WITH ONE OPTIONAL LABEL
+
+    def __init__(self, name: str, documentation: str, label: Optional[str] = None):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = {}
+
+    def inc(self, amount: float = 1.0, label_value: str = "") -> None:
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_value, value in sorted(values.items()):
+            labels = f'{{{self.label}="{_escape(label_value)}"}}' if self.label else ""
+            lines.append(f"{self.name}{labels} {_format(value)}")
+        return lines
+
+
+class Gauge:
+
+    # CURRENT VALUE READ FROM A CALLBACK AT SCRAPE TIME
+
+    def __init__(self, name: str, documentation: str, read_fn: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.read_fn = read_fn
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format(self.read_fn())}"
+        ]
+
+
+class _Span:
+
+    __slots__ = ("registry", "stage", "timings", "started")
+
+    def __init__(self, registry: "MetricsRegistry", stage: str, timings: Optional[Dict[str, float]]):
+        self.registry = registry
+        self.stage = stage
+        self.timings = timings
+
+    def __enter__(self) -> "_Span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.registry.record_stage(self.stage, time.perf_counter() - self.started, self.timings)
+
+
+class _NullSpan:
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class MetricsRegistry:
+
+    # PROCESS-WIDE METRICS SERVED FROM /metrics
+    # WITH settings.METRICS_ENABLED OFF, span() OUTSIDE A QA RUN IS A SHARED NO-OP OBJECT
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics = []
+        self.stage_seconds = self.histogram(
+            "knbqa_stage_duration_seconds", "Time spent in each stage of retrieval, generation and ingestion.", "stage"
+        )
+
+    def histogram(self, name: str, documentation: str, label: Optional[str] = None,
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        histogram = Histogram(name, documentation, label, buckets)
+        self._metrics.append(histogram)
+        return histogram
+
+    def counter(self, name: str, documentation: str, label: Optional[str] = None) -> Counter:
+        counter = Counter(name, documentation, label)
+        self._metrics.append(counter)
+        return counter
+
+    def gauge(self, name: str, documentation: str, read_fn: Callable[[], float]) -> Gauge:
+        gauge = Gauge(name, documentation, read_fn)
+        self._metrics.append(gauge)
+        return gauge
+
+    def span(self, stage: str):
+        # TIME A BLOCK: with metrics.span("retrieve.vector_search"): ...
+        timings = _stage_timings.get()
+        if not self.enabled and timings is None:
+            return _NULL_SPAN
+        return _Span(self, stage, timings)
+
+    def record_stage(self, stage: str, seconds: float, timings: Optional[Dict[str, float]] = None) -> None:
+        # STAGES SEEN MORE THAN ONCE IN A RUN ADD UP IN ITS TIMINGS
+        if self.enabled:
+            self.stage_seconds.observe(seconds, stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + 1000 * seconds
+
+    def timed(self, stage: str) -> Callable:
+        # DECORATOR FORM OF span(), FOR PLAIN AND async FUNCTIONS
+        def decorator(fn: Callable) -> Callable:
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(stage):
+                        return await fn(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def collect_timings() -> Iterator[Dict[str, float]]:
+    """
+    Collect the duration of every span entered inside the block, on this thread
+    or in threads started with asyncio.to_thread from it.
+
+    Returns:
+        Dict of stage name to milliseconds, filled in as spans finish
+    """
+
+    timings: Dict[str, float] = {}
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(token)
+
+
+def rounded_timings(timings: Dict[str, float]) -> Dict[str, float]:
+    return {stage: round(ms, 3) for stage, ms in timings.items()}
+
+
+metrics = MetricsRegistry(enabled=settings.METRICS_ENABLED)
+llm_tokens = metrics.counter("knbqa_llm_tokens_total", "Tokens sent to and produced by the chat model.", "kind")
+query_batch_size = metrics.histogram(
+    "knbqa_query_batch_size", "Texts per coalesced query embedding call.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
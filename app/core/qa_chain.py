@@ -1,49 +1,61 @@
-from typing import Dict, List, Any, Callable, Optional
-import uuid
+from typing import Dict, List, Any, Callable, Optional, AsyncIterator, Tuple, Union
+import asyncio
+import time
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import chain
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import END, StateGraph
 
 from app.config import settings
+from app.core.clients import build_llm
+from app.core.context_packer import pack_context
+from app.core.metrics import metrics, llm_tokens, collect_timings, rounded_timings
 from app.schemas.qa import ChainNode, ChainEdge, ChainVisualization, QAWorkflowState
 
 class QAChain:
     # CHAIN COMBINES RETRIEVAL WITH GEN AND TRACES THE EXEC
     
-    def __init__(self, retriever_fn: Callable):
-        self.llm = ChatOpenAI(
-            model=settings.LLM_MODEL,
-            temperature=0,
-            api_key=settings.OPENAI_API_KEY,
-            streaming=True
-        )
+    PROMPT_TEMPLATE = """
+        Using only the provided context, answer the question as completely as possible. 
+        If the context does not contain any information related to the question, reply: 
+        "I don't have enough information to answer this question."
+
+        Context:
+        {context}
+
+        Question: {question}
+
+        Answer:
+        """
+    
+    def __init__(self, retriever_fn: Callable, llm: ChatOpenAI = None, batch_retriever_fn: Callable = None):
+        self.llm = llm or build_llm()
         self.retriever_fn = retriever_fn
+        # QUESTIONS -> ONE CHUNK LIST PER QUESTION, FOR run_batch (FALLS BACK TO ONE retriever_fn CALL EACH)
+        self.batch_retriever_fn = batch_retriever_fn or (lambda questions: [retriever_fn(q) for q in questions])
+        self.answer_chain = self._answer_chain()
+        # COMPILED ONCE -- EVERY RUN KEEPS ITS TRACE IN ITS OWN QAWorkflowState
         self.graph = self._build_graph()
-        self.trace_data = {
-            "nodes": [],
-            "edges": []
-        }
-        self.node_counter = 0
     
     
-    def _get_node_id(self, prefix: str) -> str:
+    @staticmethod
+    def _get_node_id(state: QAWorkflowState, prefix: str) -> str:
         # GENERATE A UNIQUE NODE ID WITH PREFIX
-        self.node_counter += 1
-        return f"{prefix}_{self.node_counter}"
+        state.node_counter += 1
+        return f"{prefix}_{state.node_counter}"
     
-    def _add_to_trace(self, 
+    def _add_to_trace(self,
+                      state: QAWorkflowState,
                       content: str, 
                       node_type: str, 
                       source_id: Optional[str] = None,
                       edge_label: Optional[str] = None,
                       metadata: Optional[Dict[str, Any]] = None) -> str:
         # ADD A NODE AND OPT AND EDGE TO THE TRACE
-        node_id = self._get_node_id(node_type)
+        node_id = self._get_node_id(state, node_type)
         
         # ADD NODE
-        self.trace_data["nodes"].append({
+        state.trace_nodes.append({
             "id": node_id,
             "type": node_type,
             "content": content,
@@ -52,7 +64,7 @@ class QAChain:
         
         # ADD EDGE IF SOURCE ID PROVIDED
         if source_id:
-            self.trace_data["edges"].append({
+            state.trace_edges.append({
                 "source": source_id,
                 "target": node_id,
                 "label": edge_label
@@ -60,87 +72,159 @@ class QAChain:
         
         return node_id
     
-    def _retrieve_context(self, state: QAWorkflowState) -> Dict[str, Any]:
-        question = state.question
+    def _retrieve_context(self, state: QAWorkflowState) -> QAWorkflowState:
+        # RETRIEVE RELEVANT CHUNKS -- SPANS INSIDE THE RETRIEVER LAND IN timings
+        with collect_timings() as timings:
+            with metrics.span("retrieve"):
+                retrieved_chunks = self.retriever_fn(state.question)
+        return self._add_context(state, retrieved_chunks, timings)
+    
+    async def _aretrieve_context(self, state: QAWorkflowState) -> QAWorkflowState:
+        # RETRIEVAL IS SYNCHRONOUS (DB + NUMPY) -- KEEP IT OFF THE EVENT LOOP
+        # (to_thread COPIES THE CONTEXT, SO THE WORKER THREAD'S SPANS ARE COLLECTED TOO)
+        with collect_timings() as timings:
+            with metrics.span("retrieve"):
+                retrieved_chunks = await asyncio.to_thread(self.retriever_fn, state.question)
+        return self._add_context(state, retrieved_chunks, timings)
+    
+    async def _aretrieve_many(self, questions: List[str]) -> List[QAWorkflowState]:
+        # ONE RETRIEVAL FOR SEVERAL QUESTIONS -- EVERY TRACE GETS THE SHARED TIMINGS
+        with collect_timings() as timings:
+            with metrics.span("retrieve"):
+                retrieved = await asyncio.to_thread(self.batch_retriever_fn, questions)
+        return [
+            self._add_context(QAWorkflowState(question=question), chunks, dict(timings))
+            for question, chunks in zip(questions, retrieved)
+        ]
+    
+    def _add_context(self,
+                     state: QAWorkflowState,
+                     retrieved_chunks: List[Dict[str, Any]],
+                     timings: Dict[str, float]) -> QAWorkflowState:
+        # MERGE OVERLAPPING NEIGHBOURS, DROP NEAR-DUPLICATES AND FIT THE TOKEN BUDGET
+        packing = None
+        if settings.CONTEXT_PACKING_ENABLED:
+            started = time.perf_counter()
+            packed = pack_context(retrieved_chunks)
+            metrics.record_stage("pack_context", time.perf_counter() - started, timings)
+            packing = packed.stats()
+            packed_positions = set(packed.packed_positions)
+            context = packed.text
+        else:
+            packed_positions = set(range(len(retrieved_chunks)))
+            context = "\n\n".join(chunk["content"] for chunk in retrieved_chunks)
         
         # ADD QUESTION TO TRACE
+        question_metadata = {"timings_ms": rounded_timings(timings)}
+        if packing is not None:
+            question_metadata["context_packing"] = packing
         question_id = self._add_to_trace(
-            content=question,
-            node_type="question"
+            state,
+            content=state.question,
+            node_type="question",
+            metadata=question_metadata
         )
         
-        # RETRIEVE RELEVANT CHUNKS
-        retrieved_chunks = self.retriever_fn(question)
-        
         # UPDATE STATE WITH RETRIEVED CONTEXT
-        context_texts = []
-        for chunk in retrieved_chunks:
-            chunk_id = self._add_to_trace(
+        for position, chunk in enumerate(retrieved_chunks):
+            self._add_to_trace(
+                state,
                 content=chunk["content"],
                 node_type="context",
                 source_id=question_id,
                 edge_label="retrieves",
-                metadata={"similarity": chunk["similarity"]}
+                metadata={
+                    "similarity": chunk["similarity"],
+                    "lexical_score": chunk.get("lexical_score"),
+                    "score": chunk.get("score"),
+                    "packed": position in packed_positions
+                }
             )
-            context_texts.append(chunk["content"])
         
-        # JOIN CONTEXT
-        context = "\n\n".join(context_texts)
         state.context = context
         state.question_node_id = question_id
         return state
     
-    def _generate_answer(self, state: QAWorkflowState) -> Dict[str, Any]:
-        # GEN ANSWER BASED ON
-        question = state.question
-        context = state.context
-        question_node_id = state.question_node_id
-        
-        prompt_template = """
-        Using only the provided context, answer the question as completely as possible. 
-        If the context does not contain any information related to the question, reply: 
-        "I don't have enough information to answer this question."
-
-        Context:
-        {context}
-
-        Question: {question}
-
-        Answer:
-        """
-        
-        prompt = ChatPromptTemplate.from_template(prompt_template)
-        
+    def _answer_chain(self):
+        # ENDS AT THE MODEL MESSAGE (NOT A PARSED STRING) SO ITS TOKEN USAGE IS KEPT
+        prompt = ChatPromptTemplate.from_template(self.PROMPT_TEMPLATE)
+        return prompt | self.llm
+    
+    @staticmethod
+    def _token_usage(usage: Optional[Dict[str, Any]]) -> Dict[str, int]:
+        # PROVIDER-REPORTED TOKEN COUNTS FOR THE ANSWER NODE, EMPTY IF THE PROVIDER SENT NONE
+        if not usage:
+            return {}
+        if metrics.enabled:
+            llm_tokens.inc(usage["input_tokens"], "prompt")
+            llm_tokens.inc(usage["output_tokens"], "completion")
+        return {
+            "prompt_tokens": usage["input_tokens"],
+            "completion_tokens": usage["output_tokens"],
+            "total_tokens": usage["total_tokens"]
+        }
+    
+    def _add_reasoning(self, state: QAWorkflowState) -> str:
         # ADD REASONING
         reasoning_id = self._add_to_trace(
+            state,
             content="Analyzing context and formulating answer...",
             node_type="reasoning",
-            source_id=question_node_id,
+            source_id=state.question_node_id,
             edge_label="reasons"
         )
-        
-        # GENERATE ANSWER
-        chain = prompt | self.llm | StrOutputParser()
-        answer = chain.invoke({"context": context, "question": question})
-        
+        state.reasoning_node_id = reasoning_id
+        return reasoning_id
+    
+    def _add_answer(self, state: QAWorkflowState, answer: str, metadata: Optional[Dict[str, Any]] = None) -> str:
         # ADD NODE TO TRACE
         answer_id = self._add_to_trace(
+            state,
             content=answer,
             node_type="answer",
-            source_id=reasoning_id,
-            edge_label="produces"
+            source_id=state.reasoning_node_id,
+            edge_label="produces",
+            metadata=metadata
         )
-        
         state.answer = answer
+        return answer_id
+    
+    def _generate_answer(self, state: QAWorkflowState) -> QAWorkflowState:
+        # GEN ANSWER BASED ON
+        self._add_reasoning(state)
+        
+        # GENERATE ANSWER
+        with collect_timings() as timings:
+            with metrics.span("generate"):
+                message = self.answer_chain.invoke({"context": state.context, "question": state.question})
+        
+        self._add_answer(state, message.content, self._answer_metadata(message.usage_metadata, timings))
+        return state
+    
+    async def _agenerate_answer(self, state: QAWorkflowState) -> QAWorkflowState:
+        self._add_reasoning(state)
+        with collect_timings() as timings:
+            with metrics.span("generate"):
+                message = await self.answer_chain.ainvoke({"context": state.context, "question": state.question})
+        self._add_answer(state, message.content, self._answer_metadata(message.usage_metadata, timings))
         return state
     
+    def _answer_metadata(self, usage: Optional[Dict[str, Any]], timings: Dict[str, float]) -> Dict[str, Any]:
+        return {"timings_ms": rounded_timings(timings), **self._token_usage(usage)}
+    
     def _build_graph(self) -> StateGraph:
         # BUILD THE STATE GRAPH FOR THE QA CHAIN
         workflow = StateGraph(QAWorkflowState)
         
-        # ADD NODES FOR EACH STEP
-        workflow.add_node("retrieve_context", self._retrieve_context)
-        workflow.add_node("generate_answer", self._generate_answer)
+        # ADD NODES FOR EACH STEP -- invoke() USES THE SYNC FUNCTIONS, ainvoke() THE ASYNC ONES
+        workflow.add_node(
+            "retrieve_context",
+            RunnableLambda(self._retrieve_context, afunc=self._aretrieve_context, name="retrieve_context")
+        )
+        workflow.add_node(
+            "generate_answer",
+            RunnableLambda(self._generate_answer, afunc=self._agenerate_answer, name="generate_answer")
+        )
         
         # CONNECT THE NODES
         workflow.set_entry_point("retrieve_context")
@@ -149,24 +233,123 @@ class QAChain:
         
         return workflow.compile()
     
-    def run(self, question: str) -> Dict[str, Any]:
-        self.trace_data = {
-            "nodes": [],
-            "edges": []
-        }
-        self.node_counter = 0
+    @staticmethod
+    def get_visualization(state: QAWorkflowState) -> ChainVisualization:
+        # CONVERT TRACE DATA TO PROPER SCHEMA
+        nodes = [ChainNode(**node) for node in state.trace_nodes]
+        edges = [ChainEdge(**edge) for edge in state.trace_edges]
         
+        return ChainVisualization(nodes=nodes, edges=edges)
+    
+    def _result(self, question: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        return self._state_result(question, QAWorkflowState(**result))
+    
+    def _state_result(self, question: str, state: QAWorkflowState) -> Dict[str, Any]:
+        return {
+            "question": question,
+            "answer": state.answer,
+            "chain_visualization": self.get_visualization(state)
+        }
+    
+    def run(self, question: str) -> Dict[str, Any]:
         # RUN GRAPH
         result = self.graph.invoke({"question": question})
+        return self._result(question, result)
+    
+    async def arun(self, question: str) -> Dict[str, Any]:
+        # SAME AS run() WITHOUT BLOCKING THE EVENT LOOP ON RETRIEVAL OR THE LLM
+        result = await self.graph.ainvoke({"question": question})
+        return self._result(question, result)
+    
+    def start_stream(self, question: str) -> QAWorkflowState:
+        # RUN RETRIEVAL AND TRACE EVERYTHING UP TO THE ANSWER NODE
+        state = self._retrieve_context(QAWorkflowState(question=question))
+        self._add_reasoning(state)
+        return state
+    
+    async def astart_stream(self, question: str) -> QAWorkflowState:
+        state = await self._aretrieve_context(QAWorkflowState(question=question))
+        self._add_reasoning(state)
+        return state
+    
+    async def astream_answer(self, state: QAWorkflowState) -> AsyncIterator[str]:
+        # YIELD ANSWER TOKENS AS THE LLM PRODUCES THEM, THEN ADD THE ANSWER NODE
+        parts = []
+        usage = None
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
+        async for chunk in self.answer_chain.astream({"context": state.context, "question": state.question}):
+            # THE LAST CHUNK CARRIES ONLY THE TOKEN USAGE
+            if chunk.usage_metadata:
+                usage = chunk.usage_metadata
+            if not chunk.content:
+                continue
+            if not parts:
+                metrics.record_stage("generate.first_token", time.perf_counter() - started, timings)
+            parts.append(chunk.content)
+            yield chunk.content
+        metrics.record_stage("generate", time.perf_counter() - started, timings)
         
-        # CONVERT TRACE DATA TO PROPER SCHEMA
-        nodes = [ChainNode(**node) for node in self.trace_data["nodes"]]
-        edges = [ChainEdge(**edge) for edge in self.trace_data["edges"]]
+        self._add_answer(state, "".join(parts), self._answer_metadata(usage, timings))
+    
+    async def arun_batch(self,
+                         questions: List[str],
+                         max_concurrency: int,
+                         retrieval_batch_size: int) -> AsyncIterator[Tuple[int, Union[Dict[str, Any], Exception]]]:
+        """
+        Answer several questions, yielding each result as soon as it is ready.
         
-        chain_visualization = ChainVisualization(nodes=nodes, edges=edges)
+        Questions are retrieved retrieval_batch_size at a time (one embedding
+        call and one scoring pass per block) while the answers of earlier
+        blocks are generated, at most max_concurrency LLM calls at once.
+        Retrieval stays at most 2 * max_concurrency questions ahead of the
+        generations, so a large batch never holds every retrieved context.
         
-        return {
-            "question": question,
-            "answer": result["answer"],
-            "chain_visualization": chain_visualization
-        }
\ No newline at end of file
+        Args:
+            questions: The questions to answer
+            max_concurrency: Most LLM generations in flight
+            retrieval_batch_size: Questions retrieved together
+            
+        Yields:
+            (index, result) pairs in completion order -- result is the run()
+            dict, or the exception that question failed with
+        """
+        
+        concurrency = max(1, max_concurrency)
+        # RETRIEVED STATES WAITING FOR A GENERATION SLOT -- retrieve_all BLOCKS WHILE IT IS FULL
+        retrieved: asyncio.Queue = asyncio.Queue(maxsize=2 * concurrency)
+        completed: asyncio.Queue = asyncio.Queue()
+        
+        async def answer_next() -> None:
+            # ONE GENERATION SLOT, TAKING THE NEXT RETRIEVED QUESTION AS SOON AS IT IS FREE
+            while True:
+                index, state = await retrieved.get()
+                try:
+                    await self._agenerate_answer(state)
+                    completed.put_nowait((index, self._state_result(state.question, state)))
+                except Exception as exc:
+                    completed.put_nowait((index, exc))
+        
+        async def retrieve_all() -> None:
+            size = max(1, retrieval_batch_size)
+            for start in range(0, len(questions), size):
+                block = questions[start:start + size]
+                try:
+                    states = await self._aretrieve_many(block)
+                except Exception as exc:
+                    for offset in range(len(block)):
+                        completed.put_nowait((start + offset, exc))
+                    continue
+                for offset, state in enumerate(states):
+                    await retrieved.put((start + offset, state))
+        
+        tasks = [asyncio.create_task(answer_next()) for _ in range(min(concurrency, len(questions)))]
+        retriever = asyncio.create_task(retrieve_all())
+        try:
+            for _ in range(len(questions)):
+                yield await completed.get()
+        finally:
+            # THE CLIENT MAY GO AWAY MID-BATCH -- DROP WHAT IS STILL RUNNING
+            retriever.cancel()
+            for task in tasks:
+                task.cancel()
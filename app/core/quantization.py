@@ -0,0 +1,162 @@
+from typing import Optional
+import numpy as np
+
+# ROWS SCORED AT A TIME WHEN CODES HAVE TO BE WIDENED TO FLOAT32 FIRST
+SCORE_BLOCK_SIZE = 16384
+
+# NUMBER OF SET BITS IN EVERY BYTE VALUE
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint16)
+
+
+class Float32Codec:
+
+    # FULL-PRECISION ROWS, SCORES ARE EXACT COSINE SIMILARITIES
+
+    name = "none"
+    dtype = np.float32
+    exact = True
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    @property
+    def code_width(self) -> int:
+        return self.dim
+
+    def fit(self, vectors: np.ndarray) -> None:
+        pass
+
+    def state(self) -> dict:
+        # ARRAYS NEEDED TO RECREATE THE CODEC (SEE shared_index)
+        return {}
+
+    def load_state(self, state: dict) -> None:
+        pass
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors, dtype=np.float32)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes
+
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        return codes @ query
+
+    def score_many(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        # (rows x queries) SCORES IN ONE MATRIX-MATRIX PRODUCT
+        return codes @ queries.T
+
+
+class Int8Codec:
+
+    # PER-DIMENSION SCALED INT8: x_j ~= code_j * scale_j, 4x SMALLER THAN FLOAT32
+
+    name = "int8"
+    dtype = np.int8
+    exact = False
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.scales: Optional[np.ndarray] = None
+
+    @property
+    def code_width(self) -> int:
+        return self.dim
+
+    def fit(self, vectors: np.ndarray) -> None:
+        # SCALE EACH DIMENSION TO ITS OBSERVED RANGE, LATER OUTLIERS ARE CLIPPED
+        if not len(vectors):
+            return
+        max_abs = np.abs(vectors).max(axis=0)
+        max_abs[max_abs == 0] = 1.0
+        self.scales = (max_abs / 127.0).astype(np.float32)
+
+    def state(self) -> dict:
+        return {"scales": self.scales} if self.scales is not None else {}
+
+    def load_state(self, state: dict) -> None:
+        self.scales = state.get("scales")
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.scales is None:
+            self.fit(vectors)
+        return np.clip(np.rint(vectors / self.scales), -127, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scales
+
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # FOLD THE SCALES INTO THE QUERY, WIDEN CODES ONE BLOCK AT A TIME
+        scaled_query = query * self.scales
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_SIZE):
+            block = codes[start:start + SCORE_BLOCK_SIZE]
+            scores[start:start + len(block)] = block.astype(np.float32) @ scaled_query
+        return scores
+
+    def score_many(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        # AS score -- ONLY ONE WIDENED BLOCK EXISTS AT A TIME, NOT THE WHOLE SEARCH BLOCK
+        scaled_queries = (queries * self.scales).T
+        scores = np.empty((len(codes), len(queries)), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_SIZE):
+            block = codes[start:start + SCORE_BLOCK_SIZE]
+            scores[start:start + len(block)] = block.astype(np.float32) @ scaled_queries
+        return scores
+
+
+class BinaryCodec:
+
+    # ONE SIGN BIT PER DIMENSION, 32x SMALLER THAN FLOAT32, SCORED BY HAMMING DISTANCE
+
+    name = "binary"
+    dtype = np.uint8
+    exact = False
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    @property
+    def code_width(self) -> int:
+        return (self.dim + 7) // 8
+
+    def fit(self, vectors: np.ndarray) -> None:
+        pass
+
+    def state(self) -> dict:
+        return {}
+
+    def load_state(self, state: dict) -> None:
+        pass
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        signs = np.unpackbits(codes, axis=1, count=self.dim).astype(np.float32) * 2 - 1
+        return signs / np.sqrt(self.dim)
+
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # ANGLE ESTIMATE FROM THE FRACTION OF DIFFERING SIGN BITS: cos(pi * hamming / dim)
+        query_bits = np.packbits(query > 0)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_SIZE):
+            block = codes[start:start + SCORE_BLOCK_SIZE]
+            hamming = _POPCOUNT[np.bitwise_xor(block, query_bits)].sum(axis=1)
+            scores[start:start + len(block)] = np.cos(np.pi * hamming / self.dim)
+        return scores
+
+    def score_many(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        # NO MATRIX FORM FOR HAMMING DISTANCES -- ONE XOR/POPCOUNT PASS PER QUERY
+        return np.stack([self.score(codes, query) for query in queries], axis=1)
+
+
+CODECS = {
+    codec.name: codec
+    for codec in (Float32Codec, Int8Codec, BinaryCodec)
+}
+
+
+def make_codec(name: str, dim: int):
+    if name not in CODECS:
+        raise ValueError(f"Unknown retrieval quantization: {name}")
+    return CODECS[name](dim)
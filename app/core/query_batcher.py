@@ -0,0 +1,139 @@
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import queue
+import threading
+import time
+
+from app.core.metrics import metrics, query_batch_size
+
+
+class QueryEmbeddingBatcher:
+
+    # COALESCES QUERY EMBEDDINGS REQUESTED BY CONCURRENT CALLERS: TEXTS ARRIVING WITHIN
+    # window_seconds OF THE FIRST ONE (UP TO max_batch_size) GO OUT AS ONE embed_documents
+    # CALL, AND EVERY CALLER'S FUTURE RESOLVES WITH ITS OWN VECTOR
+
+    def __init__(self,
+                 embed_documents_fn: Callable[[List[str]], List[List[float]]],
+                 window_seconds: float = 0.005,
+                 max_batch_size: int = 64,
+                 max_in_flight: int = 4):
+        self.embed_documents_fn = embed_documents_fn
+        self.window_seconds = max(0.0, window_seconds)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_in_flight = max(1, max_in_flight)
+
+        self._queue: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._closed = False
+
+        # COUNTERS
+        self.batches = 0
+        self.texts = 0
+        self.provider_texts = 0
+        self.largest_batch = 0
+        self.errors = 0
+        self.provider_seconds = 0.0
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Query embedding batcher is closed")
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_in_flight,
+                    thread_name_prefix="query-batch"
+                )
+                self._thread = threading.Thread(target=self._collect, name="query-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        # QUEUE A TEXT, THE FUTURE RESOLVES WITH ITS EMBEDDING
+        # RAISES RuntimeError ONCE CLOSED -- NOTHING WOULD EVER RESOLVE THE FUTURE
+        if self._thread is None:
+            self._start()
+        future = Future()
+        with self._lock:
+            # UNDER THE LOCK SO NOTHING LANDS BEHIND close()'S STOP MARKER
+            if self._closed:
+                raise RuntimeError("Query embedding batcher is closed")
+            self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def _collect(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.window_seconds
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._executor.submit(self._embed_batch, batch)
+            if stop:
+                return
+
+    def _embed_batch(self, batch: List[Tuple[str, Future]]) -> None:
+        # IDENTICAL QUESTIONS IN ONE BATCH ARE EMBEDDED ONCE
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        started = time.perf_counter()
+        try:
+            embeddings = dict(zip(texts, self.embed_documents_fn(texts)))
+        except Exception as exc:
+            with self._lock:
+                self.errors += 1
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self.batches += 1
+            self.texts += len(batch)
+            self.provider_texts += len(texts)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.provider_seconds += elapsed
+        if metrics.enabled:
+            query_batch_size.observe(len(batch))
+            metrics.record_stage("query_batch.embed", elapsed)
+        for text, future in batch:
+            future.set_result(embeddings[text])
+
+    def close(self) -> None:
+        # EMBED WHAT IS ALREADY QUEUED, THEN STOP
+        with self._lock:
+            self._closed = True
+            thread, executor = self._thread, self._executor
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+            executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "window_ms": 1000 * self.window_seconds,
+                "max_batch_size": self.max_batch_size,
+                "batches": self.batches,
+                "texts": self.texts,
+                "provider_texts": self.provider_texts,
+                "avg_batch_size": self.texts / self.batches if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "errors": self.errors,
+                "avg_provider_ms": 1000 * self.provider_seconds / self.batches if self.batches else 0.0
+            }
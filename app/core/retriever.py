@@ -1,52 +1,276 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Optional, Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from uuid import UUID
+import logging
+import time
 import numpy as np
 from sqlalchemy.orm import Session
 from langchain_openai import OpenAIEmbeddings
 
 from app.config import settings
+from app.db.database import SessionLocal
 from app.db.models import DocumentChunk
+from app.db.vector_codec import decode_embedding
+from app.core.vector_index import VectorIndex, vector_index
+from app.core.lexical_index import lexical_index, reciprocal_rank_fusion
+from app.core.embedding_cache import query_embedding_cache
+from app.core.clients import build_embeddings
+from app.core.query_batcher import QueryEmbeddingBatcher
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# EMBEDS QUERIES WHEN NO BATCHER IS GIVEN, SO BM25 RUNS WHILE THE PROVIDER ROUND-TRIP IS IN FLIGHT
+_query_embedding_executor = ThreadPoolExecutor(
+    max_workers=settings.EMBEDDING_MAX_CONCURRENCY,
+    thread_name_prefix="query-embedding"
+)
 
 class VectorRetriever:
-    
-    # RETRIEVER FOR FINDING RELEVANT DOCUMENT CHUNKS USING VECTOR SIMILARITY
-    
-    def __init__(self, db: Session):
+
+    # RETRIEVER FOR FINDING RELEVANT DOCUMENT CHUNKS USING VECTOR SIMILARITY,
+    # BM25 OVER THE CHUNK TEXT, OR BOTH FUSED BY RECIPROCAL RANK (settings.RETRIEVAL_MODE)
+
+    def __init__(self,
+                 db: Session,
+                 mode: str = None,
+                 embeddings: OpenAIEmbeddings = None,
+                 query_batcher: QueryEmbeddingBatcher = None):
         self.db = db
-        self.embeddings = OpenAIEmbeddings(
-            model=settings.EMBEDDING_MODEL,
-            openai_api_key=settings.OPENAI_API_KEY
-        )
-    
-    def _cosine_similarity(self, a: List[float], b: List[float]) -> float:
-        # CALC COSINE SIMILARITY BETWEEN TWO VECTORS
-        a_norm = np.linalg.norm(a)
-        b_norm = np.linalg.norm(b)
-        return np.dot(a, b) / (a_norm * b_norm)
-    
+        self.mode = mode or settings.RETRIEVAL_MODE
+        if self.mode not in ("vector", "lexical", "hybrid"):
+            raise ValueError(f"Unknown retrieval mode: {self.mode}")
+        # PASS THE APP-WIDE CLIENT -- BUILDING ONE PER RETRIEVER DROPS KEEP-ALIVE CONNECTIONS
+        self.embeddings = embeddings or build_embeddings()
+        # COALESCES QUERY EMBEDDINGS ACROSS CONCURRENT REQUESTS WHEN GIVEN
+        self.query_batcher = query_batcher
+        self.index = vector_index
+        self.lexical_index = lexical_index
+        self.query_cache = query_embedding_cache
+
     def retrieve(self, query: str, top_k: int = None) -> List[Dict[str, Any]]:
         # RETURN LIST OF RELEVANT DOCS CHUNKS WITH SIMILARITY SCORES
+        return self.retrieve_many([query], top_k)[0]
+
+    def retrieve_many(self, queries: List[str], top_k: int = None) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieve chunks for several queries at once.
+
+        Query embeddings go out together (one batch call when a batcher is set),
+        vector scoring is one matrix-matrix product, and chunk rows for every
+        query are fetched in a single round-trip.
+
+        Args:
+            queries: The query texts
+            top_k: Results per query, defaults to settings.TOP_K_RETRIEVAL
+
+        Returns:
+            One result list per query, in the same order as the input
+        """
+
         if top_k is None:
             top_k = settings.TOP_K_RETRIEVAL
-            
-        query_embedding = self.embeddings.embed_query(query)
-        all_chunks = self.db.query(DocumentChunk).all()
-        
-        # CALCULATE SIMILARITY SCORES
+        if not queries:
+            return []
+
+        depth = top_k if self.mode == "vector" else max(top_k, settings.RETRIEVAL_FUSION_DEPTH)
+        futures = None
+        if self.mode != "lexical":
+            futures = self._submit_query_embeddings(queries)
+
+        # BUILD THE IN-MEMORY INDEXES ON FIRST USE
+        lexical_hits = [[] for _ in queries]
+        if self.mode != "vector":
+            with metrics.span("retrieve.lexical_search"):
+                self.lexical_index.ensure_loaded(self.db)
+                lexical_hits = [self.lexical_index.search(query, depth) for query in queries]
+
+        # IN HYBRID MODE THIS IS ONLY THE PART OF THE ROUND-TRIP BM25 DID NOT HIDE
+        query_embeddings = [None] * len(queries)
+        if futures is not None:
+            with metrics.span("retrieve.embed_query"):
+                if self.mode == "vector":
+                    # NO BM25 TO FALL BACK ON -- BOUNDED BY THE PROVIDER TIMEOUT SO A STUCK CALL FAILS THE REQUEST
+                    query_embeddings = [
+                        future.result(timeout=settings.OPENAI_TIMEOUT_SECONDS) for future in futures
+                    ]
+                else:
+                    query_embeddings = self._wait_for_embeddings(futures)
+
+        vector_hits = [[] for _ in queries]
+        embedded = [i for i, embedding in enumerate(query_embeddings) if embedding is not None]
+        if embedded:
+            with metrics.span("retrieve.vector_search"):
+                self.index.ensure_loaded(self.db)
+                searched = self.index.search_many(
+                    [query_embeddings[i] for i in embedded], self.index.shortlist_size(depth)
+                )
+            for i, hits in zip(embedded, searched):
+                vector_hits[i] = hits
+
+        # FETCH CONTENT ONLY FOR THE CANDIDATES (THE WHOLE SHORTLIST WHEN QUANTIZED)
+        chunk_ids = set()
+        for hits in vector_hits + lexical_hits:
+            chunk_ids.update(chunk_id for chunk_id, _ in hits)
+        rerank = not self.index.exact and any(vector_hits)
+        with metrics.span("retrieve.fetch_chunks"):
+            rows_by_id = self._fetch_rows(chunk_ids, with_embeddings=rerank)
+
         results = []
-        for chunk in all_chunks:
-            if chunk.embedding:
-                # CONVERT EMBEDDING FROM JSON TO LIST IF NEEDED
-                chunk_embedding = chunk.embedding if isinstance(chunk.embedding, List) else list(chunk.embedding)
-                
-                similarity = self._cosine_similarity(query_embedding, chunk_embedding)
-                
-                results.append({
-                    "chunk_id": chunk.id,
-                    "document_id": chunk.document_id,
-                    "content": chunk.content,
-                    "metadata": chunk.metadata,
-                    "similarity": similarity
-                })
-        results.sort(key=lambda x: x["similarity"], reverse=True)
-        return results[:top_k]
-                
\ No newline at end of file
+        for query_embedding, query_vector_hits, query_lexical_hits in zip(query_embeddings, vector_hits, lexical_hits):
+            query_vector_hits = self._present(query_vector_hits, rows_by_id)
+            if query_vector_hits and not self.index.exact:
+                with metrics.span("retrieve.rerank"):
+                    query_vector_hits = self._rerank(query_embedding, query_vector_hits, rows_by_id)
+            query_vector_hits = query_vector_hits[:depth]
+
+            if self.mode == "vector":
+                results.append([
+                    self._result(rows_by_id[chunk_id], similarity=similarity, score=similarity)
+                    for chunk_id, similarity in query_vector_hits
+                ])
+                continue
+
+            query_lexical_hits = self._present(query_lexical_hits, rows_by_id)
+            similarities = dict(query_vector_hits)
+            lexical_scores = dict(query_lexical_hits)
+            fused = reciprocal_rank_fusion([query_vector_hits, query_lexical_hits], k=settings.RRF_K)
+            results.append([
+                self._result(
+                    rows_by_id[chunk_id],
+                    similarity=similarities.get(chunk_id),
+                    lexical_score=lexical_scores.get(chunk_id),
+                    score=score
+                )
+                for chunk_id, score in fused[:top_k]
+            ])
+        return results
+
+    def _submit_query_embedding(self, query: str) -> Future:
+        # CACHED QUERIES RESOLVE IMMEDIATELY, THE REST GO TO THE BATCHER OR A WORKER THREAD
+        query_batcher = self.query_batcher
+
+        def submit_fn(text: str) -> Future:
+            if query_batcher is not None:
+                try:
+                    return query_batcher.submit(text)
+                except RuntimeError:
+                    # BATCHER ALREADY CLOSED (SHUTTING DOWN) -- EMBED THIS ONE DIRECTLY
+                    pass
+            return _query_embedding_executor.submit(self.embeddings.embed_query, text)
+        return self.query_cache.get_or_submit(settings.EMBEDDING_MODEL, query, submit_fn)
+
+    def _submit_query_embeddings(self, queries: List[str]) -> List[Future]:
+        if self.query_batcher is not None or len(queries) == 1:
+            return [self._submit_query_embedding(query) for query in queries]
+
+        # NO BATCHER TO COALESCE THEM -- THE CACHE MISSES GO OUT AS ONE embed_documents CALL
+        pending: Dict[str, List[Future]] = {}
+
+        def submit_fn(text: str) -> Future:
+            future = Future()
+            pending.setdefault(text, []).append(future)
+            return future
+
+        futures = [self.query_cache.get_or_submit(settings.EMBEDDING_MODEL, query, submit_fn) for query in queries]
+        if pending:
+            _query_embedding_executor.submit(self._embed_pending, pending)
+        return futures
+
+    def _embed_pending(self, pending: Dict[str, List[Future]]) -> None:
+        texts = list(pending)
+        try:
+            embeddings = self.embeddings.embed_documents(texts)
+        except Exception as exc:
+            for futures in pending.values():
+                for future in futures:
+                    future.set_exception(exc)
+            return
+        for text, embedding in zip(texts, embeddings):
+            for future in pending[text]:
+                future.set_result(embedding)
+
+    def _wait_for_embeddings(self, futures: List[Future]) -> List[Optional[List[float]]]:
+        # A SLOW OR FAILING PROVIDER DEGRADES TO LEXICAL-ONLY RESULTS INSTEAD OF AN ERROR
+        deadline = time.monotonic() + settings.QUERY_EMBEDDING_TIMEOUT_SECONDS
+        embeddings = []
+        for future in futures:
+            try:
+                embeddings.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+            except Exception:
+                logger.warning("Query embedding unavailable, answering from BM25 only", exc_info=True)
+                embeddings.append(None)
+        return embeddings
+
+    def _fetch_rows(self, chunk_ids, with_embeddings: bool) -> Dict[UUID, Any]:
+        if not chunk_ids:
+            return {}
+        columns = [
+            DocumentChunk.id,
+            DocumentChunk.document_id,
+            DocumentChunk.content,
+            DocumentChunk.chunk_metadata
+        ]
+        if with_embeddings:
+            columns += [DocumentChunk.embedding, DocumentChunk.embedding_dim, DocumentChunk.legacy_embedding]
+        rows = (
+            self.db.query(*columns)
+            .filter(DocumentChunk.id.in_(list(chunk_ids)))
+            .all()
+        )
+        return {row.id: row for row in rows}
+
+    @staticmethod
+    def _present(hits: List[Tuple[UUID, float]], rows_by_id: Dict[UUID, Any]) -> List[Tuple[UUID, float]]:
+        # CHUNKS DELETED SINCE THEY WERE SCORED ARE SKIPPED
+        return [(chunk_id, score) for chunk_id, score in hits if chunk_id in rows_by_id]
+
+    @staticmethod
+    def _result(row, similarity: Optional[float], score: float, lexical_score: Optional[float] = None) -> Dict[str, Any]:
+        return {
+            "chunk_id": row.id,
+            "document_id": row.document_id,
+            "content": row.content,
+            "metadata": row.chunk_metadata,
+            "similarity": similarity,
+            "lexical_score": lexical_score,
+            "score": score
+        }
+
+    def _rerank(self,
+                query_embedding: List[float],
+                hits: List[Tuple[UUID, float]],
+                rows_by_id: Dict[UUID, Any]) -> List[Tuple[UUID, float]]:
+        # RE-SCORE A QUANTIZED SHORTLIST AGAINST THE STORED FULL-PRECISION VECTORS
+        embeddings = []
+        for chunk_id, _ in hits:
+            row = rows_by_id[chunk_id]
+            if row.embedding is not None:
+                embeddings.append(decode_embedding(row.embedding, row.embedding_dim))
+            else:
+                embeddings.append(np.asarray(row.legacy_embedding, dtype=np.float32))
+
+        scores = VectorIndex.exact_scores(query_embedding, embeddings)
+        reranked = [(chunk_id, float(score)) for (chunk_id, _), score in zip(hits, scores)]
+        reranked.sort(key=lambda hit: hit[1], reverse=True)
+        return reranked
+
+
+def make_retriever_fn(embeddings: OpenAIEmbeddings,
+                      query_batcher: QueryEmbeddingBatcher = None,
+                      session_factory: Callable = SessionLocal) -> Callable[[str], List[Dict[str, Any]]]:
+    # retriever_fn FOR A SHARED QAChain -- EVERY CALL GETS ITS OWN SESSION, THE CLIENTS ARE SHARED
+    def retrieve(question: str) -> List[Dict[str, Any]]:
+        with session_factory() as session:
+            return VectorRetriever(session, embeddings=embeddings, query_batcher=query_batcher).retrieve(question)
+    return retrieve
+
+
+def make_batch_retriever_fn(embeddings: OpenAIEmbeddings,
+                            query_batcher: QueryEmbeddingBatcher = None,
+                            session_factory: Callable = SessionLocal) -> Callable[[List[str]], List[List[Dict[str, Any]]]]:
+    # SAME FOR A LIST OF QUESTIONS -- ONE retrieve_many CALL, ONE SESSION
+    def retrieve_many(questions: List[str]) -> List[List[Dict[str, Any]]]:
+        with session_factory() as session:
+            return VectorRetriever(session, embeddings=embeddings, query_batcher=query_batcher).retrieve_many(questions)
+    return retrieve_many
@@ -0,0 +1,234 @@
+from typing import Dict, Any, Optional, Tuple, Iterator
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from app.core.quantization import make_codec
+
+# BYTES PER STORED UUID (chunk_ids / document_ids ROWS)
+ID_WIDTH = 16
+
+CURRENT = "CURRENT"
+LOCK_FILE = "writer.lock"
+MEMBERS_FILE = "members.lock"
+
+
+class MappedGeneration:
+    # ONE PUBLISHED MANIFEST, MAPPED READ-ONLY
+
+    __slots__ = ("manifest", "codec", "codes", "chunk_ids", "document_ids", "alive")
+
+    def __init__(self, manifest, codec, codes, chunk_ids, document_ids, alive):
+        self.manifest = manifest
+        self.codec = codec
+        self.codes = codes
+        self.chunk_ids = chunk_ids
+        self.document_ids = document_ids
+        self.alive = alive
+
+
+class SharedIndexStore:
+
+    # ON-DISK GENERATIONS OF THE VECTOR INDEX THAT EVERY WORKER ON THE HOST MAPS READ-ONLY,
+    # SO THE PAGES ARE HELD ONCE IN THE PAGE CACHE INSTEAD OF ONCE PER PROCESS
+    #
+    #   CURRENT                        JSON MANIFEST OF THE LIVE STATE, SWAPPED WITH os.replace
+    #   writer.lock                    flock()ED BY WHICHEVER PROCESS IS CHANGING THE INDEX
+    #   members.lock                   SHARED flock() HELD BY EVERY PROCESS USING THE INDEX
+    #   gen-<seq>/codes.bin            ENCODED ROWS, APPENDED IN PLACE
+    #   gen-<seq>/chunk_ids.bin        16-BYTE UUIDS, ONE PER ROW
+    #   gen-<seq>/document_ids.bin
+    #   gen-<seq>/codec.npz            QUANTIZER STATE
+    #   gen-<seq>/deleted-<seq>.npy    TOMBSTONED ROWS AS OF THAT MANIFEST
+    #
+    # A MANIFEST SAYS HOW MANY ROWS OF ITS GENERATION ARE VISIBLE, SO A WRITER APPENDING
+    # PAST THAT COUNT NEVER DISTURBS A READER; COMPACTION AND REBUILDS START A NEW GENERATION.
+    # OLD GENERATIONS ARE UNLINKED AFTER THE SWAP -- MAPPINGS ALREADY OPEN STAY VALID
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._thread_lock = threading.Lock()
+        self._members_file = None
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.directory, *parts)
+
+    def signature(self) -> Optional[Tuple[int, int]]:
+        # CHEAP CHANGE CHECK -- os.replace GIVES CURRENT A NEW INODE ON EVERY PUBLISH
+        try:
+            stat = os.stat(self._path(CURRENT))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def read_manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(CURRENT)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def writer_lock(self) -> Iterator[None]:
+        # ONE WRITER PER HOST (flock) AND PER PROCESS (flock IS PER OPEN FILE, NOT PER THREAD)
+        os.makedirs(self.directory, exist_ok=True)
+        with self._thread_lock:
+            with open(self._path(LOCK_FILE), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def join(self) -> bool:
+        """
+        Register this process as a user of the index for the rest of its life.
+
+        Returns:
+            True when no other live process uses the index, so the files on disk
+            may be left over from an earlier run. The caller should rebuild them
+            and then call joined() -- other processes block in join() until then.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._members_file = open(self._path(MEMBERS_FILE), "a")
+        try:
+            fcntl.flock(self._members_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            fcntl.flock(self._members_file, fcntl.LOCK_SH)
+            return False
+
+    def joined(self) -> None:
+        # THE FIRST MEMBER IS DONE REBUILDING -- LET THE OTHERS IN
+        fcntl.flock(self._members_file, fcntl.LOCK_SH)
+
+    def open(self, manifest: Dict[str, Any]) -> MappedGeneration:
+        generation = manifest["generation"]
+        rows = manifest["rows"]
+        codec = make_codec(manifest["quantization"], manifest["dim"])
+        with np.load(self._path(generation, "codec.npz")) as state:
+            codec.load_state(dict(state))
+
+        if rows:
+            codes = np.memmap(self._path(generation, "codes.bin"), dtype=codec.dtype, mode="r",
+                              shape=(rows, codec.code_width))
+            chunk_ids = np.memmap(self._path(generation, "chunk_ids.bin"), dtype=np.uint8, mode="r",
+                                  shape=(rows, ID_WIDTH))
+            document_ids = np.memmap(self._path(generation, "document_ids.bin"), dtype=np.uint8, mode="r",
+                                     shape=(rows, ID_WIDTH))
+        else:
+            codes = np.empty((0, codec.code_width), dtype=codec.dtype)
+            chunk_ids = np.empty((0, ID_WIDTH), dtype=np.uint8)
+            document_ids = np.empty((0, ID_WIDTH), dtype=np.uint8)
+
+        alive = None
+        if manifest.get("deleted"):
+            alive = np.ones(rows, dtype=bool)
+            alive[np.load(self._path(generation, manifest["deleted"]))] = False
+        return MappedGeneration(manifest, codec, codes, chunk_ids, document_ids, alive)
+
+    def open_current(self) -> Optional[MappedGeneration]:
+        # A WRITER CAN PUBLISH, AND REMOVE WHAT THE OLD MANIFEST NAMED, BETWEEN OUR READ AND
+        # OUR OPEN -- READ AGAIN AND RETRY
+        for _ in range(10):
+            manifest = self.read_manifest()
+            if manifest is None:
+                return None
+            try:
+                return self.open(manifest)
+            except FileNotFoundError:
+                continue
+        raise RuntimeError(f"Could not open the shared vector index in {self.directory}")
+
+    # --- WRITER SIDE, CALLED UNDER writer_lock() ---
+
+    def write_generation(self,
+                         previous: Optional[Dict[str, Any]],
+                         codec,
+                         codes: np.ndarray,
+                         chunk_ids: np.ndarray,
+                         document_ids: np.ndarray) -> Dict[str, Any]:
+        # A FRESH GENERATION HOLDING EXACTLY THESE ROWS
+        seq = (previous["seq"] + 1) if previous else 1
+        generation = f"gen-{seq:08d}"
+        os.makedirs(self._path(generation), exist_ok=True)
+        np.savez(self._path(generation, "codec.npz"), **codec.state())
+        for name, array in (("codes.bin", codes), ("chunk_ids.bin", chunk_ids), ("document_ids.bin", document_ids)):
+            with open(self._path(generation, name), "wb") as f:
+                f.write(np.ascontiguousarray(array).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        manifest = {
+            "seq": seq,
+            "generation": generation,
+            "rows": len(chunk_ids),
+            "dim": codec.dim,
+            "quantization": codec.name,
+            "deleted": None,
+            "deleted_count": 0
+        }
+        self._publish(manifest)
+        self._remove_stale(generation)
+        return manifest
+
+    def append(self,
+               manifest: Dict[str, Any],
+               codes: np.ndarray,
+               chunk_ids: np.ndarray,
+               document_ids: np.ndarray) -> Dict[str, Any]:
+        # ADD ROWS PAST THE VISIBLE COUNT, THEN PUBLISH THE LARGER COUNT
+        generation = manifest["generation"]
+        rows = manifest["rows"]
+        for name, array in (("codes.bin", codes), ("chunk_ids.bin", chunk_ids), ("document_ids.bin", document_ids)):
+            array = np.ascontiguousarray(array)
+            row_bytes = array.itemsize * int(np.prod(array.shape[1:]))
+            with open(self._path(generation, name), "r+b") as f:
+                # A WRITER THAT DIED MID-APPEND MAY HAVE LEFT BYTES NO MANIFEST COVERS
+                f.truncate(rows * row_bytes)
+                f.seek(rows * row_bytes)
+                f.write(array.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        updated = dict(manifest, seq=manifest["seq"] + 1, rows=rows + len(chunk_ids))
+        self._publish(updated)
+        return updated
+
+    def write_tombstones(self, manifest: Dict[str, Any], deleted_rows: np.ndarray) -> Dict[str, Any]:
+        seq = manifest["seq"] + 1
+        name = f"deleted-{seq:08d}.npy"
+        np.save(self._path(manifest["generation"], name), np.asarray(deleted_rows, dtype=np.int64))
+        updated = dict(manifest, seq=seq, deleted=name, deleted_count=len(deleted_rows))
+        self._publish(updated)
+        if manifest.get("deleted"):
+            # READERS LOAD TOMBSTONES INTO MEMORY, THE OLD FILE IS NOT MAPPED ANYWHERE
+            try:
+                os.remove(self._path(manifest["generation"], manifest["deleted"]))
+            except FileNotFoundError:
+                pass
+        return updated
+
+    def _publish(self, manifest: Dict[str, Any]) -> None:
+        temp_path = self._path(f"{CURRENT}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._path(CURRENT))
+        directory_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+    def _remove_stale(self, keep: str) -> None:
+        for name in os.listdir(self.directory):
+            if name.startswith("gen-") and name != keep:
+                shutil.rmtree(self._path(name), ignore_errors=True)
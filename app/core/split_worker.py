@@ -0,0 +1,21 @@
+from typing import List, Optional
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# RUNS INSIDE THE BULK INGESTION PROCESS POOL -- IMPORTS NOTHING FROM THE APP, SO A
+# SPAWNED WORKER DOES NOT BUILD SETTINGS, DB ENGINES OR INDEXES JUST TO SPLIT TEXT
+
+_splitter: Optional[RecursiveCharacterTextSplitter] = None
+
+
+def init_splitter(chunk_size: int, chunk_overlap: int) -> None:
+    # POOL INITIALIZER, ONE SPLITTER PER WORKER PROCESS
+    global _splitter
+    _splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        add_start_index=True
+    )
+
+
+def split_text(text: str) -> List[str]:
+    return _splitter.split_text(text)
@@ -0,0 +1,691 @@
+from typing import List, Tuple, Sequence, Optional, Iterable, Iterator, Dict, Any
+from contextlib import nullcontext
+from datetime import datetime
+import logging
+import threading
+import time
+import uuid
+import numpy as np
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db.models import DocumentChunk
+from app.db.vector_codec import decode_embedding
+from app.core.ann import IVFLists, top_k_indices, resolve_nlist, should_train
+from app.core.quantization import make_codec
+from app.core.shared_index import SharedIndexStore, ID_WIDTH
+from app.core.index_snapshot import SnapshotStore, chunk_high_water_mark, documents_to_replay, existing_documents
+
+logger = logging.getLogger(__name__)
+
+# ROWS SCORED PER MATRIX-MATRIX PRODUCT IN search_many
+SEARCH_BLOCK_SIZE = 65536
+
+_ID_VIEW = np.dtype((np.void, ID_WIDTH))
+
+
+def uuid_rows(ids: Sequence[Optional[uuid.UUID]]) -> np.ndarray:
+    # (n, 16) uint8 ROWS FOR UUIDS -- None BECOMES ALL ZEROS
+    raw = b"".join(value.bytes if value is not None else bytes(ID_WIDTH) for value in ids)
+    return np.frombuffer(raw, dtype=np.uint8).reshape(-1, ID_WIDTH).copy()
+
+
+def id_keys(rows: np.ndarray) -> np.ndarray:
+    # ONE COMPARABLE 16-BYTE SCALAR PER ROW
+    return np.ascontiguousarray(rows).view(_ID_VIEW).ravel()
+
+
+class _IndexSnapshot:
+    # IMMUTABLE VIEW OF THE INDEX -- SWAPPED AS A WHOLE SO READERS NEVER SEE A TORN STATE
+    # IDS ARE FLAT (rows, 16) BYTE ARRAYS, NOT PYTHON OBJECTS, SO THEY CAN LIVE IN A SHARED MAPPING
+    # alive IS None WHEN NO ROW IS TOMBSTONED
+
+    __slots__ = ("codes", "chunk_ids", "document_ids", "alive", "live_count", "codec", "ivf")
+
+    def __init__(self,
+                 codes: np.ndarray,
+                 chunk_ids: np.ndarray,
+                 document_ids: np.ndarray,
+                 alive: Optional[np.ndarray] = None,
+                 codec=None,
+                 ivf: Optional[IVFLists] = None):
+        self.codes = codes
+        self.chunk_ids = chunk_ids
+        self.document_ids = document_ids
+        self.alive = alive
+        self.live_count = len(chunk_ids) if alive is None else int(alive.sum())
+        self.codec = codec
+        self.ivf = ivf
+
+    def chunk_id(self, row: int) -> uuid.UUID:
+        return uuid.UUID(bytes=self.chunk_ids[row].tobytes())
+
+
+class VectorIndex:
+
+    # INDEX OF PRE-NORMALIZED CHUNK EMBEDDINGS
+    # ROW i OF THE CODE MATRIX BELONGS TO chunk_ids[i] / document_ids[i]
+    # mode "exact" SCORES EVERY ROW, mode "ivf" ONLY THE ROWS IN THE nprobe
+    # INVERTED LISTS CLOSEST TO THE QUERY (EXACT UNTIL THERE IS ENOUGH DATA TO TRAIN)
+    # quantization "none" KEEPS FLOAT32 ROWS, "int8" / "binary" KEEP COMPACT CODES
+    # WHOSE SCORES ARE APPROXIMATE -- CALLERS RE-RANK A SHORTLIST (SEE exact_scores)
+    # DELETED ROWS ARE TOMBSTONED AND COMPACTED AWAY ONCE compact_ratio OF THE ROWS ARE DEAD
+    # WITHOUT A store THE ROWS LIVE IN THIS PROCESS; WITH ONE THEY LIVE IN FILES EVERY
+    # WORKER ON THE HOST MAPS, AND CHANGES ARE PUBLISHED AS NEW GENERATIONS (SEE shared_index)
+    # WITH snapshots A COLD START LOADS THE LAST SAVED COPY AND REPLAYS ONLY WHAT CHANGED
+
+    LOAD_BATCH_SIZE = 1000
+    MIN_CAPACITY = 1024
+
+    def __init__(self,
+                 mode: str = "exact",
+                 quantization: str = "none",
+                 shortlist_multiplier: int = 4,
+                 nlist: int = 0,
+                 nprobe: int = 16,
+                 train_iterations: int = 10,
+                 min_train_size: int = 10000,
+                 retrain_growth: float = 2.0,
+                 compact_ratio: float = 0.2,
+                 store: Optional[SharedIndexStore] = None,
+                 snapshots: Optional[SnapshotStore] = None):
+        if mode not in ("exact", "ivf"):
+            raise ValueError(f"Unknown retrieval index mode: {mode}")
+        make_codec(quantization, 0)
+
+        self.mode = mode
+        self.quantization = quantization
+        self.shortlist_multiplier = max(1, shortlist_multiplier)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iterations = train_iterations
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.compact_ratio = compact_ratio
+        self.store = store
+        self.snapshots = snapshots
+        # HOW THE LAST BUILD WENT -- SOURCE, REPLAYED DOCUMENTS, SECONDS
+        self.load_stats: Dict[str, Any] = {}
+        # (chunk high-water mark, time) OF THE LAST BUILD'S READ OF THE DB -- WHAT A PRIVATE
+        # INDEX IS KNOWN TO COVER, SINCE CHUNKS OTHER WORKERS ADD LATER NEVER REACH IT
+        self._synced_marks: Optional[Tuple[Optional[datetime], datetime]] = None
+
+        self._lock = threading.Lock()
+        self._snapshot = _IndexSnapshot(
+            np.empty((0, 0), dtype=np.float32),
+            np.empty((0, ID_WIDTH), dtype=np.uint8),
+            np.empty((0, ID_WIDTH), dtype=np.uint8)
+        )
+        self._loaded = False
+
+        # APPEND BUFFERS (IN-PROCESS ONLY) -- SNAPSHOTS ARE VIEWS OF THE FIRST size ROWS,
+        # SO WRITING PAST THEM NEVER DISTURBS A READER HOLDING AN OLDER SNAPSHOT
+        self._codec = None
+        self._code_buffer = np.empty((0, 0), dtype=np.float32)
+        self._chunk_id_buffer = np.empty((0, ID_WIDTH), dtype=np.uint8)
+        self._document_id_buffer = np.empty((0, ID_WIDTH), dtype=np.uint8)
+
+        # LAST SHARED GENERATION THIS PROCESS MAPPED
+        self._manifest = None
+        self._store_signature = None
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        # L2-NORMALIZE ROWS SO A DOT PRODUCT IS THE COSINE SIMILARITY
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def size(self) -> int:
+        return self._snapshot.live_count
+
+    @property
+    def dim(self) -> int:
+        codec = self._snapshot.codec
+        return codec.dim if codec is not None else 0
+
+    @property
+    def exact(self) -> bool:
+        # WHETHER search() SCORES ARE EXACT COSINE SIMILARITIES
+        return self.quantization == "none"
+
+    @property
+    def memory_bytes(self) -> int:
+        # BYTES OF CODES AND IDS -- SHARED PAGES WHEN A store IS SET, NOT PRIVATE MEMORY
+        snapshot = self._snapshot
+        return snapshot.codes.nbytes + snapshot.chunk_ids.nbytes + snapshot.document_ids.nbytes
+
+    def _writing(self):
+        # HOLD THE HOST-WIDE WRITER LOCK WHILE CHANGING A SHARED INDEX
+        return self.store.writer_lock() if self.store is not None else nullcontext()
+
+    def load(self, db: Session) -> None:
+        # BUILD THE INDEX FROM EVERY EMBEDDED CHUNK IN THE DB
+        with self._lock, self._writing():
+            self._build_locked(db)
+
+    def ensure_loaded(self, db: Session) -> None:
+        # ALSO WHERE A SHARED INDEX PICKS UP GENERATIONS OTHER WORKERS PUBLISHED
+        if self._loaded:
+            if self.store is not None and self.store.signature() != self._store_signature:
+                with self._lock:
+                    self._refresh_locked()
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if self.store is None:
+                self._build_locked(db)
+                return
+            # THE FIRST PROCESS ON THE HOST REBUILDS FROM THE DB (FILES FROM AN EARLIER RUN MAY
+            # BE STALE), THE OTHERS WAIT IN join() AND THEN MAP WHAT IT PUBLISHED
+            first = self.store.join()
+            try:
+                with self._writing():
+                    if first or self.store.read_manifest() is None:
+                        self._build_locked(db)
+            finally:
+                if first:
+                    self.store.joined()
+            self._refresh_locked()
+
+    def _build_locked(self, db: Session) -> None:
+        # INSTALL THE LAST SNAPSHOT PLUS WHAT CHANGED SINCE, OR (WITHOUT ONE) EVERY ROW IN THE DB
+        started = time.perf_counter()
+        # MARKS FIRST, THEN THE ROWS -- EVERY CHUNK THE MARKS COVER IS ALREADY IN WHAT IS READ
+        synced_marks = (chunk_high_water_mark(db), datetime.utcnow())
+        snapshot = self.snapshots.load(self.quantization) if self.snapshots is not None else None
+        if snapshot is None:
+            self._replace_locked(*self._read_db(db))
+            self.load_stats = {"source": "db", "rows": self.size}
+        else:
+            self._replace_locked(snapshot.codec, snapshot.codes, snapshot.chunk_ids, snapshot.document_ids)
+            replay = documents_to_replay(db, snapshot)
+            snapshot_documents = {
+                uuid.UUID(bytes=key.tobytes()) for key in np.unique(id_keys(snapshot.document_ids))
+            }
+            deleted = snapshot_documents - existing_documents(db)
+            self._remove_documents_locked(replay | deleted)
+
+            replayed_rows = 0
+            batch = ([], [], [])
+            for row in self._db_rows(db, replay):
+                for column, value in zip(batch, row):
+                    column.append(value)
+                if len(batch[0]) >= self.LOAD_BATCH_SIZE:
+                    replayed_rows += self._add_locked(*batch)
+                    batch = ([], [], [])
+            replayed_rows += self._add_locked(*batch)
+
+            self.load_stats = {
+                "source": "snapshot",
+                "snapshot_version": snapshot.manifest["version"],
+                "rows": self.size,
+                "replayed_documents": len(replay),
+                "replayed_rows": replayed_rows,
+                "deleted_documents": len(deleted)
+            }
+        self._synced_marks = synced_marks
+        self.load_stats["seconds"] = round(time.perf_counter() - started, 3)
+        logger.info("Vector index loaded: %s", self.load_stats)
+
+    def _db_rows(self,
+                 db: Session,
+                 document_ids: Optional[Iterable[uuid.UUID]] = None) -> Iterator[Tuple[uuid.UUID, uuid.UUID, np.ndarray]]:
+        # (chunk_id, document_id, embedding) FOR EVERY EMBEDDED CHUNK, OR THOSE OF document_ids
+        query = (
+            db.query(
+                DocumentChunk.id,
+                DocumentChunk.document_id,
+                DocumentChunk.embedding,
+                DocumentChunk.embedding_dim,
+                DocumentChunk.legacy_embedding
+            )
+            .filter(or_(DocumentChunk.embedding.isnot(None), DocumentChunk.legacy_embedding.isnot(None)))
+        )
+        if document_ids is not None:
+            document_ids = list(document_ids)
+            if not document_ids:
+                return
+            query = query.filter(DocumentChunk.document_id.in_(document_ids))
+
+        for chunk_id, document_id, buffer, buffer_dim, legacy_embedding in \
+                query.execution_options(yield_per=self.LOAD_BATCH_SIZE):
+            # ROWS NOT YET CONVERTED FROM JSONB FALL BACK TO THE LEGACY COLUMN -- A JSON null
+            # THERE PASSES IS NOT NULL BUT HOLDS NO EMBEDDING
+            if buffer is not None:
+                yield chunk_id, document_id, decode_embedding(buffer, buffer_dim)
+            elif legacy_embedding is not None:
+                yield chunk_id, document_id, np.asarray(legacy_embedding, dtype=np.float32)
+
+    def _read_db(self, db: Session):
+        dim = None
+        codec = None
+        blocks, chunk_ids, document_ids = [], [], []
+        batch_vectors, batch_chunk_ids, batch_document_ids = [], [], []
+
+        def flush_batch():
+            nonlocal codec
+            if batch_vectors:
+                # ENCODE PER BATCH SO A QUANTIZED LOAD NEVER HOLDS THE FULL FLOAT32 MATRIX
+                vectors = self._normalize(np.stack(batch_vectors))
+                if codec is None:
+                    codec = make_codec(self.quantization, dim)
+                    codec.fit(vectors)
+                blocks.append(codec.encode(vectors))
+                chunk_ids.append(uuid_rows(batch_chunk_ids))
+                document_ids.append(uuid_rows(batch_document_ids))
+                batch_vectors.clear()
+                batch_chunk_ids.clear()
+                batch_document_ids.clear()
+
+        for chunk_id, document_id, embedding in self._db_rows(db):
+            if dim is None:
+                dim = len(embedding)
+            if len(embedding) != dim:
+                continue
+            batch_vectors.append(embedding)
+            batch_chunk_ids.append(chunk_id)
+            batch_document_ids.append(document_id)
+            if len(batch_vectors) >= self.LOAD_BATCH_SIZE:
+                flush_batch()
+        flush_batch()
+
+        if codec is None:
+            codec = make_codec(self.quantization, 0)
+        codes = np.vstack(blocks) if blocks else np.empty((0, codec.code_width), dtype=codec.dtype)
+        empty_ids = np.empty((0, ID_WIDTH), dtype=np.uint8)
+        return (
+            codec,
+            codes,
+            np.vstack(chunk_ids) if chunk_ids else empty_ids,
+            np.vstack(document_ids) if document_ids else empty_ids
+        )
+
+    def save_snapshot(self, db: Session) -> Optional[Dict[str, Any]]:
+        """
+        Write the live rows to the snapshot store for the next cold start.
+
+        A shared index holds every chunk any worker on the host committed, so
+        its marks are read from the DB now. A private one only holds what it
+        read at its last build plus its own writes, so it saves the marks of
+        that build -- chunks other workers added since are replayed on load.
+
+        Args:
+            db: Session used to read the chunk high-water mark
+
+        Returns:
+            The snapshot manifest, or None when snapshots are off or nothing is loaded
+        """
+
+        if self.snapshots is None or not self._loaded:
+            return None
+        if self.store is not None:
+            # MARKS FIRST, THEN THE ROWS -- EVERY CHUNK THE MARKS COVER IS ALREADY IN THE COPY
+            high_water_mark, saved_at = chunk_high_water_mark(db), datetime.utcnow()
+        elif self._synced_marks is not None:
+            high_water_mark, saved_at = self._synced_marks
+        else:
+            # ROWS INSTALLED WITH load_arrays, NOTHING WAS READ FROM THE DB
+            return None
+        if self.store is not None:
+            with self._lock:
+                self._refresh_locked()
+        snapshot = self._snapshot
+        codes, chunk_ids, document_ids = snapshot.codes, snapshot.chunk_ids, snapshot.document_ids
+        if snapshot.alive is not None:
+            codes, chunk_ids, document_ids = codes[snapshot.alive], chunk_ids[snapshot.alive], document_ids[snapshot.alive]
+        return self.snapshots.save(snapshot.codec, codes, chunk_ids, document_ids, high_water_mark, saved_at)
+
+    def load_arrays(self,
+                    chunk_ids: Sequence[uuid.UUID],
+                    document_ids: Sequence[uuid.UUID],
+                    embeddings: np.ndarray) -> None:
+        # REPLACE THE INDEX CONTENTS WITH THESE ROWS
+        vectors = self._normalize(embeddings)
+        codec = make_codec(self.quantization, vectors.shape[1])
+        codec.fit(vectors)
+        with self._lock, self._writing():
+            self._replace_locked(codec, codec.encode(vectors), uuid_rows(chunk_ids), uuid_rows(document_ids))
+            self._synced_marks = None
+
+    def _replace_locked(self,
+                        codec,
+                        codes: np.ndarray,
+                        chunk_ids: np.ndarray,
+                        document_ids: np.ndarray,
+                        ivf: Optional[IVFLists] = None) -> None:
+        # INSTALL EXACTLY THESE ROWS, AS A NEW SHARED GENERATION OR NEW IN-PROCESS BUFFERS
+        if self.store is not None:
+            self.store.write_generation(self.store.read_manifest(), codec, codes, chunk_ids, document_ids)
+            self._refresh_locked(ivf)
+            return
+        self._codec = codec
+        self._code_buffer = codes
+        self._chunk_id_buffer = chunk_ids
+        self._document_id_buffer = document_ids
+        self._publish(len(chunk_ids), None, ivf)
+        self._loaded = True
+
+    def _refresh_locked(self, ivf: Optional[IVFLists] = None) -> None:
+        # MAP THE NEWEST SHARED GENERATION, KEEPING IVF LISTS WHEN ONLY ROWS WERE APPENDED
+        signature = self.store.signature()
+        generation = self.store.open_current()
+        if generation is None:
+            return
+        manifest = generation.manifest
+        previous = self._manifest
+        snapshot = self._snapshot
+        if ivf is None and snapshot.ivf is not None and previous is not None \
+                and previous["generation"] == manifest["generation"]:
+            ivf = snapshot.ivf
+            if manifest["rows"] > previous["rows"]:
+                appended = generation.codes[previous["rows"]:manifest["rows"]]
+                ivf = ivf.with_appended(self._normalize(generation.codec.decode(appended)), previous["rows"])
+
+        self._codec = generation.codec
+        self._code_buffer = generation.codes
+        self._chunk_id_buffer = generation.chunk_ids
+        self._document_id_buffer = generation.document_ids
+        self._manifest = manifest
+        self._store_signature = signature
+        self._publish(manifest["rows"], generation.alive, ivf)
+        self._loaded = True
+
+    def _publish(self, count: int, alive: Optional[np.ndarray], ivf: Optional[IVFLists] = None) -> None:
+        codes = self._code_buffer[:count]
+        if self.mode == "ivf" and should_train(ivf, count, self.min_train_size, self.retrain_growth):
+            # QUANTIZED CODES ARE DECODED TO APPROXIMATE VECTORS FOR TRAINING
+            ivf = IVFLists.build(
+                self._normalize(self._codec.decode(codes)),
+                resolve_nlist(self.nlist, count),
+                self.train_iterations
+            )
+        self._snapshot = _IndexSnapshot(
+            codes,
+            self._chunk_id_buffer[:count],
+            self._document_id_buffer[:count],
+            alive,
+            self._codec,
+            ivf if self.mode == "ivf" else None
+        )
+
+    def _reserve(self, needed: int) -> None:
+        # GROW THE BUFFERS GEOMETRICALLY SO APPENDS ARE AMORTIZED O(ROWS ADDED)
+        count = len(self._snapshot.chunk_ids)
+        capacity = len(self._chunk_id_buffer)
+        width = self._codec.code_width
+        if needed <= capacity and self._code_buffer.shape[1] == width:
+            return
+
+        new_capacity = max(needed, 2 * capacity, self.MIN_CAPACITY)
+        codes = np.empty((new_capacity, width), dtype=self._codec.dtype)
+        chunk_ids = np.empty((new_capacity, ID_WIDTH), dtype=np.uint8)
+        document_ids = np.empty((new_capacity, ID_WIDTH), dtype=np.uint8)
+        if count:
+            codes[:count] = self._code_buffer[:count]
+            chunk_ids[:count] = self._chunk_id_buffer[:count]
+            document_ids[:count] = self._document_id_buffer[:count]
+
+        self._code_buffer = codes
+        self._chunk_id_buffer = chunk_ids
+        self._document_id_buffer = document_ids
+
+    def add(self,
+            chunk_ids: Sequence[uuid.UUID],
+            document_ids: Sequence[uuid.UUID],
+            embeddings: Sequence[Sequence[float]]) -> int:
+        # ADD VECTORS TO THE INDEX, RETURNS THE NUMBER OF ROWS ADDED
+        with self._lock:
+            # NOT LOADED YET -- THE NEXT LOAD PICKS THESE UP FROM THE DB
+            if not self._loaded:
+                return 0
+            with self._writing():
+                return self._add_locked(chunk_ids, document_ids, embeddings)
+
+    def _add_locked(self,
+                    chunk_ids: Sequence[uuid.UUID],
+                    document_ids: Sequence[uuid.UUID],
+                    embeddings: Sequence[Sequence[float]]) -> int:
+        if self.store is not None:
+            # ANOTHER WORKER MAY HAVE PUBLISHED SINCE WE LAST LOOKED
+            self._refresh_locked()
+
+        snapshot = self._snapshot
+        count = len(snapshot.chunk_ids)
+        dim = self._codec.dim if snapshot.live_count else None
+
+        new_vectors, new_chunk_ids, new_document_ids = [], [], []
+        for chunk_id, document_id, embedding in zip(chunk_ids, document_ids, embeddings):
+            if embedding is None:
+                continue
+            if dim is None:
+                dim = len(embedding)
+            if len(embedding) != dim:
+                continue
+            new_vectors.append(embedding)
+            new_chunk_ids.append(chunk_id)
+            new_document_ids.append(document_id)
+
+        # ROWS ALREADY IN THE INDEX ARE NOT ADDED TWICE
+        new_id_rows = uuid_rows(new_chunk_ids)
+        if snapshot.live_count and len(new_id_rows):
+            existing = id_keys(snapshot.chunk_ids)
+            if snapshot.alive is not None:
+                existing = existing[snapshot.alive]
+            fresh = ~np.isin(id_keys(new_id_rows), existing)
+            new_id_rows = new_id_rows[fresh]
+            new_vectors = [vector for vector, keep in zip(new_vectors, fresh) if keep]
+            new_document_ids = [document_id for document_id, keep in zip(new_document_ids, fresh) if keep]
+        if not new_vectors:
+            return 0
+
+        normalized = self._normalize(new_vectors)
+        added = len(new_id_rows)
+        if not snapshot.live_count:
+            # FIRST ROWS OF AN EMPTY INDEX DEFINE ITS DIMENSION AND QUANTIZER
+            codec = make_codec(self.quantization, dim)
+            codec.fit(normalized)
+            self._replace_locked(codec, codec.encode(normalized), new_id_rows, uuid_rows(new_document_ids))
+            return added
+
+        new_codes = self._codec.encode(normalized)
+        if self.store is not None:
+            self.store.append(self._manifest, new_codes, new_id_rows, uuid_rows(new_document_ids))
+            self._refresh_locked()
+            return added
+
+        self._reserve(count + added)
+        self._code_buffer[count:count + added] = new_codes
+        self._chunk_id_buffer[count:count + added] = new_id_rows
+        self._document_id_buffer[count:count + added] = uuid_rows(new_document_ids)
+
+        alive = snapshot.alive
+        if alive is not None:
+            alive = np.concatenate([alive, np.ones(added, dtype=bool)])
+        ivf = snapshot.ivf.with_appended(normalized, count) if snapshot.ivf is not None else None
+        self._publish(count + added, alive, ivf)
+        return added
+
+    def remove_document(self, document_id: uuid.UUID) -> int:
+        # DROP EVERY ROW THAT BELONGS TO THE DOCUMENT, RETURNS THE NUMBER OF ROWS REMOVED
+        with self._lock:
+            if not self._loaded:
+                return 0
+            with self._writing():
+                return self._remove_documents_locked([document_id])
+
+    def remove_chunks(self, chunk_ids: Iterable[uuid.UUID]) -> int:
+        # DROP THESE CHUNKS ONLY, RETURNS THE NUMBER OF ROWS REMOVED
+        chunk_ids = list(chunk_ids)
+        # NOTHING TO DROP -- NO LOCK, NO REFRESH, NO FLOCK IN SHARED MODE
+        if not chunk_ids:
+            return 0
+        with self._lock:
+            if not self._loaded:
+                return 0
+            with self._writing():
+                return self._remove_rows_locked("chunk_ids", chunk_ids)
+
+    def _remove_documents_locked(self, document_ids: Iterable[uuid.UUID]) -> int:
+        return self._remove_rows_locked("document_ids", document_ids)
+
+    def _remove_rows_locked(self, column: str, ids: Iterable[uuid.UUID]) -> int:
+        # TOMBSTONE THE ROWS WHOSE chunk_ids OR document_ids (column) ARE IN ids
+        if self.store is not None:
+            self._refresh_locked()
+
+        snapshot = self._snapshot
+        n = len(snapshot.chunk_ids)
+        keys = id_keys(uuid_rows(list(ids)))
+        if not snapshot.live_count or not len(keys):
+            return 0
+
+        alive = np.ones(n, dtype=bool) if snapshot.alive is None else snapshot.alive.copy()
+        rows = np.flatnonzero(np.isin(id_keys(getattr(snapshot, column)), keys) & alive)
+        if not len(rows):
+            return 0
+        alive[rows] = False
+
+        if n - int(alive.sum()) > self.compact_ratio * n:
+            # COMPACT INTO NEW BUFFERS / A NEW GENERATION -- READERS MAY STILL HOLD THE OLD ONES
+            self._replace_locked(
+                self._codec,
+                np.ascontiguousarray(snapshot.codes[alive]),
+                np.ascontiguousarray(snapshot.chunk_ids[alive]),
+                np.ascontiguousarray(snapshot.document_ids[alive]),
+                snapshot.ivf.with_remapped(alive) if snapshot.ivf is not None else None
+            )
+        elif self.store is not None:
+            self.store.write_tombstones(self._manifest, np.flatnonzero(~alive))
+            self._refresh_locked()
+        else:
+            self._publish(n, alive, snapshot.ivf)
+        return len(rows)
+
+    def shortlist_size(self, top_k: int) -> int:
+        # HOW MANY CANDIDATES TO ASK search() FOR WHEN THE RESULT WILL BE RE-RANKED
+        return top_k if self.exact else top_k * self.shortlist_multiplier
+
+    def search(self,
+               query_embedding: Sequence[float],
+               top_k: int,
+               nprobe: Optional[int] = None,
+               exact: bool = False) -> List[Tuple[uuid.UUID, float]]:
+        # RETURN (chunk_id, similarity) PAIRS FOR THE top_k BEST ROWS, BEST FIRST
+        # exact=True SKIPS THE IVF LISTS, IT DOES NOT UNDO QUANTIZATION
+        snapshot = self._snapshot
+        if snapshot.live_count == 0 or top_k <= 0:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if query.shape[0] != snapshot.codec.dim:
+            return []
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return []
+        query = query / query_norm
+
+        if snapshot.ivf is not None and not exact:
+            # APPROXIMATE -- SCORE ONLY THE CANDIDATES FROM THE PROBED LISTS
+            rows = snapshot.ivf.candidates(query, nprobe or self.nprobe)
+            if snapshot.alive is not None:
+                rows = rows[snapshot.alive[rows]]
+            scores = snapshot.codec.score(snapshot.codes[rows], query)
+            top = top_k_indices(scores, top_k)
+            return [(snapshot.chunk_id(rows[i]), float(scores[i])) for i in top]
+
+        scores = snapshot.codec.score(snapshot.codes, query)
+        if snapshot.alive is not None:
+            scores[~snapshot.alive] = -np.inf
+        top = top_k_indices(scores, min(top_k, snapshot.live_count))
+        return [(snapshot.chunk_id(i), float(scores[i])) for i in top]
+
+    def search_many(self,
+                    query_embeddings: Sequence[Sequence[float]],
+                    top_k: int,
+                    nprobe: Optional[int] = None,
+                    exact: bool = False) -> List[List[Tuple[uuid.UUID, float]]]:
+        # search() FOR SEVERAL QUERIES, SCORED AS ONE MATRIX-MATRIX PRODUCT PER BLOCK OF ROWS
+        snapshot = self._snapshot
+        n = len(snapshot.chunk_ids)
+        results = [[] for _ in query_embeddings]
+        if snapshot.live_count == 0 or top_k <= 0 or not len(query_embeddings):
+            return results
+        if snapshot.ivf is not None and not exact:
+            # EVERY QUERY PROBES DIFFERENT LISTS, SO THERE IS NO SHARED MATRIX TO SCORE
+            return [self.search(query, top_k, nprobe=nprobe) for query in query_embeddings]
+
+        valid, queries = [], []
+        for i, query_embedding in enumerate(query_embeddings):
+            query = np.asarray(query_embedding, dtype=np.float32)
+            if query.shape != (snapshot.codec.dim,):
+                continue
+            query_norm = np.linalg.norm(query)
+            if query_norm == 0:
+                continue
+            valid.append(i)
+            queries.append(query / query_norm)
+        if not valid:
+            return results
+        queries = np.stack(queries)
+
+        # RUNNING TOP-K PER QUERY SO THE SCORE MATRIX NEVER EXCEEDS ONE BLOCK OF ROWS
+        k = min(top_k, snapshot.live_count)
+        best_rows, best_scores = [], []
+        for start in range(0, n, SEARCH_BLOCK_SIZE):
+            block_scores = snapshot.codec.score_many(snapshot.codes[start:start + SEARCH_BLOCK_SIZE], queries)
+            if snapshot.alive is not None:
+                block_scores[~snapshot.alive[start:start + SEARCH_BLOCK_SIZE]] = -np.inf
+            block_k = min(k, len(block_scores))
+            if block_k < len(block_scores):
+                top = np.argpartition(-block_scores, block_k - 1, axis=0)[:block_k]
+            else:
+                top = np.broadcast_to(np.arange(len(block_scores))[:, None], block_scores.shape)
+            best_rows.append(top + start)
+            best_scores.append(np.take_along_axis(block_scores, top, axis=0))
+        best_rows = np.vstack(best_rows)
+        best_scores = np.vstack(best_scores)
+
+        for column, i in enumerate(valid):
+            order = top_k_indices(best_scores[:, column], k)
+            results[i] = [
+                (snapshot.chunk_id(best_rows[j, column]), float(best_scores[j, column]))
+                for j in order
+            ]
+        return results
+
+    @staticmethod
+    def exact_scores(query_embedding: Sequence[float], embeddings: Sequence[Sequence[float]]) -> np.ndarray:
+        # FULL-PRECISION COSINE SIMILARITIES, FOR RE-RANKING A QUANTIZED SHORTLIST
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0 or not len(embeddings):
+            return np.zeros(len(embeddings), dtype=np.float32)
+        return VectorIndex._normalize(np.stack(embeddings)) @ (query / query_norm)
+
+
+# SHARED BY EVERY REQUEST IN THIS PROCESS -- AND, WITH VECTOR_INDEX_SHARED, BY EVERY WORKER ON THE HOST
+vector_index = VectorIndex(
+    mode=settings.RETRIEVAL_INDEX,
+    quantization=settings.RETRIEVAL_QUANTIZATION,
+    shortlist_multiplier=settings.RETRIEVAL_SHORTLIST_MULTIPLIER,
+    nlist=settings.IVF_NLIST,
+    nprobe=settings.IVF_NPROBE,
+    train_iterations=settings.IVF_TRAIN_ITERATIONS,
+    min_train_size=settings.IVF_MIN_TRAIN_SIZE,
+    retrain_growth=settings.IVF_RETRAIN_GROWTH,
+    compact_ratio=settings.VECTOR_INDEX_COMPACT_RATIO,
+    store=SharedIndexStore(settings.VECTOR_INDEX_DIR) if settings.VECTOR_INDEX_SHARED else None,
+    snapshots=(
+        SnapshotStore(settings.VECTOR_INDEX_SNAPSHOT_DIR, settings.DATABASE_URL)
+        if settings.VECTOR_INDEX_SNAPSHOT_ENABLED else None
+    )
+)
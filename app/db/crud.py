@@ -1,34 +1,54 @@
-from uuid import UUID
-from typing import List, Optional, Dict, Any
+from uuid import UUID, uuid4
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any, Sequence
+from sqlalchemy import insert, select, delete, update, and_, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import numpy as np
 
-from app.db.models import Document, DocumentChunk, QARecord
+from app.db.models import Document, DocumentChunk, QARecord, EmbeddingCacheEntry, IngestionJob
+from app.db.vector_codec import encode_embedding, decode_embedding
+from app.db.pagination import keyset_page
+from app.core.metrics import metrics
 from app.schemas.document import DocumentCreate
 from app. schemas.qa import QARequest, QAResponse
 
 class DocumentRepository:
     
     @staticmethod
-    def create_document(db: Session, document: DocumentCreate) -> Document:
+    @metrics.timed("db.create_document")
+    def create_document(db: Session, document: DocumentCreate, commit: bool = True) -> Document:
         db_document = Document(
             title=document.title,
             content=document.content
         )
         db.add(db_document)
+        if not commit:
+            # FLUSHED FOR ITS ID, COMMITTED BY THE CALLER TOGETHER WITH ITS CHUNKS
+            db.flush()
+            return db_document
         db.commit()
         db.refresh(db_document)
         return db_document
     
     @staticmethod
+    @metrics.timed("db.get_document")
     def get_docuent(db: Session, document_id: UUID) -> Optional[Document]:
         return db.query(Document).filter(Document.id == document_id).first()
     
+    # LIST COLUMNS ONLY -- NEVER THE LEGACY content TEXT
+    LIST_COLUMNS = (Document.id, Document.title, Document.created_at)
+    
     @staticmethod
-    def get_all_documents(db: Session, skip: int = 0, limit: int = 100) -> List[Document]:
-        return db.query(Document).offset(skip).limit(limit).all()
+    @metrics.timed("db.get_all_documents")
+    def get_all_documents(db: Session, limit: int = 100, cursor: Optional[str] = None) -> List[Any]:
+        query = keyset_page(select(*DocumentRepository.LIST_COLUMNS), Document, limit, cursor)
+        return list(db.execute(query).all())
     
     @staticmethod
+    @metrics.timed("db.delete_document")
     def delete_document(db: Session, document_id: UUID) -> bool:
         document = db.query(Document).filter(Document.id == document_id).first()
         
@@ -38,37 +58,166 @@ class DocumentRepository:
         db.commit()
         return True
     
+    # ASYNC VARIANTS FOR REQUEST HANDLERS
+    
+    @staticmethod
+    @metrics.timed("db.create_document")
+    async def acreate_document(db: AsyncSession, document: DocumentCreate) -> Document:
+        db_document = Document(
+            title=document.title,
+            content=document.content
+        )
+        db.add(db_document)
+        await db.commit()
+        await db.refresh(db_document)
+        return db_document
+    
+    @staticmethod
+    @metrics.timed("db.get_document")
+    async def aget_document(db: AsyncSession, document_id: UUID) -> Optional[Document]:
+        return await db.get(Document, document_id)
+    
+    @staticmethod
+    @metrics.timed("db.get_all_documents")
+    async def aget_all_documents(db: AsyncSession, limit: int = 100, cursor: Optional[str] = None) -> List[Any]:
+        # ROWS OF LIST_COLUMNS, NEWEST FIRST, AFTER cursor (SEE app.db.pagination)
+        query = keyset_page(select(*DocumentRepository.LIST_COLUMNS), Document, limit, cursor)
+        result = await db.execute(query)
+        return list(result.all())
+    
+    @staticmethod
+    @metrics.timed("db.update_document")
+    async def aupdate_title(db: AsyncSession, document_id: UUID, title: str) -> None:
+        await db.execute(update(Document).where(Document.id == document_id).values(title=title))
+        await db.commit()
+    
+    @staticmethod
+    @metrics.timed("db.delete_document")
+    async def adelete_document(db: AsyncSession, document_id: UUID) -> bool:
+        # BULK DELETES INSTEAD OF THE ORM CASCADE, WHICH WOULD LOAD EVERY CHUNK FIRST
+        await db.execute(delete(DocumentChunk).where(DocumentChunk.document_id == document_id))
+        await db.execute(delete(IngestionJob).where(IngestionJob.document_id == document_id))
+        result = await db.execute(delete(Document).where(Document.id == document_id))
+        await db.commit()
+        return result.rowcount > 0
+    
     
 class ChunkRepository:
     
     @staticmethod
-    def create_chunks(db: Session, document_id: UUID, chunks: List[Dict[str, Any]]) -> List[DocumentChunk]:
-        db_chunks = []
+    @metrics.timed("db.create_chunks")
+    def create_chunks(db: Session,
+                      document_id: UUID,
+                      chunks: List[Dict[str, Any]],
+                      start_index: int = 0,
+                      commit: bool = True) -> List[UUID]:
+        # ONE MULTI-ROW INSERT, IDS ARE GENERATED HERE SO NO ROW HAS TO BE READ BACK
+        rows = ChunkRepository._chunk_rows(document_id, chunks, start_index)
+        if not rows:
+            return []
         
+        db.execute(insert(DocumentChunk), rows)
+        if commit:
+            db.commit()
+        return [row["id"] for row in rows]
+    
+    @staticmethod
+    def _chunk_rows(document_id: UUID, chunks: List[Dict[str, Any]], start_index: int) -> List[Dict[str, Any]]:
+        rows = []
         for idx, chunk_data in enumerate(chunks):
-            db_chunk = DocumentChunk(
-                document_id=document_id,
-                chunk_index=idx,
-                content=chunk_data["content"],
-                embedding=chunk_data.get("embedding"),
-                chunk_metadata=chunk_data.get("metadata", {})
-            )
-            db_chunks.append(db_chunk)
-        
-        db.add_all(db_chunks)
-        db.commit()
-        
-        for chunk in db_chunks:
-            db.refresh(chunk)
-        return db_chunks
+            embedding = chunk_data.get("embedding")
+            rows.append({
+                "id": uuid4(),
+                "document_id": document_id,
+                # A CHUNK THAT KNOWS ITS POSITION (build_chunks METADATA) KEEPS IT
+                "chunk_index": chunk_data.get("metadata", {}).get("chunk_index", start_index + idx),
+                "content": chunk_data["content"],
+                "embedding": encode_embedding(embedding) if embedding is not None else None,
+                "embedding_dim": len(embedding) if embedding is not None else None,
+                "chunk_metadata": chunk_data.get("metadata", {}),
+                "created_at": datetime.utcnow()
+            })
+        return rows
+    
+    @staticmethod
+    @metrics.timed("db.get_chunk_contents")
+    def get_chunk_contents(db: Session, document_id: UUID) -> List[Any]:
+        # (id, chunk_index, content) ROWS OF A DOCUMENT -- NO EMBEDDINGS
+        query = (
+            select(DocumentChunk.id, DocumentChunk.chunk_index, DocumentChunk.content)
+            .where(DocumentChunk.document_id == document_id)
+        )
+        return list(db.execute(query).all())
+    
+    @staticmethod
+    @metrics.timed("db.update_chunk_positions")
+    def update_chunk_positions(db: Session, positions: List[Dict[str, Any]], commit: bool = True) -> int:
+        # BULK UPDATE BY PRIMARY KEY -- EACH DICT HOLDS id, chunk_index AND chunk_metadata
+        if positions:
+            db.execute(update(DocumentChunk), positions)
+        if commit:
+            db.commit()
+        return len(positions)
+    
+    @staticmethod
+    @metrics.timed("db.delete_chunks")
+    def delete_chunks(db: Session, chunk_ids: Sequence[UUID], commit: bool = True) -> int:
+        deleted = 0
+        for start in range(0, len(chunk_ids), 1000):
+            result = db.execute(delete(DocumentChunk).where(DocumentChunk.id.in_(chunk_ids[start:start + 1000])))
+            deleted += result.rowcount
+        if commit:
+            db.commit()
+        return deleted
+    
+    @staticmethod
+    @metrics.timed("db.delete_document_chunks")
+    def delete_document_chunks(db: Session, document_id: UUID, commit: bool = True) -> int:
+        deleted = db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).delete()
+        if commit:
+            db.commit()
+        return deleted
             
     @staticmethod
+    @metrics.timed("db.get_all_chunks")
     def get_all_chunks(db: Session) -> List[DocumentChunk]:
         return db.query(DocumentChunk).all()
     
+    # ASYNC VARIANTS FOR REQUEST HANDLERS
+    
+    @staticmethod
+    @metrics.timed("db.create_chunks")
+    async def acreate_chunks(db: AsyncSession,
+                             document_id: UUID,
+                             chunks: List[Dict[str, Any]],
+                             start_index: int = 0,
+                             commit: bool = True) -> List[UUID]:
+        rows = ChunkRepository._chunk_rows(document_id, chunks, start_index)
+        if not rows:
+            return []
+        await db.execute(insert(DocumentChunk), rows)
+        if commit:
+            await db.commit()
+        return [row["id"] for row in rows]
+    
+    @staticmethod
+    @metrics.timed("db.delete_document_chunks")
+    async def adelete_document_chunks(db: AsyncSession, document_id: UUID, commit: bool = True) -> int:
+        result = await db.execute(delete(DocumentChunk).where(DocumentChunk.document_id == document_id))
+        if commit:
+            await db.commit()
+        return result.rowcount
+    
+    @staticmethod
+    @metrics.timed("db.get_all_chunks")
+    async def aget_all_chunks(db: AsyncSession) -> List[DocumentChunk]:
+        result = await db.scalars(select(DocumentChunk))
+        return list(result)
+    
 class QARepository:
     
     @staticmethod
+    @metrics.timed("db.create_qa_record")
     def create_qa_record(db: Session, question: str, answer: str, chain_trace: Dict[str, Any]) -> QARecord:
         qa_record = QARecord(
             question=question,
@@ -81,6 +230,251 @@ class QARepository:
         return qa_record
     
     @staticmethod
-    def get_qa_history(db: Session, skip: int = 0, limit: int = 20) -> List[QARecord]:
-        return db.query(QARecord).order_by(QARecord.created_at.desc()).offset(skip).limit(limit).all()
-        
\ No newline at end of file
+    @metrics.timed("db.create_qa_records")
+    def create_qa_records(db: Session, records: List[Dict[str, Any]]) -> int:
+        # ONE INSERT FOR A WHOLE BATCH OF ANSWERS -- DICTS OF QARecord COLUMNS
+        if not records:
+            return 0
+        db.execute(insert(QARecord), records)
+        db.commit()
+        return len(records)
+    
+    @staticmethod
+    def _history_query(limit: int, cursor: Optional[str], include_trace: bool):
+        # chain_trace HOLDS THE TEXT OF EVERY RETRIEVED CHUNK -- ONLY SELECTED WHEN ASKED FOR
+        columns = [QARecord.id, QARecord.question, QARecord.answer, QARecord.created_at]
+        if include_trace:
+            columns.append(QARecord.chain_trace)
+        return keyset_page(select(*columns), QARecord, limit, cursor)
+    
+    @staticmethod
+    @metrics.timed("db.get_qa_history")
+    def get_qa_history(db: Session,
+                       limit: int = 20,
+                       cursor: Optional[str] = None,
+                       include_trace: bool = False) -> List[Any]:
+        return list(db.execute(QARepository._history_query(limit, cursor, include_trace)).all())
+    
+    # ASYNC VARIANTS FOR REQUEST HANDLERS
+    
+    @staticmethod
+    @metrics.timed("db.create_qa_record")
+    async def acreate_qa_record(db: AsyncSession, question: str, answer: str, chain_trace: Dict[str, Any]) -> QARecord:
+        qa_record = QARecord(
+            question=question,
+            answer=answer,
+            chain_trace=chain_trace
+        )
+        db.add(qa_record)
+        await db.commit()
+        await db.refresh(qa_record)
+        return qa_record
+    
+    @staticmethod
+    @metrics.timed("db.create_qa_records")
+    async def acreate_qa_records(db: AsyncSession, records: List[Dict[str, Any]]) -> int:
+        if not records:
+            return 0
+        await db.execute(insert(QARecord), records)
+        await db.commit()
+        return len(records)
+    
+    @staticmethod
+    @metrics.timed("db.get_qa_history")
+    async def aget_qa_history(db: AsyncSession,
+                              limit: int = 20,
+                              cursor: Optional[str] = None,
+                              include_trace: bool = False) -> List[Any]:
+        result = await db.execute(QARepository._history_query(limit, cursor, include_trace))
+        return list(result.all())
+
+
+class IngestionJobRepository:
+    
+    @staticmethod
+    @metrics.timed("db.create_job")
+    def create_job(db: Session,
+                   document_id: Optional[UUID],
+                   source_path: Optional[str] = None,
+                   kind: str = "document") -> IngestionJob:
+        job = IngestionJob(kind=kind, document_id=document_id, status="queued", source_path=source_path)
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job
+    
+    @staticmethod
+    @metrics.timed("db.get_job")
+    def get_job(db: Session, job_id: UUID) -> Optional[IngestionJob]:
+        return db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+    
+    @staticmethod
+    @metrics.timed("db.update_job")
+    def update_job(db: Session, job_id: UUID, **fields: Any) -> None:
+        db.query(IngestionJob).filter(IngestionJob.id == job_id).update(fields)
+        db.commit()
+    
+    @staticmethod
+    def _lease_expired(now: datetime):
+        # RUNNING, BUT ITS OWNER STOPPED RENEWING THE LEASE (NULL: CLAIMED BEFORE LEASES EXISTED)
+        return and_(
+            IngestionJob.status == "running",
+            or_(IngestionJob.lease_expires_at.is_(None), IngestionJob.lease_expires_at < now)
+        )
+    
+    @staticmethod
+    @metrics.timed("db.get_claimable_job_ids")
+    def get_claimable_job_ids(db: Session, include_queued: bool = True) -> List[UUID]:
+        condition = IngestionJobRepository._lease_expired(datetime.utcnow())
+        if include_queued:
+            condition = or_(IngestionJob.status == "queued", condition)
+        rows = (
+            db.query(IngestionJob.id)
+            .filter(condition)
+            .order_by(IngestionJob.created_at)
+            .all()
+        )
+        return [row.id for row in rows]
+    
+    @staticmethod
+    @metrics.timed("db.claim_job")
+    def claim_job(db: Session, job_id: UUID, owner: str, lease_seconds: float) -> bool:
+        # ONE CONDITIONAL UPDATE -- OF WORKERS RACING FOR THE SAME JOB, ONLY ONE MATCHES THE ROW
+        now = datetime.utcnow()
+        result = db.execute(
+            update(IngestionJob)
+            .where(
+                IngestionJob.id == job_id,
+                or_(IngestionJob.status == "queued", IngestionJobRepository._lease_expired(now))
+            )
+            .values(
+                status="running",
+                error=None,
+                lease_owner=owner,
+                lease_expires_at=now + timedelta(seconds=lease_seconds)
+            )
+        )
+        db.commit()
+        return result.rowcount == 1
+    
+    @staticmethod
+    @metrics.timed("db.renew_job_leases")
+    def renew_job_leases(db: Session, job_ids: Sequence[UUID], owner: str, lease_seconds: float) -> int:
+        if not job_ids:
+            return 0
+        result = db.execute(
+            update(IngestionJob)
+            .where(
+                IngestionJob.id.in_(list(job_ids)),
+                IngestionJob.status == "running",
+                IngestionJob.lease_owner == owner
+            )
+            .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))
+        )
+        db.commit()
+        return result.rowcount
+    
+    @staticmethod
+    @metrics.timed("db.update_job")
+    def update_owned_job(db: Session, job_id: UUID, owner: str, commit: bool = True, **fields: Any) -> bool:
+        # FALSE IF THE JOB IS NO LONGER RUNNING UNDER owner'S LEASE
+        result = db.execute(
+            update(IngestionJob)
+            .where(
+                IngestionJob.id == job_id,
+                IngestionJob.status == "running",
+                IngestionJob.lease_owner == owner
+            )
+            .values(**fields)
+        )
+        if commit:
+            db.commit()
+        return result.rowcount == 1
+    
+    # ASYNC VARIANTS FOR REQUEST HANDLERS
+    
+    @staticmethod
+    @metrics.timed("db.create_job")
+    async def acreate_job(db: AsyncSession,
+                          document_id: Optional[UUID],
+                          source_path: Optional[str] = None,
+                          kind: str = "document") -> IngestionJob:
+        # RAISES IntegrityError IF THE DOCUMENT ALREADY HAS A QUEUED OR RUNNING JOB
+        job = IngestionJob(kind=kind, document_id=document_id, status="queued", source_path=source_path)
+        db.add(job)
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise
+        await db.refresh(job)
+        return job
+    
+    @staticmethod
+    @metrics.timed("db.get_job")
+    async def aget_job(db: AsyncSession, job_id: UUID) -> Optional[IngestionJob]:
+        return await db.get(IngestionJob, job_id)
+    
+    @staticmethod
+    @metrics.timed("db.has_unfinished_job")
+    async def ahas_unfinished_job(db: AsyncSession, document_id: UUID) -> bool:
+        job_id = await db.scalar(
+            select(IngestionJob.id)
+            .where(IngestionJob.document_id == document_id, IngestionJob.status.in_(["queued", "running"]))
+            .limit(1)
+        )
+        return job_id is not None
+    
+    @staticmethod
+    @metrics.timed("db.get_unfinished_source_paths")
+    async def aget_unfinished_source_paths(db: AsyncSession, document_id: UUID) -> List[str]:
+        # SPOOLED UPLOADS OF THE DOCUMENT'S QUEUED AND RUNNING JOBS
+        result = await db.scalars(
+            select(IngestionJob.source_path)
+            .where(
+                IngestionJob.document_id == document_id,
+                IngestionJob.status.in_(["queued", "running"]),
+                IngestionJob.source_path.is_not(None)
+            )
+        )
+        return list(result)
+    
+    @staticmethod
+    @metrics.timed("db.update_job")
+    async def aupdate_job(db: AsyncSession, job_id: UUID, **fields: Any) -> None:
+        await db.execute(update(IngestionJob).where(IngestionJob.id == job_id).values(**fields))
+        await db.commit()
+
+
+class EmbeddingCacheRepository:
+    
+    @staticmethod
+    @metrics.timed("db.get_embeddings")
+    def get_embeddings(db: Session, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        rows = (
+            db.query(EmbeddingCacheEntry.key, EmbeddingCacheEntry.embedding, EmbeddingCacheEntry.embedding_dim)
+            .filter(EmbeddingCacheEntry.key.in_(keys))
+            .all()
+        )
+        return {row.key: decode_embedding(row.embedding, row.embedding_dim) for row in rows}
+    
+    @staticmethod
+    @metrics.timed("db.put_embeddings")
+    def put_embeddings(db: Session, model: str, entries: Dict[str, Sequence[float]]) -> None:
+        if not entries:
+            return
+        # CONCURRENT UPLOADS MAY CACHE THE SAME TEXT -- FIRST WRITER WINS
+        statement = pg_insert(EmbeddingCacheEntry).values([
+            {
+                "key": key,
+                "model": model,
+                "embedding": encode_embedding(embedding),
+                "embedding_dim": len(embedding)
+            }
+            for key, embedding in entries.items()
+        ]).on_conflict_do_nothing(index_elements=["key"])
+        db.execute(statement)
+        db.commit()
+
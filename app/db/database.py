@@ -1,21 +1,43 @@
+from typing import AsyncGenerator
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
 
-# CREATE SQL ENGINE
-engine = create_engine(settings.DATABASE_URL)
+# POOL SETTINGS SHARED BY BOTH ENGINES
+POOL_OPTIONS = {
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
+    "pool_timeout": settings.DB_POOL_TIMEOUT,
+    "pool_recycle": settings.DB_POOL_RECYCLE,
+    "pool_pre_ping": settings.DB_POOL_PRE_PING
+}
+
+def async_database_url(url: str) -> str:
+    # SAME DATABASE THROUGH THE ASYNCPG DRIVER
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "postgresql":
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    return parsed.render_as_string(hide_password=False)
+
+# CREATE SQL ENGINE -- SYNC, FOR BACKGROUND THREADS (INGESTION, INDEX LOADING, MIGRATIONS)
+engine = create_engine(settings.DATABASE_URL, **POOL_OPTIONS)
 
 # CREATE SESSION LOCAL CLASS
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# CREATE ASYNC ENGINE -- FOR REQUEST HANDLERS, NEVER BLOCKS THE EVENT LOOP
+async_engine = create_async_engine(async_database_url(settings.DATABASE_URL), **POOL_OPTIONS)
+
+# RETURNED OBJECTS STAY READABLE AFTER COMMIT WITHOUT ANOTHER (AWAITED) REFRESH
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # CREATE BASE CLASS FOR MODELS
 Base = declarative_base()
 
 # GET DB SESSION
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -0,0 +1,219 @@
+from typing import Dict, List
+from dataclasses import dataclass
+import argparse
+import logging
+import time
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from app.db.vector_codec import encode_embedding
+
+logger = logging.getLogger(__name__)
+
+# WHAT EACH KIND OF UPGRADE STILL NEEDS -- A CHECK RETURNS A ROW WHILE ITS UPGRADE IS PENDING
+MISSING_COLUMN = (
+    "SELECT 1 WHERE NOT EXISTS ("
+    "SELECT 1 FROM information_schema.columns "
+    "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column)"
+)
+PRESENT_COLUMN = (
+    "SELECT 1 FROM information_schema.columns "
+    "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"
+)
+NOT_NULL_COLUMN = PRESENT_COLUMN + " AND is_nullable = 'NO'"
+# AN INVALID INDEX IS WHAT AN INTERRUPTED CREATE INDEX CONCURRENTLY LEAVES BEHIND
+MISSING_INDEX = (
+    "SELECT 1 WHERE NOT EXISTS ("
+    "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+    "WHERE pg_class.relname = :index AND pg_class.relnamespace = current_schema()::regnamespace "
+    "AND pg_index.indisvalid)"
+)
+
+# SERIALIZES WORKERS UPGRADING THE SAME DATABASE (pg_advisory_lock KEY)
+UPGRADE_LOCK_KEY = 7311047
+UPGRADE_LOCK_POLL_SECONDS = 1.0
+
+
+@dataclass(frozen=True)
+class SchemaUpgrade:
+    # check (ONE OF THE QUERIES ABOVE) WITH params, AND THE STATEMENTS THAT APPLY THE UPGRADE
+    check: str
+    params: Dict[str, str]
+    statements: List[str]
+
+
+def add_column(table: str, column: str, definition: str) -> SchemaUpgrade:
+    return SchemaUpgrade(
+        MISSING_COLUMN, {"table": table, "column": column},
+        [f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}"]
+    )
+
+
+def drop_not_null(table: str, column: str) -> SchemaUpgrade:
+    return SchemaUpgrade(
+        NOT_NULL_COLUMN, {"table": table, "column": column},
+        [f"ALTER TABLE {table} ALTER COLUMN {column} DROP NOT NULL"]
+    )
+
+
+def create_index(name: str, definition: str, unique: bool = False) -> SchemaUpgrade:
+    # CONCURRENTLY -- WRITES TO THE TABLE GO ON WHILE THE INDEX BUILDS
+    return SchemaUpgrade(
+        MISSING_INDEX, {"index": name},
+        [
+            f"DROP INDEX CONCURRENTLY IF EXISTS {name}",
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY {name} ON {definition}"
+        ]
+    )
+
+
+# SCHEMA CHANGES FOR DATABASES CREATED BY AN OLDER create_all
+# NEW TABLES ARE HANDLED BY create_all, ONLY CHANGES TO EXISTING ONES GO HERE
+# EACH ONE RUNS ONLY WHILE ITS CHECK SAYS IT IS PENDING, SO ONCE A DATABASE IS UP TO DATE A
+# STARTUP ONLY READS THE CATALOG AND TAKES NO TABLE LOCKS
+SCHEMA_UPGRADES = [
+    # UPLOADS ARE STREAMED INTO CHUNKS INSTEAD OF KEPT IN documents.content
+    drop_not_null("documents", "content"),
+    add_column("ingestion_jobs", "source_path", "VARCHAR"),
+    # DOCUMENT UPDATES KEEP UNCHANGED CHUNKS
+    add_column("ingestion_jobs", "chunks_reused", "INTEGER NOT NULL DEFAULT 0"),
+    # JOB CLAIMS (SEE IngestionJob.lease_owner)
+    add_column("ingestion_jobs", "lease_owner", "VARCHAR"),
+    add_column("ingestion_jobs", "lease_expires_at", "TIMESTAMP"),
+    # BULK UPLOADS RUN AS JOBS WITHOUT A DOCUMENT OF THEIR OWN
+    add_column("ingestion_jobs", "kind", "VARCHAR NOT NULL DEFAULT 'document'"),
+    drop_not_null("ingestion_jobs", "document_id"),
+    add_column("ingestion_jobs", "files_done", "INTEGER NOT NULL DEFAULT 0"),
+    add_column("ingestion_jobs", "result", "JSONB"),
+    # SEE IngestionJob.__table_args__
+    create_index(
+        "uq_ingestion_jobs_unfinished_document",
+        "ingestion_jobs (document_id) WHERE status IN ('queued', 'running')",
+        unique=True
+    ),
+    # BINARY FLOAT32 EMBEDDINGS -- THE JSONB COLUMN STAYS UNTIL convert_legacy_embeddings HAS RUN
+    add_column("document_chunks", "embedding_vector", "BYTEA"),
+    add_column("document_chunks", "embedding_dim", "INTEGER"),
+    # CACHE ENTRIES ARE DISPOSABLE, OLD JSONB ONES ARE DROPPED RATHER THAN CONVERTED
+    add_column("embedding_cache", "embedding_vector", "BYTEA"),
+    add_column("embedding_cache", "embedding_dim", "INTEGER"),
+    SchemaUpgrade(
+        PRESENT_COLUMN, {"table": "embedding_cache", "column": "embedding"},
+        [
+            "DELETE FROM embedding_cache WHERE embedding_vector IS NULL",
+            "ALTER TABLE embedding_cache DROP COLUMN IF EXISTS embedding"
+        ]
+    ),
+    # SEE DocumentChunk.created_at
+    create_index("ix_document_chunks_created_at", "document_chunks (created_at)"),
+    # KEYSET PAGINATION OF THE LIST ENDPOINTS
+    create_index("ix_documents_created_at_id", "documents (created_at, id)"),
+    create_index("ix_qa_records_created_at_id", "qa_records (created_at, id)"),
+]
+
+
+def pending_upgrades(connection: Connection) -> List[SchemaUpgrade]:
+    return [
+        upgrade for upgrade in SCHEMA_UPGRADES
+        if connection.execute(text(upgrade.check), upgrade.params).first() is not None
+    ]
+
+
+def upgrade_schema(engine: Engine) -> int:
+    """
+    Apply the schema upgrades an existing database still needs.
+
+    Args:
+        engine: Engine for the database to upgrade
+
+    Returns:
+        The number of upgrades applied
+    """
+
+    with engine.connect() as connection:
+        if not pending_upgrades(connection):
+            return 0
+
+    # AUTOCOMMIT -- EACH STATEMENT HOLDS ITS LOCK ONLY AS LONG AS IT RUNS, AND CREATE INDEX
+    # CONCURRENTLY CANNOT RUN INSIDE A TRANSACTION
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        # POLLED, NOT WAITED FOR IN A QUERY -- AN INDEX BUILT CONCURRENTLY WAITS FOR EVERY OPEN SNAPSHOT
+        while not connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": UPGRADE_LOCK_KEY}).scalar():
+            time.sleep(UPGRADE_LOCK_POLL_SECONDS)
+        try:
+            # ANOTHER WORKER MAY HAVE APPLIED THEM MEANWHILE
+            upgrades = pending_upgrades(connection)
+            for upgrade in upgrades:
+                for statement in upgrade.statements:
+                    logger.info("Schema upgrade: %s", statement)
+                    connection.execute(text(statement))
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": UPGRADE_LOCK_KEY})
+    return len(upgrades)
+
+
+def convert_legacy_embeddings(engine: Engine, batch_size: int = 1000) -> int:
+    """
+    Move JSONB chunk embeddings into the binary float32 column, one batch per transaction.
+
+    Args:
+        engine: Engine for the database to convert
+        batch_size: Rows converted per transaction
+
+    Returns:
+        The number of rows converted
+    """
+
+    # A JSON null (OR ANY OTHER NON-ARRAY VALUE) PASSES IS NOT NULL BUT HOLDS NO EMBEDDING --
+    # CLEARED UP FRONT, SO THE BATCHES ONLY EVER SEE ARRAYS
+    clear_non_arrays = text(
+        "UPDATE document_chunks SET embedding = NULL "
+        "WHERE embedding_vector IS NULL AND embedding IS NOT NULL AND jsonb_typeof(embedding) <> 'array'"
+    )
+    select_batch = text(
+        "SELECT id, embedding FROM document_chunks "
+        "WHERE embedding_vector IS NULL AND embedding IS NOT NULL AND jsonb_typeof(embedding) = 'array' "
+        "LIMIT :limit"
+    )
+    update_row = text(
+        "UPDATE document_chunks "
+        "SET embedding_vector = :vector, embedding_dim = :dim, embedding = NULL "
+        "WHERE id = :id"
+    )
+
+    with engine.begin() as connection:
+        cleared = connection.execute(clear_non_arrays).rowcount
+    if cleared:
+        logger.warning("Cleared %d chunk embeddings that were not JSON arrays", cleared)
+
+    converted = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(select_batch, {"limit": batch_size}).all()
+            if not rows:
+                break
+            connection.execute(update_row, [
+                {"id": row.id, "vector": encode_embedding(row.embedding), "dim": len(row.embedding)}
+                for row in rows
+            ])
+        converted += len(rows)
+        logger.info("Converted %d chunk embeddings", converted)
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema upgrades to an existing database.")
+    parser.add_argument("--convert-embeddings", action="store_true",
+                        help="move JSONB chunk embeddings into the binary column")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db.database import engine
+
+    print(f"Applied {upgrade_schema(engine)} schema upgrades")
+    if args.convert_embeddings:
+        total = convert_legacy_embeddings(engine, batch_size=args.batch_size)
+        print(f"Converted {total} chunk embeddings")
@@ -2,8 +2,8 @@ from datetime import datetime
 import uuid
 from typing import List, Dict, Any, Optional
 
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Integer
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Integer, LargeBinary, Index, text
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 
 from app.db.database import Base
@@ -14,12 +14,19 @@ class Document(Base):
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     title = Column(String, nullable=False)
-    content = Column(Text, nullable=False)
+    # ONLY SET FOR LEGACY ROWS -- UPLOADS ARE STREAMED STRAIGHT INTO CHUNKS
+    content = deferred(Column(Text, nullable=True))
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    # KEYSET PAGINATION (SEE app.db.pagination)
+    __table_args__ = (Index("ix_documents_created_at_id", "created_at", "id"),)
+    
     # RELATIONSHIP -- ONE DOCUMENT HAS MANY CHUNKS
     chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
     
+    # RELATIONSHIP -- ONE DOCUMENT HAS MANY INGESTION JOBS
+    jobs = relationship("IngestionJob", back_populates="document", cascade="all, delete-orphan")
+    
 class DocumentChunk(Base):
     
     __tablename__ = "document_chunks"
@@ -28,9 +35,14 @@ class DocumentChunk(Base):
     document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"))
     chunk_index = Column(Integer, nullable=False)
     content = Column(Text, nullable=False)
-    embedding = Column(JSONB, nullable=True)
+    # LITTLE-ENDIAN FLOAT32 BUFFER, SEE app.db.vector_codec
+    embedding = Column("embedding_vector", LargeBinary, nullable=True)
+    embedding_dim = Column(Integer, nullable=True)
+    # PRE-BINARY JSONB ARRAY, EMPTIED BY app.db.migrations --convert-embeddings
+    legacy_embedding = deferred(Column("embedding", JSONB, nullable=True))
     chunk_metadata = Column(JSON, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # INDEXED FOR THE VECTOR INDEX SNAPSHOT REPLAY (CHUNKS NEWER THAN ITS HIGH-WATER MARK)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     # RELATIONSHIP -- MANY CHUNKS BELONG TO ONE DOCUMENT
     document = relationship("Document", back_populates="chunks")
@@ -42,5 +54,63 @@ class QARecord(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     question = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
-    chain_trace = Column(JSONB, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    # EVERY RETRIEVED CHUNK'S TEXT -- LOADED ONLY WHEN ASKED FOR
+    chain_trace = deferred(Column(JSONB, nullable=True))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # KEYSET PAGINATION (SEE app.db.pagination)
+    __table_args__ = (Index("ix_qa_records_created_at_id", "created_at", "id"),)
+    
+class EmbeddingCacheEntry(Base):
+    
+    __tablename__ = "embedding_cache"
+    
+    # SHA-256 OF (EMBEDDING MODEL, CHUNK TEXT)
+    key = Column(String(64), primary_key=True)
+    model = Column(String, nullable=False)
+    embedding = Column("embedding_vector", LargeBinary, nullable=False)
+    embedding_dim = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+class IngestionJob(Base):
+    
+    __tablename__ = "ingestion_jobs"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # "document" (ONE UPLOAD OR UPDATE OF document_id) OR "bulk" (A SPOOLED BATCH OF FILES AND
+    # ARCHIVES, EACH FILE BECOMING ITS OWN DOCUMENT -- SEE bulk_ingest)
+    kind = Column(String, nullable=False, default="document")
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), nullable=True)
+    # queued -> running -> completed | failed
+    status = Column(String, nullable=False, default="queued", index=True)
+    chunks_total = Column(Integer, nullable=False, default=0)
+    chunks_embedded = Column(Integer, nullable=False, default=0)
+    # CHUNKS WHOSE TEXT WAS ALREADY STORED FOR THE DOCUMENT -- KEPT WITH THEIR EMBEDDING, NOT RE-EMBEDDED
+    chunks_reused = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    # SPOOLED UPLOAD ON DISK, REMOVED ONCE THE JOB FINISHES
+    source_path = Column(String, nullable=True)
+    # WORKER RUNNING THE JOB AND HOW LONG ITS CLAIM HOLDS -- RENEWED WHILE IT RUNS, AN
+    # EXPIRED LEASE MEANS THE WORKER IS GONE AND ANOTHER ONE MAY TAKE THE JOB OVER
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    # BULK JOBS: FILES HANDLED SO FAR, COMMITTED WITH EACH FILE SO A RESUMED JOB SKIPS THEM,
+    # AND THE PER-FILE RESULTS AND THROUGHPUT (SAVED AS IT GOES, FINAL ONCE COMPLETED)
+    files_done = Column(Integer, nullable=False, default=0)
+    result = Column(JSONB, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # AT MOST ONE UNFINISHED JOB PER DOCUMENT -- TWO UPDATES WOULD DIFF AGAINST THE SAME CHUNK ROWS
+    __table_args__ = (
+        Index(
+            "uq_ingestion_jobs_unfinished_document",
+            "document_id",
+            unique=True,
+            postgresql_where=text("status IN ('queued', 'running')")
+        ),
+    )
+    
+    # RELATIONSHIP -- MANY JOBS BELONG TO ONE DOCUMENT
+    document = relationship("Document", back_populates="jobs")
+
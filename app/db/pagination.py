@@ -0,0 +1,53 @@
+from typing import Any, Optional, Sequence, Tuple
+from datetime import datetime
+from uuid import UUID
+import base64
+
+from sqlalchemy import tuple_
+
+# NEWEST FIRST, id BREAKS created_at TIES -- BACKED BY A (created_at, id) INDEX ON EACH LISTED TABLE
+
+
+def encode_cursor(created_at: datetime, row_id: UUID) -> str:
+    # OPAQUE TO CLIENTS -- THE (created_at, id) OF THE LAST ROW THEY SAW
+    raw = f"{created_at.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    # RAISES ValueError FOR ANYTHING encode_cursor DID NOT PRODUCE
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, row_id = raw.split("|")
+        return datetime.fromisoformat(created_at), UUID(row_id)
+    except Exception as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def keyset_page(query, model, limit: int, cursor: Optional[str] = None):
+    """
+    Order a select() newest first and restrict it to the page after cursor.
+
+    Args:
+        query: A select() over model's columns
+        model: Mapped class with created_at and id columns
+        limit: Rows per page
+        cursor: next_cursor of the previous page, None for the first page
+
+    Returns:
+        The paged query -- a row comparison, so Postgres walks the index
+        instead of skipping OFFSET rows
+    """
+
+    query = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.where(tuple_(model.created_at, model.id) < tuple_(created_at, row_id))
+    return query
+
+
+def next_cursor(rows: Sequence[Any], limit: int) -> Optional[str]:
+    # None ONCE A PAGE COMES BACK SHORT -- THERE IS NOTHING AFTER IT
+    if len(rows) < limit or not rows:
+        return None
+    return encode_cursor(rows[-1].created_at, rows[-1].id)
@@ -0,0 +1,14 @@
+from typing import Optional, Sequence
+import numpy as np
+
+# EMBEDDINGS ARE STORED AS RAW LITTLE-ENDIAN FLOAT32 BUFFERS
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+
+def encode_embedding(embedding: Sequence[float]) -> bytes:
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def decode_embedding(buffer: bytes, dim: Optional[int] = None) -> np.ndarray:
+    # ZERO-COPY, READ-ONLY VIEW OVER THE BUFFER
+    return np.frombuffer(buffer, dtype=EMBEDDING_DTYPE, count=dim if dim is not None else -1)
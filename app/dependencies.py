@@ -1,11 +1,17 @@
-from typing import Generator
-from sqlalchemy.orm import Session
+from typing import Optional
+from fastapi import Request
 
-from app.db.database import SessionLocal
+# THE ONE get_db DEPENDENCY LIVES WITH THE ENGINE -- RE-EXPORTED HERE FOR ROUTES
+from app.db.database import get_db
+from app.core.qa_chain import QAChain
+from app.core.query_batcher import QueryEmbeddingBatcher
 
-def get_db() -> Generator[Session, None, None]:
-    try:
-        db = SessionLocal()
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+__all__ = ["get_db", "get_qa_chain", "get_query_batcher"]
+
+def get_qa_chain(request: Request) -> QAChain:
+    # SHARED CHAIN BUILT IN THE app.main LIFESPAN
+    return request.app.state.qa_chain
+
+def get_query_batcher(request: Request) -> Optional[QueryEmbeddingBatcher]:
+    # NONE WHEN settings.QUERY_BATCHING_ENABLED IS OFF
+    return request.app.state.query_batcher
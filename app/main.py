@@ -1,18 +1,93 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import asyncio
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, PlainTextResponse
 
 from app.api.routes import api_router
 from app.config import settings
-from app.db.database import Base, engine
+from app.db.database import Base, engine, async_engine, SessionLocal
+from app.db.migrations import upgrade_schema
+from app.core.ingestion import ingestion_worker
+from app.core.bulk_ingest import bulk_ingestor
+from app.core.history_writer import qa_history_writer
+from app.core.clients import ProviderClients
+from app.core.retriever import make_retriever_fn, make_batch_retriever_fn
+from app.core.query_batcher import QueryEmbeddingBatcher
+from app.core.qa_chain import QAChain
+from app.core.metrics import metrics
+from app.core.vector_index import vector_index
+from app.core.lexical_index import lexical_index
 
-# CREATE DB TABLES
-Base.metadata.create_all(bind=engine)
+def prepare_database() -> None:
+    # CREATE DB TABLES
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+
+def rebuilt(load_stats: dict) -> bool:
+    return load_stats.get("source") == "db" or bool(load_stats.get("replayed_documents"))
+
+def load_indexes() -> None:
+    # SNAPSHOT PLUS REPLAY -- SAVED RIGHT AWAY IF IT HAD TO BE REBUILT, SO A CRASH DOES NOT COST IT AGAIN
+    with SessionLocal() as db:
+        vector_index.ensure_loaded(db)
+        if rebuilt(vector_index.load_stats):
+            vector_index.save_snapshot(db)
+        # HYBRID AND LEXICAL MODES WOULD OTHERWISE TOKENIZE THE CORPUS ON THE FIRST QUERY
+        if settings.RETRIEVAL_MODE != "vector":
+            lexical_index.ensure_loaded(db)
+            if rebuilt(lexical_index.load_stats):
+                lexical_index.save_snapshot()
+
+def save_indexes() -> None:
+    with SessionLocal() as db:
+        vector_index.save_snapshot(db)
+    lexical_index.save_snapshot()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # SCHEMA AND INDEX WORK RUNS BEFORE THE FIRST REQUEST, NOT AT IMPORT TIME
+    await asyncio.to_thread(prepare_database)
+    if settings.VECTOR_INDEX_SNAPSHOT_ENABLED:
+        await asyncio.to_thread(load_indexes)
+    
+    # PROVIDER CLIENTS AND THE COMPILED QA GRAPH LIVE AS LONG AS THE APP
+    clients = ProviderClients()
+    app.state.provider_clients = clients
+    query_batcher = None
+    if settings.QUERY_BATCHING_ENABLED:
+        query_batcher = QueryEmbeddingBatcher(
+            clients.embeddings.embed_documents,
+            window_seconds=settings.QUERY_BATCH_WINDOW_MS / 1000,
+            max_batch_size=settings.QUERY_BATCH_MAX_SIZE,
+            max_in_flight=settings.EMBEDDING_MAX_CONCURRENCY
+        )
+    app.state.query_batcher = query_batcher
+    app.state.qa_chain = QAChain(
+        retriever_fn=make_retriever_fn(clients.embeddings, query_batcher),
+        llm=clients.llm,
+        batch_retriever_fn=make_batch_retriever_fn(clients.embeddings, query_batcher)
+    )
+    
+    # PICK UP INGESTION JOBS LEFT OVER FROM THE LAST RUN
+    ingestion_worker.resume_unfinished()
+    yield
+    ingestion_worker.shutdown()
+    bulk_ingestor.shutdown()
+    # QA HISTORY STILL QUEUED IS WRITTEN BEFORE THE ENGINE GOES AWAY
+    await qa_history_writer.close()
+    if settings.VECTOR_INDEX_SNAPSHOT_ENABLED:
+        await asyncio.to_thread(save_indexes)
+    if query_batcher is not None:
+        query_batcher.close()
+    await clients.aclose()
+    await async_engine.dispose()
 
 # INITI FASTAPI
 app = FastAPI(
     title=settings.APP_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan
 )
 
 # CORS
@@ -22,6 +97,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # PAGE CURSORS FOR GET /documents/ AND /qa/history
+    expose_headers=["X-Next-Cursor"],
 )
 
 # INCLUDE API ROUTER
@@ -29,4 +106,11 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 
 @app.get("/", include_in_schema=False)
 async def root():
-    return RedirectResponse(url="/docs")
\ No newline at end of file
+    return RedirectResponse(url="/docs")
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    # PROMETHEUS TEXT EXPOSITION FORMAT
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
\ No newline at end of file
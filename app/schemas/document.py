@@ -7,7 +7,7 @@ class DocumentBase(BaseModel):
     title: str
 
 class DocumentCreate(DocumentBase):
-    content: str
+    content: Optional[str] = None
     
 class DocumentResponse(DocumentBase):
     id: UUID
@@ -39,3 +39,66 @@ class DocumentChunkResponse(DocumentChunkBase):
     model_config = {
         "from_attributes": True
     }
+
+
+class EmbeddingCacheStats(BaseModel):
+    size: int
+    max_size: int
+    memory_hits: int
+    db_hits: int
+    misses: int
+    hit_rate: float
+    provider_calls: int
+    provider_seconds: float
+    estimated_seconds_saved: float
+
+
+class IngestionJobResponse(BaseModel):
+    id: UUID
+    # "document" OR "bulk" -- A BULK JOB HAS NO document_id, ITS FILES ARE LISTED IN result
+    kind: str = "document"
+    document_id: Optional[UUID] = None
+    status: str
+    chunks_total: int
+    chunks_embedded: int
+    chunks_reused: int = 0
+    files_done: int = 0
+    result: Optional["BulkIngestResponse"] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    
+    model_config = {
+        "from_attributes": True
+    }
+
+
+
+class BulkIngestFileResult(BaseModel):
+    filename: str
+    source: str
+    # "completed", "failed" OR "skipped"
+    status: str
+    document_id: Optional[UUID] = None
+    chunks: int
+    bytes: int
+    error: Optional[str] = None
+
+
+class BulkIngestResponse(BaseModel):
+    files: List[BulkIngestFileResult]
+    files_completed: int
+    files_failed: int
+    files_skipped: int
+    # STOPPED AT BULK_INGEST_MAX_FILES
+    truncated: bool
+    chunks: int
+    bytes: int
+    elapsed_seconds: float
+    files_per_second: float
+    chunks_per_second: float
+    megabytes_per_second: float
+    stage_seconds: Dict[str, float]
+
+
+IngestionJobResponse.model_rebuild()
@@ -7,6 +7,9 @@ class QARequest(BaseModel):
     question: str = Field(..., description="The question to answer")
     stream: bool = Field(False, description="Whether to stream the response")
     
+class QABatchRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, description="The questions to answer")
+    
 class ChainNode(BaseModel):
     id: str
     type: str
@@ -27,6 +30,11 @@ class QAWorkflowState(BaseModel):
     context: str = ""
     answer: str = ""
     question_node_id: str = ""
+    reasoning_node_id: str = ""
+    # TRACE OF THIS RUN -- KEPT IN THE STATE SO ONE CHAIN CAN SERVE CONCURRENT RUNS
+    trace_nodes: List[Dict[str, Any]] = Field(default_factory=list)
+    trace_edges: List[Dict[str, Any]] = Field(default_factory=list)
+    node_counter: int = 0
 
 class QAResponse(BaseModel):
     id: UUID = Field(default_factory=uuid4)
@@ -48,4 +56,42 @@ class QAHistoryResponse(BaseModel):
         "from_attributes": True
     }
 
-    
\ No newline at end of file
+
+class QueryCacheStats(BaseModel):
+    size: int
+    max_size: int
+    ttl_seconds: float
+    hits: int
+    misses: int
+    expirations: int
+    hit_rate: float
+    avg_hit_ms: float
+    avg_miss_ms: float
+
+
+class QueryBatcherStats(BaseModel):
+    window_ms: float
+    max_batch_size: int
+    batches: int
+    texts: int
+    provider_texts: int
+    avg_batch_size: float
+    largest_batch: int
+    errors: int
+    avg_provider_ms: float
+
+
+class QAHistoryWriterStats(BaseModel):
+    enabled: bool
+    queue_depth: int
+    max_queue_size: int
+    full_policy: str
+    batch_size: int
+    flush_interval_seconds: float
+    enqueued: int
+    written: int
+    dropped: int
+    failed: int
+    flushes: int
+    avg_flush_ms: float
+    last_flush_ms: float
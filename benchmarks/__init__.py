@@ -0,0 +1 @@
+"""Performance benchmarks for the Knowledge Base Q&A backend."""
@@ -0,0 +1,111 @@
+"""
+Recall@k and latency of IVF search against the exact path.
+
+Builds an in-memory VectorIndex in "ivf" mode and, for each nprobe value,
+compares its top-k with exact search over the same rows. By default the
+corpus is synthetic clustered data; --from-db loads the chunk embeddings
+from DATABASE_URL and samples queries from them.
+
+    python -m benchmarks.ann_recall --chunks 200000 --dim 384 --nprobe 1 4 16 64
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import numpy as np
+
+from app.core.vector_index import VectorIndex
+
+
+def synthetic_corpus(n: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    return centers[labels] + 1.5 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def run(index: VectorIndex, queries: np.ndarray, top_k: int, nprobes):
+    exact_results, exact_times = [], []
+    for query in queries:
+        started = time.perf_counter()
+        exact_results.append({chunk_id for chunk_id, _ in index.search(query, top_k, exact=True)})
+        exact_times.append(time.perf_counter() - started)
+
+    report = {
+        "exact": {
+            "p50_ms": percentile_ms(exact_times, 50),
+            "p95_ms": percentile_ms(exact_times, 95)
+        },
+        "ivf": []
+    }
+    for nprobe in nprobes:
+        recalls, times = [], []
+        for query, expected in zip(queries, exact_results):
+            started = time.perf_counter()
+            found = {chunk_id for chunk_id, _ in index.search(query, top_k, nprobe=nprobe)}
+            times.append(time.perf_counter() - started)
+            recalls.append(len(found & expected) / max(1, len(expected)))
+        report["ivf"].append({
+            "nprobe": nprobe,
+            f"recall@{top_k}": round(float(np.mean(recalls)), 4),
+            "p50_ms": percentile_ms(times, 50),
+            "p95_ms": percentile_ms(times, 95),
+            "speedup_p50": round(float(np.percentile(exact_times, 50) / max(np.percentile(times, 50), 1e-9)), 2)
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=0, help="0 = ~sqrt(chunks)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--from-db", action="store_true", help="use the chunk embeddings in DATABASE_URL")
+    args = parser.parse_args()
+
+    index = VectorIndex(mode="ivf", nlist=args.nlist, min_train_size=1)
+    rng = np.random.default_rng(1)
+
+    started = time.perf_counter()
+    if args.from_db:
+        from app.db.database import SessionLocal
+        with SessionLocal() as db:
+            index.load(db)
+        corpus = index._snapshot.codes
+    else:
+        corpus = synthetic_corpus(args.chunks, args.dim, args.clusters)
+        index.load_arrays(
+            [uuid.uuid4() for _ in range(len(corpus))],
+            [None] * len(corpus),
+            corpus
+        )
+    build_seconds = time.perf_counter() - started
+
+    # QUERIES ARE PERTURBED CORPUS ROWS SO THEY LOOK LIKE REAL QUESTIONS NEAR THE DATA
+    picks = rng.choice(len(corpus), min(args.queries, len(corpus)), replace=False)
+    queries = corpus[picks] + 0.1 * rng.standard_normal((len(picks), corpus.shape[1])).astype(np.float32)
+
+    report = {
+        "chunks": index.size,
+        "dim": index.dim,
+        "nlist": index._snapshot.ivf.nlist if index._snapshot.ivf is not None else 0,
+        "build_seconds": round(build_seconds, 3),
+        **run(index, queries, args.top_k, args.nprobe)
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
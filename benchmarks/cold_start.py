@@ -0,0 +1,153 @@
+"""
+Vector index startup time: full rebuild from the DB vs. snapshot plus replay.
+
+Seeds a scratch Postgres database (DATABASE_URL) with synthetic chunk
+embeddings, then measures:
+
+- rebuild: VectorIndex.load reading and decoding every embedding (--legacy
+  stores them in the old JSONB column, the slowest path)
+- save: writing the .npy snapshot
+- snapshot: a fresh index loading the snapshot after --changed documents
+  were added and --deleted documents removed, replaying only those
+
+The seeded documents are deleted afterwards unless --keep is given.
+
+    python -m benchmarks.cold_start --documents 2000 --chunks-per-doc 50 --dim 1536
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import numpy as np
+from sqlalchemy import insert
+
+from app.config import settings
+from app.db.database import Base, engine, SessionLocal
+from app.db.migrations import upgrade_schema
+from app.db.models import Document, DocumentChunk
+from app.db.vector_codec import encode_embedding
+from app.core.vector_index import VectorIndex
+from app.core.index_snapshot import SnapshotStore
+
+
+def seed_documents(count: int, chunks_per_doc: int, dim: int, legacy: bool, created_at: datetime, rng):
+    # BULK INSERTS, ONE TRANSACTION PER DOCUMENT BATCH
+    document_ids = []
+    for start in range(0, count, 100):
+        documents, chunks = [], []
+        for d in range(start, min(start + 100, count)):
+            document_id = uuid.uuid4()
+            document_ids.append(document_id)
+            documents.append({"id": document_id, "title": f"Cold start {d}", "created_at": created_at})
+            vectors = rng.standard_normal((chunks_per_doc, dim)).astype(np.float32)
+            for i, vector in enumerate(vectors):
+                row = {
+                    "id": uuid.uuid4(),
+                    "document_id": document_id,
+                    "chunk_index": i,
+                    "content": f"chunk {i} of document {d}",
+                    "created_at": created_at
+                }
+                if legacy:
+                    row["legacy_embedding"] = vector.tolist()
+                else:
+                    row["embedding"] = encode_embedding(vector)
+                    row["embedding_dim"] = dim
+                chunks.append(row)
+        with SessionLocal() as db:
+            db.execute(insert(Document), documents)
+            db.execute(insert(DocumentChunk), chunks)
+            db.commit()
+    return document_ids
+
+
+def delete_documents(document_ids):
+    with SessionLocal() as db:
+        for start in range(0, len(document_ids), 500):
+            batch = document_ids[start:start + 500]
+            db.query(DocumentChunk).filter(DocumentChunk.document_id.in_(batch)).delete(synchronize_session=False)
+            db.query(Document).filter(Document.id.in_(batch)).delete(synchronize_session=False)
+        db.commit()
+
+
+def timed_load(index: VectorIndex) -> float:
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        index.load(db)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=500)
+    parser.add_argument("--chunks-per-doc", type=int, default=40)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--changed", type=int, default=5, help="documents added after the snapshot")
+    parser.add_argument("--deleted", type=int, default=5, help="documents deleted after the snapshot")
+    parser.add_argument("--quantization", default=settings.RETRIEVAL_QUANTIZATION)
+    parser.add_argument("--legacy", action="store_true", help="store embeddings in the JSONB column")
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    rng = np.random.default_rng(0)
+    snapshot_dir = tempfile.mkdtemp(prefix="knbqa-snapshot-")
+    snapshots = SnapshotStore(snapshot_dir, settings.DATABASE_URL)
+
+    # OLDER THAN THE REPLAY MARGIN, SO ONLY THE CHANGES BELOW ARE REPLAYED
+    seeded = seed_documents(args.documents, args.chunks_per_doc, args.dim, args.legacy,
+                            datetime.utcnow() - timedelta(hours=1), rng)
+    added = []
+    try:
+        rebuilt = VectorIndex(quantization=args.quantization)
+        rebuild_seconds = timed_load(rebuilt)
+
+        # THE LIVE INDEX SAVES ITS SNAPSHOT ON SHUTDOWN -- SAME HERE
+        rebuilt.snapshots = snapshots
+        started = time.perf_counter()
+        with SessionLocal() as db:
+            manifest = rebuilt.save_snapshot(db)
+        save_seconds = time.perf_counter() - started
+
+        added = seed_documents(args.changed, args.chunks_per_doc, args.dim, args.legacy, datetime.utcnow(), rng)
+        deleted, seeded = seeded[:args.deleted], seeded[args.deleted:]
+        delete_documents(deleted)
+
+        restored = VectorIndex(quantization=args.quantization, snapshots=snapshots)
+        snapshot_seconds = timed_load(restored)
+        expected = VectorIndex(quantization=args.quantization)
+        timed_load(expected)
+
+        report = {
+            "chunks": rebuilt.size,
+            "dim": args.dim,
+            "quantization": args.quantization,
+            "legacy_jsonb": args.legacy,
+            "rebuild_seconds": round(rebuild_seconds, 3),
+            "snapshot_save_seconds": round(save_seconds, 3),
+            "snapshot_bytes": sum(
+                os.path.getsize(os.path.join(snapshot_dir, manifest["path"], name))
+                for name in os.listdir(os.path.join(snapshot_dir, manifest["path"]))
+            ),
+            "snapshot_load_seconds": round(snapshot_seconds, 3),
+            "speedup": round(rebuild_seconds / max(snapshot_seconds, 1e-9), 1),
+            "load_stats": restored.load_stats,
+            "rows_match_rebuild": restored.size == expected.size
+        }
+        print(json.dumps(report, indent=2))
+    finally:
+        if not args.keep:
+            delete_documents(seeded + added)
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Local stand-in for the OpenAI embeddings and chat-completions endpoints.
+
+Embeddings are deterministic: every word (or token id) maps to a fixed
+pseudo-random unit vector and a text embeds to the normalized sum of its
+words, so texts that share words land close together and retrieval has
+something real to find. Chat completions return a canned answer, streamed
+token by token when asked. Latency can be injected per request, per
+embedded text and per streamed token.
+
+Run standalone and point the app at it:
+
+    python -m benchmarks.fake_openai --port 8089 --embedding-latency-ms 20
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 uvicorn app.main:app
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+CANNED_ANSWER = (
+    "Based on the provided context, the requested behaviour is configured in the "
+    "settings file and takes effect after the service is restarted."
+)
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+class FakeEmbedder:
+
+    # BAG-OF-WORDS RANDOM PROJECTION -- SAME TEXT, SAME VECTOR, ON EVERY RUN
+
+    def __init__(self, dim: int = 1536):
+        self.dim = dim
+        self._word_vectors = {}
+        self._lock = threading.Lock()
+
+    def _word_vector(self, word) -> np.ndarray:
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.sha256(str(word).encode()).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            with self._lock:
+                self._word_vectors[word] = vector
+        return vector
+
+    def embed(self, value) -> list:
+        # value IS A STRING, OR A LIST OF TOKEN IDS WHEN THE CLIENT PRE-TOKENIZES
+        words = _WORD_PATTERN.findall(value.lower()) if isinstance(value, str) else list(value)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in words or [""]:
+            vector += self._word_vector(word)
+        vector /= np.linalg.norm(vector) or 1.0
+        return vector.tolist()
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    # HEADERS AND BODY GO OUT AS SEPARATE WRITES -- WITHOUT THIS, DELAYED ACKS ADD ~40ms
+    # TO EVERY REQUEST ON A KEPT-ALIVE CONNECTION
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.lock:
+            self.server.requests += 1
+
+        if self.path.endswith("/embeddings"):
+            self._embeddings(request)
+        elif self.path.endswith("/chat/completions"):
+            self._chat(request)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _embeddings(self, request: dict) -> None:
+        inputs = request.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        config = self.server.config
+        time.sleep((config["embedding_latency_ms"] + config["embedding_per_text_ms"] * len(inputs)) / 1000)
+
+        with self.server.lock:
+            self.server.embedding_calls += 1
+            self.server.embedded_texts += len(inputs)
+        self._send_json(200, {
+            "object": "list",
+            "model": request.get("model", "fake"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": self.server.embedder.embed(value)}
+                for i, value in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0}
+        })
+
+    @staticmethod
+    def _usage(request: dict, answer: str) -> dict:
+        # ONE TOKEN PER WORD IS CLOSE ENOUGH FOR A FAKE
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in request.get("messages", []))
+        completion_tokens = len(answer.split())
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    def _chat(self, request: dict) -> None:
+        config = self.server.config
+        with self.server.lock:
+            self.server.chat_calls += 1
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = request.get("model", "fake")
+        answer = config["answer"]
+        time.sleep(config["chat_latency_ms"] / 1000)
+
+        if not request.get("stream"):
+            time.sleep(config["token_latency_ms"] * len(answer.split()) / 1000)
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop"
+                }],
+                "usage": self._usage(request, answer)
+            })
+            return
+
+        # SERVER-SENT EVENTS OVER A CHUNKED RESPONSE, ONE WORD PER EVENT
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(data: str) -> None:
+            payload = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta: dict, finish_reason=None) -> str:
+            return json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            })
+
+        send_event(chunk({"role": "assistant", "content": ""}))
+        for i, word in enumerate(answer.split(" ")):
+            if i:
+                time.sleep(config["token_latency_ms"] / 1000)
+            send_event(chunk({"content": word if i == 0 else " " + word}))
+        send_event(chunk({}, "stop"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send_event(json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [],
+                "usage": self._usage(request, answer)
+            }))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_server(port: int = 0,
+                 dim: int = 1536,
+                 embedding_latency_ms: float = 0.0,
+                 embedding_per_text_ms: float = 0.0,
+                 chat_latency_ms: float = 0.0,
+                 token_latency_ms: float = 0.0,
+                 answer: str = CANNED_ANSWER) -> ThreadingHTTPServer:
+    """
+    Start the fake server on a background thread.
+
+    Args:
+        port: Port to bind on 127.0.0.1, 0 picks a free one
+        dim: Embedding dimension
+        embedding_latency_ms: Added to every embeddings request
+        embedding_per_text_ms: Added per text in an embeddings request
+        chat_latency_ms: Added before the first token of every completion
+        token_latency_ms: Added between streamed tokens
+        answer: Completion text returned for every chat request
+
+    Returns:
+        The running server; base_url(server) gives the OPENAI_BASE_URL to use
+    """
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.embedder = FakeEmbedder(dim)
+    server.config = {
+        "embedding_latency_ms": embedding_latency_ms,
+        "embedding_per_text_ms": embedding_per_text_ms,
+        "chat_latency_ms": chat_latency_ms,
+        "token_latency_ms": token_latency_ms,
+        "answer": answer
+    }
+    reset_counters(server)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def reset_counters(server: ThreadingHTTPServer) -> None:
+    server.connections = 0
+    server.requests = 0
+    server.embedding_calls = 0
+    server.embedded_texts = 0
+    server.chat_calls = 0
+
+
+def counters(server: ThreadingHTTPServer) -> dict:
+    return {
+        "connections": server.connections,
+        "requests": server.requests,
+        "embedding_calls": server.embedding_calls,
+        "embedded_texts": server.embedded_texts,
+        "chat_calls": server.chat_calls
+    }
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0)
+    parser.add_argument("--embedding-per-text-ms", type=float, default=0.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=0.0)
+    parser.add_argument("--token-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_server(
+        port=args.port,
+        dim=args.dim,
+        embedding_latency_ms=args.embedding_latency_ms,
+        embedding_per_text_ms=args.embedding_per_text_ms,
+        chat_latency_ms=args.chat_latency_ms,
+        token_latency_ms=args.token_latency_ms
+    )
+    print(f"Fake OpenAI server listening on {base_url(server)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
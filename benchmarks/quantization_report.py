@@ -0,0 +1,95 @@
+"""
+Memory and recall of int8 / binary quantized retrieval against float32.
+
+For each quantization mode and shortlist multiplier, searches the
+quantized index for top_k * multiplier candidates, re-ranks them with
+the full-precision vectors (as VectorRetriever does with the vectors
+stored in Postgres) and compares the final top-k with exact float32
+search. --from-db runs on the chunk embeddings in DATABASE_URL, so the
+numbers reflect our own corpus; without it a synthetic corpus is used.
+
+    python -m benchmarks.quantization_report --from-db --multiplier 1 4 10
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import numpy as np
+
+from app.core.vector_index import VectorIndex
+from benchmarks.ann_recall import synthetic_corpus, percentile_ms
+
+
+def load_corpus(args):
+    if args.from_db:
+        from app.db.database import SessionLocal
+        index = VectorIndex(quantization="none")
+        with SessionLocal() as db:
+            index.load(db)
+        snapshot = index._snapshot
+        return np.asarray(snapshot.codes), [snapshot.chunk_id(row) for row in range(len(snapshot.chunk_ids))]
+    corpus = synthetic_corpus(args.chunks, args.dim, args.clusters)
+    return VectorIndex._normalize(corpus), [uuid.uuid4() for _ in range(len(corpus))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--multiplier", type=int, nargs="+", default=[1, 4, 10])
+    parser.add_argument("--from-db", action="store_true", help="use the chunk embeddings in DATABASE_URL")
+    args = parser.parse_args()
+
+    corpus, chunk_ids = load_corpus(args)
+    row_of = {chunk_id: row for row, chunk_id in enumerate(chunk_ids)}
+    document_ids = [None] * len(chunk_ids)
+
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(corpus), min(args.queries, len(corpus)), replace=False)
+    queries = corpus[picks] + 0.1 * rng.standard_normal((len(picks), corpus.shape[1])).astype(np.float32)
+
+    baseline = VectorIndex(quantization="none")
+    baseline.load_arrays(chunk_ids, document_ids, corpus)
+    expected = [{chunk_id for chunk_id, _ in baseline.search(query, args.top_k)} for query in queries]
+
+    report = {
+        "chunks": len(chunk_ids),
+        "dim": corpus.shape[1],
+        "float32_bytes": baseline.memory_bytes,
+        "modes": []
+    }
+    for quantization in ("int8", "binary"):
+        index = VectorIndex(quantization=quantization)
+        index.load_arrays(chunk_ids, document_ids, corpus)
+        for multiplier in args.multiplier:
+            recalls, times = [], []
+            for query, truth in zip(queries, expected):
+                started = time.perf_counter()
+                shortlist = index.search(query, args.top_k * multiplier)
+                scores = VectorIndex.exact_scores(query, [corpus[row_of[chunk_id]] for chunk_id, _ in shortlist])
+                top = np.argsort(-scores)[:args.top_k]
+                found = {shortlist[i][0] for i in top}
+                times.append(time.perf_counter() - started)
+                recalls.append(len(found & truth) / max(1, len(truth)))
+            report["modes"].append({
+                "quantization": quantization,
+                "shortlist_multiplier": multiplier,
+                "index_bytes": index.memory_bytes,
+                "memory_reduction": round(baseline.memory_bytes / max(1, index.memory_bytes), 1),
+                f"recall@{args.top_k}": round(float(np.mean(recalls)), 4),
+                "p50_ms": percentile_ms(times, 50),
+                "p95_ms": percentile_ms(times, 95)
+            })
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
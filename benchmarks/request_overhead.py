@@ -0,0 +1,93 @@
+"""
+Per-request overhead of building provider clients and the QA graph.
+
+"per_request" reproduces what /qa/ask used to do on every call: build an
+embeddings client, a chat client and compile the LangGraph state graph,
+then embed the question over a brand-new HTTP connection. "shared" uses
+the ProviderClients / QAChain objects the lifespan handler now creates
+once. Embedding calls go to a local stub server, so only client-side
+cost and connection setup are measured; the stub reports how many TCP
+connections each variant opened.
+
+    python -m benchmarks.request_overhead --requests 200
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from benchmarks.fake_openai import start_server, base_url, reset_counters
+
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def summarize(build_times, call_times, connections):
+    return {
+        "build_p50_ms": percentile_ms(build_times, 50),
+        "build_p95_ms": percentile_ms(build_times, 95),
+        "embed_p50_ms": percentile_ms(call_times, 50),
+        "embed_p95_ms": percentile_ms(call_times, 95),
+        "tcp_connections": connections
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    server = start_server(dim=8)
+    os.environ["OPENAI_BASE_URL"] = base_url(server)
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    # SEND RAW STRINGS, THE STUB DOES NOT NEED tiktoken TOKEN IDS
+    os.environ["EMBEDDING_CHECK_CTX_LENGTH"] = "false"
+
+    from app.core.clients import ProviderClients, build_embeddings, build_http_client
+    from app.core.qa_chain import QAChain
+
+    def no_context(question):
+        return []
+
+    # BEFORE: EVERYTHING BUILT PER REQUEST
+    build_times, call_times = [], []
+    reset_counters(server)
+    for i in range(args.requests):
+        started = time.perf_counter()
+        http_client = build_http_client()
+        embeddings = build_embeddings(http_client)
+        QAChain(retriever_fn=no_context)
+        built = time.perf_counter()
+        embeddings.embed_query(f"question {i}")
+        done = time.perf_counter()
+        http_client.close()
+        build_times.append(built - started)
+        call_times.append(done - built)
+    per_request = summarize(build_times, call_times, server.connections)
+
+    # AFTER: BUILT ONCE, AS IN THE LIFESPAN HANDLER
+    clients = ProviderClients()
+    QAChain(retriever_fn=no_context, llm=clients.llm)
+    build_times, call_times = [], []
+    reset_counters(server)
+    for i in range(args.requests):
+        started = time.perf_counter()
+        clients.embeddings.embed_query(f"question {i}")
+        call_times.append(time.perf_counter() - started)
+        build_times.append(0.0)
+    shared = summarize(build_times, call_times, server.connections)
+    clients.http_client.close()
+
+    print(json.dumps({
+        "requests": args.requests,
+        "per_request": per_request,
+        "shared": shared
+    }, indent=2))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
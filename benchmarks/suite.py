@@ -0,0 +1,301 @@
+"""
+End-to-end performance suite against a local fake OpenAI server.
+
+Starts benchmarks.fake_openai (deterministic embeddings, canned streamed
+answers, configurable latency) and the app itself under uvicorn on a
+local port, then measures:
+
+- ingestion: synthetic documents uploaded through POST /documents/ until
+  every job completes (documents/s, chunks/s, MB/s)
+- retrieval: VectorRetriever.retrieve latency p50/p95/p99
+- ask: end-to-end POST /qa/ask latency p50/p95/p99 at --concurrency
+- stream: time to first token and total time of streamed /qa/ask
+- memory: peak RSS and in-memory index sizes
+
+DATABASE_URL must point at a scratch Postgres database; the documents the
+suite creates are deleted afterwards unless --keep is given. Results are
+printed (and written to --output) as JSON so runs can be compared across
+commits:
+
+    python -m benchmarks.suite --documents 200 --doc-kb 20 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.fake_openai import start_server, base_url, counters, reset_counters
+
+WORDS = (
+    "service config timeout retry cache index shard replica latency throughput "
+    "request response token vector chunk document upload query answer context "
+    "pipeline worker queue batch stream memory disk network cluster node deploy "
+    "rollback migration schema table column backup restore alert metric trace"
+).split()
+
+
+def synthetic_corpus(num_documents: int, doc_kb: int, seed: int = 0):
+    # PARAGRAPHS OF DOMAIN-ISH WORDS PLUS IDENTIFIERS, SO BOTH RANKERS HAVE SOMETHING TO MATCH
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for d in range(num_documents):
+        paragraphs, size = [], 0
+        while size < doc_kb * 1024:
+            words = rng.choice(WORDS, int(rng.integers(40, 120)))
+            sentence = " ".join(words) + f" ERR-{int(rng.integers(1000, 9999))}."
+            paragraphs.append(sentence.capitalize())
+            size += len(sentence) + 2
+        corpus.append((f"Synthetic document {d}", "\n\n".join(paragraphs)))
+    return corpus
+
+
+def sample_queries(corpus, count: int, seed: int = 1):
+    # A FEW WORDS LIFTED FROM RANDOM PARAGRAPHS
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(count):
+        _, text = corpus[int(rng.integers(len(corpus)))]
+        paragraphs = text.split("\n\n")
+        words = paragraphs[int(rng.integers(len(paragraphs)))].split()
+        start = int(rng.integers(max(1, len(words) - 8)))
+        queries.append(" ".join(words[start:start + 8]))
+    return queries
+
+
+def percentiles_ms(samples):
+    if not samples:
+        return {}
+    return {
+        f"p{q}_ms": round(float(np.percentile(samples, q)) * 1000, 3)
+        for q in (50, 95, 99)
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def start_app(app):
+    # THE REAL ASGI SERVER ON A FREE PORT, SO STREAMING BEHAVES AS IT DOES IN PRODUCTION
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="on"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+async def bench_ingestion(client, api: str, corpus, poll_seconds: float = 0.2):
+    started = time.perf_counter()
+    jobs = []
+    for title, text in corpus:
+        while True:
+            response = await client.post(
+                f"{api}/documents/",
+                data={"title": title},
+                files={"file": (f"{title}.md", text.encode(), "text/markdown")}
+            )
+            # QUEUE FULL -- BACK OFF UNTIL THE WORKERS CATCH UP
+            if response.status_code != 503:
+                break
+            await asyncio.sleep(poll_seconds)
+        response.raise_for_status()
+        jobs.append(response.json())
+
+    pending = {job["id"] for job in jobs}
+    chunks, failed = 0, 0
+    while pending:
+        await asyncio.sleep(poll_seconds)
+        for job_id in list(pending):
+            job = (await client.get(f"{api}/documents/jobs/{job_id}")).json()
+            if job["status"] in ("completed", "failed"):
+                pending.discard(job_id)
+                chunks += job["chunks_embedded"]
+                failed += job["status"] == "failed"
+    elapsed = time.perf_counter() - started
+
+    total_bytes = sum(len(text.encode()) for _, text in corpus)
+    return {
+        "documents": len(corpus),
+        "failed": failed,
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "documents_per_second": round(len(corpus) / elapsed, 2),
+        "chunks_per_second": round(chunks / elapsed, 2),
+        "mb_per_second": round(total_bytes / elapsed / 1e6, 3)
+    }, [job["document_id"] for job in jobs]
+
+
+def bench_retrieval(queries, embeddings):
+    from app.db.database import SessionLocal
+    from app.core.retriever import VectorRetriever
+
+    with SessionLocal() as db:
+        retriever = VectorRetriever(db, embeddings=embeddings)
+        # FIRST CALL BUILDS THE IN-MEMORY INDEXES -- REPORTED SEPARATELY
+        started = time.perf_counter()
+        retriever.retrieve("warm up")
+        load_seconds = time.perf_counter() - started
+
+        times = []
+        for query in queries:
+            started = time.perf_counter()
+            retriever.retrieve(query)
+            times.append(time.perf_counter() - started)
+    return {"queries": len(queries), "index_load_seconds": round(load_seconds, 3), **percentiles_ms(times)}
+
+
+async def bench_ask(client, api: str, queries, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    times = []
+
+    async def ask(question):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(f"{api}/qa/ask", json={"question": question})
+            response.raise_for_status()
+            times.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(ask(question) for question in queries))
+    elapsed = time.perf_counter() - started
+    return {
+        "questions": len(queries),
+        "concurrency": concurrency,
+        "questions_per_second": round(len(queries) / elapsed, 2),
+        **percentiles_ms(times)
+    }
+
+
+async def bench_stream(client, api: str, queries):
+    first_token, total = [], []
+    for question in queries:
+        started = time.perf_counter()
+        seen_token = False
+        async with client.stream("POST", f"{api}/qa/ask", json={"question": question, "stream": True}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not seen_token and line and json.loads(line)["type"] == "token":
+                    first_token.append(time.perf_counter() - started)
+                    seen_token = True
+        total.append(time.perf_counter() - started)
+    return {
+        "questions": len(queries),
+        "time_to_first_token": percentiles_ms(first_token),
+        "total": percentiles_ms(total)
+    }
+
+
+async def run(args, server):
+    import httpx
+    from app.main import app
+    from app.core.clients import ProviderClients
+    from app.core.vector_index import vector_index
+    from app.core.lexical_index import lexical_index
+    from app.config import settings
+
+    corpus = synthetic_corpus(args.documents, args.doc_kb, seed=args.seed)
+    queries = sample_queries(corpus, args.queries, seed=args.seed + 1)
+    api = settings.API_V1_STR
+
+    app_server, app_thread, url = start_app(app)
+    report = {}
+    document_ids = []
+    try:
+        async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+            reset_counters(server)
+            report["ingestion"], document_ids = await bench_ingestion(client, api, corpus)
+            report["ingestion"]["provider"] = counters(server)
+
+            reset_counters(server)
+            clients = ProviderClients()
+            report["retrieval"] = await asyncio.to_thread(bench_retrieval, queries, clients.embeddings)
+            await clients.aclose()
+
+            # FRESH QUESTION TEXT SO THE QUERY CACHE DOES NOT SERVE THESE
+            reset_counters(server)
+            ask_queries = [f"{query} (ask {i})" for i, query in enumerate(queries)]
+            report["ask"] = await bench_ask(client, api, ask_queries, args.concurrency)
+            report["ask"]["provider"] = counters(server)
+
+            stream_queries = [f"{query} (stream {i})" for i, query in enumerate(queries[:args.stream_queries])]
+            report["stream"] = await bench_stream(client, api, stream_queries)
+
+            report["memory"] = {
+                "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                "vector_index_bytes": vector_index.memory_bytes,
+                "lexical_index_bytes": lexical_index.memory_bytes
+            }
+
+            if not args.keep:
+                for document_id in document_ids:
+                    await client.delete(f"{api}/documents/{document_id}")
+    finally:
+        app_server.should_exit = True
+        app_thread.join()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--doc-kb", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--stream-queries", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0)
+    parser.add_argument("--embedding-per-text-ms", type=float, default=0.2)
+    parser.add_argument("--chat-latency-ms", type=float, default=200.0)
+    parser.add_argument("--token-latency-ms", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the uploaded documents")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    server = start_server(
+        dim=args.dim,
+        embedding_latency_ms=args.embedding_latency_ms,
+        embedding_per_text_ms=args.embedding_per_text_ms,
+        chat_latency_ms=args.chat_latency_ms,
+        token_latency_ms=args.token_latency_ms
+    )
+    # POINT THE APP AT THE FAKE SERVER BEFORE ANY app MODULE READS ITS SETTINGS
+    os.environ["OPENAI_BASE_URL"] = base_url(server)
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["EMBEDDING_CHECK_CTX_LENGTH"] = "false"
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "args": vars(args)
+        },
+        **asyncio.run(run(args, server))
+    }
+    server.shutdown()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Peak memory and DB round-trips of document ingestion as the upload grows.
+
+Compares the old whole-file path (read, decode, split everything, one ORM
+object per chunk) with the streamed path used by the ingestion worker
+(incremental decode, windowed splitting, one bulk insert per embedding
+round). Embeddings come from a local deterministic stub so no API calls
+are made. DB round-trips are only measured when DATABASE_URL points at a
+reachable Postgres; every insert is rolled back.
+
+    python -m benchmarks.upload_scaling --sizes-mb 1 4 16
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import tracemalloc
+import uuid
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import numpy as np
+from sqlalchemy import event
+
+from app.config import settings
+from app.core.document_processor import DocumentProcessor, iter_decoded
+
+
+class StubEmbeddings:
+
+    # DETERMINISTIC VECTORS SEEDED FROM THE TEXT, NO NETWORK
+
+    def __init__(self, dim: int = 1536):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vectors.append(np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32).tolist())
+        return vectors
+
+
+def make_document(size_bytes: int) -> bytes:
+    rng = np.random.default_rng(0)
+    words = ["latency", "throughput", "index", "vector", "chunk", "embedding", "query", "answer",
+             "document", "context", "retrieval", "postgres", "cache", "stream", "batch", "token"]
+    parts, total = [], 0
+    while total < size_bytes:
+        paragraph = " ".join(rng.choice(words, size=int(rng.integers(40, 120)))) + ".\n\n"
+        parts.append(paragraph)
+        total += len(paragraph)
+    return "".join(parts).encode("utf-8")[:size_bytes]
+
+
+def run_whole_file(processor: DocumentProcessor, raw: bytes, db=None) -> int:
+    from app.db.models import DocumentChunk
+    from app.db.vector_codec import encode_embedding
+
+    text = io.BytesIO(raw).read().decode("utf-8")
+    chunks_data = processor.process_document(text, uuid.uuid4())
+    if db is not None:
+        document_id = _create_document(db)
+        db_chunks = [
+            DocumentChunk(
+                document_id=document_id,
+                chunk_index=idx,
+                content=chunk["content"],
+                embedding=encode_embedding(chunk["embedding"]),
+                embedding_dim=len(chunk["embedding"]),
+                chunk_metadata=chunk["metadata"]
+            )
+            for idx, chunk in enumerate(chunks_data)
+        ]
+        db.add_all(db_chunks)
+        db.flush()
+        for chunk in db_chunks:
+            db.refresh(chunk)
+    return len(chunks_data)
+
+
+def run_streamed(processor: DocumentProcessor, raw: bytes, db=None) -> int:
+    from app.db.crud import ChunkRepository
+
+    document_id = _create_document(db) if db is not None else uuid.uuid4()
+    embedded = 0
+    stream = iter_decoded(io.BytesIO(raw), read_size=settings.UPLOAD_READ_SIZE)
+    for chunks_data in processor.process_stream(stream, document_id):
+        if db is not None:
+            ChunkRepository.create_chunks(db, document_id, chunks_data, start_index=embedded, commit=False)
+        embedded += len(chunks_data)
+    return embedded
+
+
+def _create_document(db) -> uuid.UUID:
+    from app.db.models import Document
+
+    document = Document(title="benchmark")
+    db.add(document)
+    db.flush()
+    return document.id
+
+
+def measure(fn, processor, raw, session_factory):
+    db = session_factory() if session_factory else None
+    statements = {"count": 0}
+
+    def count_statement(*args, **kwargs):
+        statements["count"] += 1
+
+    if db is not None:
+        connection = db.connection()
+        event.listen(connection, "before_cursor_execute", count_statement)
+
+    tracemalloc.start()
+    try:
+        chunks = fn(processor, raw, db)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        if db is not None:
+            event.remove(connection, "before_cursor_execute", count_statement)
+            db.rollback()
+            db.close()
+
+    return {
+        "chunks": chunks,
+        "peak_mb": round(peak / 2 ** 20, 2),
+        "db_round_trips": statements["count"] if db is not None else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--no-db", action="store_true", help="skip DB round-trip measurement")
+    args = parser.parse_args()
+
+    session_factory = None
+    if not args.no_db and settings.DATABASE_URL:
+        from app.db.database import SessionLocal
+        session_factory = SessionLocal
+
+    processor = DocumentProcessor(cache=None)
+    processor.embeddings = StubEmbeddings()
+
+    results = []
+    for size_mb in args.sizes_mb:
+        raw = make_document(int(size_mb * 2 ** 20))
+        results.append({
+            "size_mb": size_mb,
+            "whole_file": measure(run_whole_file, processor, raw, session_factory),
+            "streamed": measure(run_streamed, processor, raw, session_factory)
+        })
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
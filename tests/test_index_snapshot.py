@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+import uuid
+
+import numpy as np
+
+from app.db.models import Document, DocumentChunk
+from app.db.vector_codec import encode_embedding
+from app.core.index_snapshot import SnapshotStore
+from app.core.lexical_index import LexicalIndex
+from app.core.vector_index import VectorIndex
+
+WORDS = ["alpha", "beta", "gamma", "delta", "max_connections", "ERR-1042", "v2.3.1", "omega"]
+# FILLER, SO FEW CHUNKS TIE ON A QUERY'S SCORE
+VOCABULARY = WORDS + [f"term{i}" for i in range(200)]
+
+
+def add_document(db, rng, chunks: int, created_at: datetime) -> uuid.UUID:
+    document = Document(id=uuid.uuid4(), title="doc")
+    db.add(document)
+    for i in range(chunks):
+        embedding = rng.normal(size=16).astype(np.float32)
+        db.add(DocumentChunk(
+            id=uuid.uuid4(),
+            document_id=document.id,
+            chunk_index=i,
+            content=" ".join(rng.choice(VOCABULARY, size=int(rng.integers(10, 60)))),
+            embedding=encode_embedding(embedding),
+            embedding_dim=16,
+            created_at=created_at
+        ))
+    db.commit()
+    return document.id
+
+
+def delete_document(db, document_id: uuid.UUID) -> None:
+    db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).delete()
+    db.query(Document).filter(Document.id == document_id).delete()
+    db.commit()
+
+
+def test_snapshot_replay_matches_rebuild(db, tmp_path):
+    rng = np.random.default_rng(0)
+    saved_at = datetime.utcnow() - timedelta(hours=1)
+    documents = [add_document(db, rng, 20, saved_at - timedelta(hours=i)) for i in range(6)]
+
+    vectors = VectorIndex(quantization="none", snapshots=SnapshotStore(str(tmp_path / "vector"), "test"))
+    vectors.ensure_loaded(db)
+    vectors.save_snapshot(db)
+    lexical = LexicalIndex(snapshots=SnapshotStore(str(tmp_path / "lexical"), "test"))
+    lexical.ensure_loaded(db)
+    lexical.save_snapshot()
+
+    # CHANGES AFTER THE SNAPSHOT: ONE DOCUMENT DELETED, ONE ADDED
+    delete_document(db, documents[0])
+    add_document(db, rng, 8, datetime.utcnow())
+
+    vectors = VectorIndex(quantization="none", snapshots=SnapshotStore(str(tmp_path / "vector"), "test"))
+    vectors.ensure_loaded(db)
+    # ONLY WHAT CHANGED SINCE THE SNAPSHOT IS READ BACK FROM THE DATABASE
+    assert vectors.load_stats["source"] == "snapshot"
+    assert vectors.load_stats["replayed_documents"] == 1
+    assert vectors.load_stats["deleted_documents"] == 1
+    lexical = LexicalIndex(snapshots=SnapshotStore(str(tmp_path / "lexical"), "test"))
+    lexical.ensure_loaded(db)
+    assert lexical.load_stats["source"] == "snapshot"
+    assert lexical.load_stats["replayed_documents"] == 1
+
+    rebuilt_vectors = VectorIndex(quantization="none")
+    rebuilt_vectors.load(db)
+    rebuilt_lexical = LexicalIndex()
+    rebuilt_lexical.load(db)
+
+    assert vectors.size == rebuilt_vectors.size == 5 * 20 + 8
+    assert lexical.size == rebuilt_lexical.size
+    for _ in range(5):
+        query = rng.normal(size=16)
+        assert [hit[0] for hit in vectors.search(query, 10)] == [hit[0] for hit in rebuilt_vectors.search(query, 10)]
+    # EVERY MATCH, SO CHUNKS TIED ON A SCORE CANNOT FALL EITHER SIDE OF A CUTOFF
+    for query in WORDS + ["alpha beta connections"]:
+        scores = dict(lexical.search(query, lexical.size))
+        rebuilt_scores = dict(rebuilt_lexical.search(query, rebuilt_lexical.size))
+        assert scores.keys() == rebuilt_scores.keys()
+        assert np.allclose([scores[chunk_id] for chunk_id in scores], [rebuilt_scores[chunk_id] for chunk_id in scores])
@@ -0,0 +1,100 @@
+from collections import Counter
+import os
+
+from app.db.models import Document, DocumentChunk, IngestionJob
+from app.core.vector_index import vector_index
+from app.core.lexical_index import lexical_index
+
+
+def paragraph(i: int, word: str = "lorem") -> str:
+    return f"Paragraph {i}. " + f"{word} ipsum dolor {i} " * 40
+
+
+def ingest(db, worker, document, text, tmp_path):
+    source_path = tmp_path / f"{len(document.jobs)}.upload"
+    source_path.write_text(text, encoding="utf-8")
+    job = IngestionJob(document_id=document.id, status="queued", source_path=str(source_path))
+    db.add(job)
+    db.commit()
+
+    worker.submit(job.id)
+    # WAITS FOR THE JOB
+    worker.shutdown()
+
+    db.expire_all()
+    return db.get(IngestionJob, job.id)
+
+
+def stored_chunks(db, document):
+    return (
+        db.query(DocumentChunk)
+        .filter(DocumentChunk.document_id == document.id)
+        .order_by(DocumentChunk.chunk_index)
+        .all()
+    )
+
+
+def test_update_embeds_only_changed_chunks(db, worker, embeddings, tmp_path):
+    document = Document(title="handbook")
+    db.add(document)
+    db.commit()
+
+    paragraphs = [paragraph(i) for i in range(40)]
+    first = ingest(db, worker, document, "\n\n".join(paragraphs), tmp_path)
+    assert first.status == "completed"
+    old_chunks = stored_chunks(db, document)
+    old_ids = {chunk.content: chunk.id for chunk in old_chunks}
+
+    # ONE PARAGRAPH EDITED, ONE INSERTED, ONE DROPPED
+    edited = list(paragraphs)
+    edited[30] = paragraph(30, word="LOREM")
+    edited.insert(10, "A brand new paragraph. " * 30)
+    del edited[21]
+    new_text = "\n\n".join(edited)
+
+    expected = worker.processor.text_splitter.split_text(new_text)
+    matched = Counter(chunk.content for chunk in old_chunks) & Counter(expected)
+    reused = sum(matched.values())
+    assert 0 < reused < len(expected)
+
+    embeddings.texts = 0
+    second = ingest(db, worker, document, new_text, tmp_path)
+
+    assert second.status == "completed"
+    assert second.chunks_reused == reused
+    assert second.chunks_total == len(expected)
+    assert embeddings.texts == len(expected) - reused
+
+    chunks = stored_chunks(db, document)
+    assert [chunk.content for chunk in chunks] == expected
+    assert [chunk.chunk_index for chunk in chunks] == list(range(len(expected)))
+    # UNCHANGED TEXT KEEPS ITS ROW
+    assert sum(1 for chunk in chunks if old_ids.get(chunk.content) == chunk.id) == reused
+    assert vector_index.size == len(expected)
+    assert lexical_index.size == len(expected)
+    assert not os.path.exists(tmp_path / "1.upload")
+
+
+def test_failed_update_keeps_previous_version(db, worker, embeddings, tmp_path):
+    document = Document(title="handbook")
+    db.add(document)
+    db.commit()
+
+    first = ingest(db, worker, document, "\n\n".join(paragraph(i) for i in range(30)), tmp_path)
+    assert first.status == "completed"
+    before = [(chunk.id, chunk.chunk_index, chunk.content) for chunk in stored_chunks(db, document)]
+
+    # THE FIRST ROUNDS OF NEW CHUNKS ARE EMBEDDED AND INDEXED BEFORE THE PROVIDER FAILS
+    embeddings.calls = 0
+    embeddings.fail_after = 2
+    second = ingest(
+        db, worker, document, "\n\n".join(paragraph(i, word="changed") for i in range(30)), tmp_path
+    )
+
+    assert second.status == "failed"
+    assert "Embedding provider unavailable" in second.error
+    assert second.source_path is None
+    assert not os.path.exists(tmp_path / "1.upload")
+    assert [(chunk.id, chunk.chunk_index, chunk.content) for chunk in stored_chunks(db, document)] == before
+    assert vector_index.size == len(before)
+    assert lexical_index.size == len(before)